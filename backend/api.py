@@ -1,8 +1,29 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from langchain_community.document_loaders import PyPDFLoader
-from backend.rag_pipeline import generate_langchain_summary
-import tempfile, os
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.datastructures import Headers
+from langchain_core.documents import Document
+from pydantic import BaseModel
+from backend.rag_pipeline import (
+    aanswer_question, aexpand_line, agenerate_langchain_summary, astream_langchain_summary, batch_priority,
+    pipeline_fingerprint,
+)
+from backend.summary_cache import SummaryCache, make_cache_key
+from backend.summary_store import InvalidCursorError, SummaryStore, make_etag
+from backend.dedup import DedupIndex, minhash
+from backend.corpus import Corpus, note_passages
+from backend.doc_store import DocStore
+from backend.keywords import set_background
+from backend.ingest import aload_pdf_chunks, PDFIngestError
+from backend.governor import LLMUnavailableError
+from backend.uploads import MAX_UPLOAD_BYTES, Upload, receive_upload, upload_budget
+from backend.jobs import JobQueue, JobFailed, QueueFullError
+from backend.singleflight import EventFeed, SingleFlight
+from backend.tracing import request_trace, span
+from backend.metrics import REQUEST_SECONDS, render_metrics, token_tally
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import asyncio, os, json, logging, time
 
 app = FastAPI()
 app.add_middleware(
@@ -12,48 +33,692 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+logger = logging.getLogger("noterag")
+
+# Server-Timing: <stage>;dur=<ms> on every response (stages that finished
+# before the headers were sent; for streams that is upload/cache/parse)
+SERVER_TIMING = os.getenv("NOTERAG_SERVER_TIMING", "0") == "1"
+
+# multipart framing around one file; anything past this is payload
+MULTIPART_SLACK = 64 * 1024
+
+class RejectOversizedUpload:
+    # Refuses a POST body over the limit: by Content-Length before a byte of
+    # it is read, else (chunked, no length) as soon as that much has arrived,
+    # so the multipart parser never spools more than the limit to disk.
+    # Plain ASGI: an http middleware can't see the body as it arrives.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return await self.app(scope, receive, send)
+        files = BATCH_MAX_FILES if scope["path"] == "/api/simplify_pdf/batch" else 1
+        limit = files * (MAX_UPLOAD_BYTES + MULTIPART_SLACK)
+        detail = f"Upload is over the {limit}-byte limit."
+        length = Headers(scope=scope).get("content-length", "")
+        if length.isdigit() and int(length) > limit:
+            return await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+        received = 0
+
+        async def capped_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get("body", b""))
+            if received > limit:
+                # raised inside body parsing, so FastAPI answers it as a 413
+                raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, capped_receive, send)
+
+app.add_middleware(RejectOversizedUpload)
+
+@app.middleware("http")
+async def time_request(request: Request, call_next):
+    with request_trace() as trace:
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            route = request.scope.get("route")
+            elapsed = time.perf_counter() - started
+            REQUEST_SECONDS.observe(elapsed, path=getattr(route, "path", "unmatched"), status=str(status))
+    stages = trace.totals()
+    if SERVER_TIMING and stages:
+        response.headers["Server-Timing"] = ", ".join(
+            f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items()
+        )
+    logger.info("%s %s %d %.3fs %s", request.method, request.url.path, status, elapsed,
+                " ".join(f"{name}={seconds:.3f}" for name, seconds in stages.items()))
+    return response
+
+summary_cache = SummaryCache.from_env()
+# near-duplicate uploads (new footer date, re-exported slides) → earlier summary
+dedup_index = DedupIndex.from_env()
+# the same file uploaded again while its summary is still being made → wait for that one
+summary_flight = SingleFlight()
+# cache key -> events of a streaming run in summary_flight, for other streams to follow
+stream_feeds: Dict[str, EventFeed] = {}
+# every summarized note's chunks and summary lines, searchable by /api/ask
+corpus = Corpus.from_env()
+# local keyword scoring (NOTERAG_METADATA=local) weighs words against it
+set_background(corpus.document_frequencies)
+# every Summary returned, for listing and reopening notes (see summary_store.py)
+summary_store = SummaryStore.from_env()
+# chunks of lazily summarized documents, for /api/expand (see doc_store.py)
+doc_store = DocStore.from_env()
+# one run per (document, line) expansion, shared by a tap and a prefetch
+expand_flight = SingleFlight()
+
+# PDF parsing is pure-Python CPU work; run it in worker processes so it
+# neither blocks the event loop nor fights the request threads for the GIL.
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+PARSE_WORKERS = int(os.getenv("NOTERAG_PARSE_WORKERS", "0")) or os.cpu_count() or 1
+
+def get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        _parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+    return _parse_pool
+
+@app.on_event("shutdown")
+def shutdown_parse_pool():
+    if _parse_pool is not None:
+        _parse_pool.shutdown(cancel_futures=True)
+
+def build_summary_obj(summary_data: Dict) -> Dict:
+    # One Summary object matching your Swift struct
+    return {
+        "id":        1,
+        "title":     summary_data["title"],
+        "topic":     summary_data["topic"] or None,
+        "keywords":  summary_data["keywords"],
+        "lines":     summary_data["high_level"],
+        "expanded":  summary_data["expanded"],
+        # token counts / ratio when extractive pre-compression ran, else None
+        "compression": summary_data.get("compression"),
+        # {"chunks", "reused"} when the map step ran; reused chunks skipped the LLM
+        "chunk_reuse": summary_data.get("chunk_reuse"),
+    }
+
+def llm_error(e: Exception, where: str) -> HTTPException:
+    # rate limited past our retries, or the circuit is open → 503 with Retry-After
+    if isinstance(e, LLMUnavailableError):
+        logger.warning("LLM unavailable: %s", e)
+        headers = {"Retry-After": str(max(1, round(e.retry_after)))}
+    else:
+        logger.error("Error in %s", where, exc_info=e)
+        headers = None
+    return HTTPException(status_code=503, detail="AI service unavailable. Please try again later.", headers=headers)
+
+def ingest_error(e: PDFIngestError) -> HTTPException:
+    retry_after = getattr(e, "retry_after", None)
+    headers = {"Retry-After": str(retry_after)} if retry_after else None
+    return HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+
+async def read_upload(file: UploadFile, **kwargs) -> Upload:
+    # size/type checks, in-flight byte budget, chunked copy (see uploads.py)
+    try:
+        with span("upload_read"):
+            return await receive_upload(file, **kwargs)
+    except PDFIngestError as e:
+        raise ingest_error(e)
+
+async def parse_upload(upload: Upload) -> List[Document]:
+    # Parse the PDF into page-tagged chunks; page ranges are extracted in
+    # parallel in the parse pool. The upload's bytes are released after.
+    try:
+        with span("pdf_parse"):
+            return await aload_pdf_chunks(upload.source, get_parse_pool(), PARSE_WORKERS)
+    except PDFIngestError as e:
+        raise ingest_error(e)
+    finally:
+        await upload.release()
+
+def _near_duplicate(docs: List[Document], fingerprint: str):
+    if not dedup_index.enabled:
+        return None, None
+    signature = minhash("\n".join(d.page_content for d in docs))
+    match = dedup_index.lookup(signature, fingerprint)
+    if match is None:
+        return signature, None
+    cache_key, similarity = match
+    summary_data = summary_cache.get(cache_key)
+    if summary_data is not None:
+        logger.info("Near-duplicate upload (Jaccard ~%.2f); reusing its summary", similarity)
+    return signature, summary_data
+
+async def find_near_duplicate(docs: List[Document], fingerprint: str):
+    # (MinHash signature, stored summary of a near-identical document or
+    # None); hashing and both lookups run in a worker thread. The signature
+    # is None when matching is off or the text is too short to compare.
+    with span("dedup_lookup"):
+        return await asyncio.to_thread(_near_duplicate, docs, fingerprint)
+
+async def add_near_duplicate(docs: List[Document], signature, cache_key: str, fingerprint: str) -> None:
+    # index a new summary for find_near_duplicate; `signature` None hashes `docs`
+    if not dedup_index.enabled:
+        return
+    def add():
+        sig = signature if signature is not None else minhash("\n".join(d.page_content for d in docs))
+        dedup_index.add(sig, cache_key, fingerprint)
+    with span("dedup_add"):
+        await asyncio.to_thread(add)
+
+async def index_note(cache_key: str, docs: List[Document], summary_data: Dict) -> None:
+    # a failure here costs search coverage, not the response
+    try:
+        with span("corpus_index"):
+            await asyncio.to_thread(corpus.add_note, cache_key, summary_data["title"], note_passages(docs, summary_data))
+    except Exception:
+        logger.exception("Error adding note to the corpus")
+
+async def keep_summaries(items: List[Tuple[str, Dict, Optional[str], Optional[str]]]) -> List[Dict]:
+    # (cache key, summary data, folder or None, the file's sha256 or None) ->
+    # Summary objects with their stored id; the file's stored summary is
+    # updated in place, whatever its cache key. A failure here costs the
+    # listing, not the response
+    objs = [{**build_summary_obj(summary_data), "doc": key} for key, summary_data, _, _ in items]
+    try:
+        with span("summary_store"):
+            return await asyncio.to_thread(
+                summary_store.put_many,
+                [(key, obj, folder, content) for (key, _, folder, content), obj in zip(items, objs)],
+            )
+    except Exception:
+        logger.exception("Error storing summaries")
+        return objs
+
+async def keep_summary(key: str, summary_data: Dict, folder: Optional[str] = None,
+                       content: Optional[str] = None) -> Dict:
+    return (await keep_summaries([(key, summary_data, folder, content)]))[0]
+
+async def compute_summary(upload: Upload, cache_key: str, fingerprint: str) -> Dict:
+    # runs once per cache key at a time (see summarize_upload) and owns `upload`
+    try:
+        started = time.perf_counter()
+
+        # 3) Extract chunks from the PDF; nearly the same text → earlier result
+        docs = await parse_upload(upload)
+        signature, summary_data = await find_near_duplicate(docs, fingerprint)
+
+        # 4) Generate summary (stubbed or real)
+        with token_tally() as used:
+            if summary_data is None:
+                try:
+                    summary_data = await agenerate_langchain_summary(docs)
+                except Exception as e:
+                    raise llm_error(e, "generate_langchain_summary")
+                await add_near_duplicate(docs, signature, cache_key, fingerprint)
+
+        await asyncio.to_thread(summary_cache.put, cache_key, summary_data, time.perf_counter() - started, used[0])
+        await index_note(cache_key, docs, summary_data)
+        return summary_data
+    finally:
+        await upload.aclose()
+
+async def summarize_upload(upload: Upload) -> Dict:
+    # Takes ownership of `upload`. Identical uploads that arrive while one
+    # is being summarized share that computation; it keeps running if the
+    # client that started it goes away.
+    # 2) Same bytes + same prompts/model → reuse the earlier result
+    fingerprint = pipeline_fingerprint()
+    with span("cache_lookup"):
+        cache_key = make_cache_key(upload.sha256, fingerprint)
+        summary_data = await asyncio.to_thread(summary_cache.get, cache_key)
+    if summary_data is not None:
+        await upload.aclose()
+        return summary_data
+    task, started = summary_flight.claim(cache_key, lambda: compute_summary(upload, cache_key, fingerprint))
+    if not started:
+        await upload.aclose()          # someone else's run has these bytes already
+    return await summary_flight.wait(task)
+
+# ─── Lazy mode: the lines now, each expanded section on first request ────────
+# Most expanded sections are never opened, so with ?lazy=true the pipeline
+# stops after the lines and title/topic/keywords. The document's chunks stay
+# in doc_store under a handle (its summary cache key), and /api/expand makes
+# and caches one section at a time. Once every section exists, the full
+# summary goes in the summary cache like any other.
+LAZY_EXPAND = os.getenv("NOTERAG_LAZY_EXPAND", "0") == "1"
+EXPAND_PREFETCH = os.getenv("NOTERAG_EXPAND_PREFETCH", "0") == "1"
+
+def outline_key(doc: str) -> str:
+    return make_cache_key(doc, "outline")
+
+def expansion_key(doc: str, index: int) -> str:
+    return make_cache_key(doc, f"expanded:{index}")
+
+def lookup_doc(doc: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+    # (full summary, None) or (None, outline) or (None, None); blocking
+    summary_data = summary_cache.get(doc)
+    return summary_data, doc_store.summary(doc) if summary_data is None else None
+
+def with_expansions(doc: str, outline: Dict) -> Dict:
+    # the outline plus whichever sections have been made so far; blocking
+    parts = [summary_cache.get(expansion_key(doc, i)) for i in range(len(outline["high_level"]))]
+    return {
+        **outline,
+        "expanded": [part["points"] if part else [] for part in parts],
+        "sources": [part["sources"] if part else [] for part in parts],
+    }
+
+async def compute_outline(upload: Upload, doc: str, fingerprint: str) -> Dict:
+    # compute_summary without the expansions; owns `upload`
+    try:
+        started = time.perf_counter()
+        docs = await parse_upload(upload)
+        outline = await asyncio.to_thread(summary_cache.get, outline_key(doc))
+        if outline is None:
+            signature, summary_data = await find_near_duplicate(docs, fingerprint)
+            if summary_data is not None:
+                await asyncio.to_thread(summary_cache.put, doc, summary_data, time.perf_counter() - started)
+                await index_note(doc, docs, summary_data)
+                return summary_data
+            try:
+                with token_tally() as used:
+                    outline = await agenerate_langchain_summary(docs, expand=False)
+            except Exception as e:
+                raise llm_error(e, "generate_langchain_summary")
+            await asyncio.to_thread(summary_cache.put, outline_key(doc), outline, time.perf_counter() - started, used[0])
+            await index_note(doc, docs, outline)
+        with span("doc_store"):
+            await asyncio.to_thread(doc_store.put, doc, docs, outline)
+        return await asyncio.to_thread(with_expansions, doc, outline)
+    finally:
+        await upload.aclose()
+
+async def outline_upload(upload: Upload) -> Tuple[str, Dict]:
+    # Takes ownership of `upload`. Returns its handle and the full summary if
+    # one exists, else the outline with the sections made so far.
+    fingerprint = pipeline_fingerprint()
+    with span("cache_lookup"):
+        doc = make_cache_key(upload.sha256, fingerprint)
+        summary_data, outline = await asyncio.to_thread(lookup_doc, doc)
+    if summary_data is not None or outline is not None:
+        await upload.aclose()
+        return doc, summary_data or await asyncio.to_thread(with_expansions, doc, outline)
+    task, started = summary_flight.claim(outline_key(doc), lambda: compute_outline(upload, doc, fingerprint))
+    if not started:
+        await upload.aclose()
+    return doc, await summary_flight.wait(task)
+
+async def compute_expansion(doc: str, index: int) -> Dict:
+    entry = await asyncio.to_thread(doc_store.get, doc)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired document. Please upload it again.")
+    docs, outline = entry
+    started = time.perf_counter()
+    try:
+        with token_tally() as used:
+            part = await aexpand_line(docs, outline["high_level"][index], index)
+    except Exception as e:
+        raise llm_error(e, "aexpand_line")
+    await asyncio.to_thread(summary_cache.put, expansion_key(doc, index), part, time.perf_counter() - started, used[0])
+    summary_data = await asyncio.to_thread(with_expansions, doc, outline)
+    await keep_summary(doc, summary_data)
+    if all(summary_data["expanded"]):
+        # the last missing section: from now on this is an ordinary summary
+        await asyncio.to_thread(summary_cache.put, doc, summary_data)
+        await add_near_duplicate(docs, None, doc, pipeline_fingerprint())
+        await index_note(doc, docs, summary_data)
+    return part
+
+def prefetch_expansions(doc: str, summary_data: Dict) -> None:
+    # start every missing section in the background; a tap on one joins its run
+    for i, section in enumerate(summary_data["expanded"]):
+        if not section:
+            expand_flight.claim(expansion_key(doc, i), lambda i=i: compute_expansion(doc, i))
+
 @app.post("/api/simplify_pdf")
-async def simplify_pdf(file: UploadFile = File(...)):
+async def simplify_pdf(file: UploadFile = File(...), lazy: bool = LAZY_EXPAND, prefetch: bool = EXPAND_PREFETCH,
+                       folder: Optional[str] = None):
+    # lazy=true: the lines, title/topic/keywords and a "doc" handle now,
+    # "expanded" sections empty until fetched from /api/expand/{doc}/{index};
+    # prefetch=true starts making all of them in the background. The summary
+    # is stored under its id (in `folder`, if given) for /api/summaries.
     # 1) Read the uploaded PDF
-    contents = await file.read()
+    upload = await read_upload(file)
+    if lazy:
+        doc, summary_data = await outline_upload(upload)
+        if prefetch:
+            prefetch_expansions(doc, summary_data)
+        with span("response_build"):
+            return {"summaries": [await keep_summary(doc, summary_data, folder, upload.sha256)]}
+    doc = make_cache_key(upload.sha256, pipeline_fingerprint())
+    summary_data = await summarize_upload(upload)
+
+    # 5) Build one Summary object matching your Swift struct
+    with span("response_build"):
+        return {"summaries": [await keep_summary(doc, summary_data, folder, upload.sha256)]}
+
+@app.get("/api/expand/{doc}/{index}")
+async def expand_line(doc: str, index: int):
+    # {"doc", "index", "points", "sources"} for line `index` (0-based) of a
+    # summarized document; made on the first request for it, cached after
+    with span("cache_lookup"):
+        summary_data, outline = await asyncio.to_thread(lookup_doc, doc)
+    if summary_data is None and outline is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired document. Please upload it again.")
+    if not 0 <= index < len((summary_data or outline)["high_level"]):
+        raise HTTPException(status_code=404, detail="No such line.")
+    if summary_data is not None:
+        part = {"points": summary_data["expanded"][index], "sources": summary_data["sources"][index]}
+    else:
+        part = await asyncio.to_thread(summary_cache.get, expansion_key(doc, index))
+        if part is None:
+            task, _ = expand_flight.claim(expansion_key(doc, index), lambda: compute_expansion(doc, index))
+            part = await expand_flight.wait(task)
+    return {"doc": doc, "index": index, **part}
+
+# ─── Batch mode: many PDFs in one request ─────────────────────────────────────
+BATCH_MAX_FILES = int(os.getenv("NOTERAG_BATCH_MAX_FILES", "20"))
+
+@app.post("/api/simplify_pdf/batch")
+async def simplify_pdf_batch(files: List[UploadFile] = File(...), folder: Optional[str] = None):
+    # One entry per uploaded file, in order: {"filename", "summaries"} or
+    # {"filename", "status", "error"}. A bad PDF only fails its own entry.
+    # Every file goes the /api/simplify_pdf way on its own, all at once: its
+    # bytes are released as soon as it is parsed, so a file waiting on the
+    # byte budget waits for others to be parsed, not summarized, and the
+    # same file twice is summarized once (summary_flight). Throughput matches
+    # N concurrent requests (scripts/bench_batch.py); the gain is one round
+    # trip for the client.
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_FILES} files per batch.")
+
+    fingerprint = pipeline_fingerprint()
 
-    # 2) Write to a temp file so PyPDFLoader can read it
-    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-        tmp.write(contents)
-        tmp_path = tmp.name
+    async def summarize_file(f: UploadFile) -> Tuple[str, Dict, str]:
+        upload = await read_upload(f)
+        return make_cache_key(upload.sha256, fingerprint), await summarize_upload(upload), upload.sha256
 
+    with batch_priority():
+        outcomes = await asyncio.gather(*(summarize_file(f) for f in files), return_exceptions=True)
+    for i, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception) and not isinstance(outcome, HTTPException):
+            logger.error("Error summarizing batch file", exc_info=outcome)
+            outcomes[i] = HTTPException(status_code=500, detail="Internal error.")
+
+    with span("response_build"):
+        done = [outcome for outcome in outcomes if not isinstance(outcome, HTTPException)]
+        objs = iter(await keep_summaries([(k, summary_data, folder, sha) for k, summary_data, sha in done]))
+        results = []
+        for f, outcome in zip(files, outcomes):
+            if isinstance(outcome, HTTPException):
+                results.append({"filename": f.filename, "status": outcome.status_code, "error": outcome.detail})
+            else:
+                results.append({"filename": f.filename, "summaries": [next(objs)]})
+        return {"results": results}
+
+# ─── Job mode: submit now, poll for the result ────────────────────────────────
+async def run_summary_job(payload: Tuple[Upload, Optional[str]]) -> Dict:
+    upload, folder = payload
+    doc = make_cache_key(upload.sha256, pipeline_fingerprint())
     try:
-        # 3) Extract text from PDF
-        loader = PyPDFLoader(tmp_path)
-        docs = loader.load_and_split()
-        text = "\n".join(doc.page_content for doc in docs)
+        summary_data = await summarize_upload(upload)
+    except HTTPException as e:
+        raise JobFailed(e.status_code, e.detail)
+    return {"summaries": [await keep_summary(doc, summary_data, folder, upload.sha256)]}
 
-        # 4) Generate summary (stubbed or real)
+job_queue = JobQueue(
+    run_summary_job,
+    workers=int(os.getenv("NOTERAG_JOB_WORKERS", "2")),
+    max_pending=int(os.getenv("NOTERAG_JOB_QUEUE", "32")),
+    result_ttl=float(os.getenv("NOTERAG_JOB_TTL", "3600")),
+)
+
+@app.on_event("shutdown")
+async def shutdown_job_queue():
+    await job_queue.stop()
+
+def job_status(job: Dict) -> Dict:
+    return {k: v for k, v in job.items() if k != "result"}
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(response: Response, file: UploadFile = File(...), folder: Optional[str] = None):
+    # queued uploads wait on disk and don't count against the in-flight budget
+    upload = await read_upload(file, spool_bytes=0)
+    await upload.release()
+    try:
+        job = job_queue.submit((upload, folder))
+    except QueueFullError as e:
+        await upload.aclose()
+        raise HTTPException(
+            status_code=429,
+            detail="Too many documents in progress. Please retry later.",
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    response.headers["Location"] = f"/api/jobs/{job['id']}"
+    return job_status(job)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    return job_status(job)
+
+@app.get("/api/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job.")
+    if job["status"] == "failed":
+        raise HTTPException(status_code=job["error_status"], detail=job["error"])
+    if job["status"] != "done":
+        return JSONResponse(
+            status_code=202,
+            content=job_status(job),
+            headers={"Retry-After": str(job_queue.retry_after())},
+        )
+    return job["result"]
+
+async def replay_summary_events(summary_data: Dict) -> AsyncIterator[Dict]:
+    # cache hit: same event sequence as a live run, minus the tokens
+    if summary_data.get("compression"):
+        yield {"type": "compression", **summary_data["compression"]}
+    for i, line in enumerate(summary_data["high_level"]):
+        yield {"type": "line", "index": i, "text": line}
+    for i, section in enumerate(summary_data["expanded"]):
+        yield {"type": "expanded", "index": i, "points": section}
+    yield {"type": "meta", "title": summary_data["title"], "topic": summary_data["topic"],
+           "keywords": summary_data["keywords"]}
+    yield {"type": "done", "summary": summary_data}
+
+def encode_event(event: Dict, sse: bool) -> str:
+    data = json.dumps(event, ensure_ascii=False)
+    return f"event: {event['type']}\ndata: {data}\n\n" if sse else data + "\n"
+
+async def compute_summary_stream(docs: List[Document], signature, cache_key: str, fingerprint: str,
+                                 feed: EventFeed) -> Dict:
+    # compute_summary for a stream: the pipeline's events go to `feed` as they
+    # come, for every stream client following this run
+    try:
+        started = time.perf_counter()
+        summary_data = None
         try:
-            summary_data = generate_langchain_summary(text)
+            with token_tally() as used:
+                async for event in astream_langchain_summary(docs):
+                    feed.append(event)
+                    if event["type"] == "done":
+                        summary_data = event["summary"]
         except Exception as e:
-            print("Error in generate_langchain_summary:", e)
-            raise HTTPException(
-                status_code=503,
-                detail="AI service unavailable. Please try again later."
-            )
+            raise llm_error(e, "astream_langchain_summary")
+        await asyncio.to_thread(summary_cache.put, cache_key, summary_data, time.perf_counter() - started, used[0])
+        await add_near_duplicate(docs, signature, cache_key, fingerprint)
+        await index_note(cache_key, docs, summary_data)
+        return summary_data
+    finally:
+        stream_feeds.pop(cache_key, None)
+        feed.close()
 
-        # 5) Build one Summary object matching your Swift struct
-        summary_obj = {
-            "id":        1,
-            "title":     summary_data["high_level"][0] if summary_data["high_level"] else "",
-            "topic":     None,
-            "keywords":  ["summary",
-        "visual representation",
-        "attention",
-        "working memory",
-        "cognitive load"],
-            "lines":     summary_data["high_level"],
-            "expanded":  summary_data["expanded"]
-        }
-
-        return {"summaries": [summary_obj]}
+def claim_summary_stream(docs: List[Document], signature, cache_key: str, fingerprint: str) -> asyncio.Task:
+    # the run for `cache_key` in summary_flight, started as a stream if none is
+    def start():
+        feed = stream_feeds[cache_key] = EventFeed()
+        return compute_summary_stream(docs, signature, cache_key, fingerprint, feed)
+    task, _ = summary_flight.claim(cache_key, start)
+    return task
 
+@app.post("/api/simplify_pdf/stream")
+async def simplify_pdf_stream(request: Request, file: UploadFile = File(...), tokens: bool = True,
+                              folder: Optional[str] = None):
+    # Same pipeline as /api/simplify_pdf, but each piece is sent the moment it
+    # exists: the three lines first (optionally token by token), then every
+    # expanded section, then title/topic/keywords, then the usual response body
+    # as a final "summary" event. NDJSON by default, SSE when the client
+    # sends Accept: text/event-stream. Identical uploads share one run: a
+    # stream that joins a streaming run follows its events from the start,
+    # one that joins a non-streaming run gets its result replayed.
+    upload = await read_upload(file)
+    try:
+        fingerprint = pipeline_fingerprint()
+        with span("cache_lookup"):
+            cache_key = make_cache_key(upload.sha256, fingerprint)
+            summary_data = await asyncio.to_thread(summary_cache.get, cache_key)
+
+        # parse errors are still reported as plain HTTP errors, before streaming starts
+        docs = None
+        running = summary_flight.get(cache_key) if summary_data is None else None
+        if running is None and summary_data is None:
+            docs = await parse_upload(upload)
     finally:
-        # 6) Clean up the temp file
-        os.remove(tmp_path)
+        await upload.aclose()
+    if docs is not None:
+        signature, summary_data = await find_near_duplicate(docs, fingerprint)
+        if summary_data is not None:
+            await asyncio.to_thread(summary_cache.put, cache_key, summary_data)
+            await index_note(cache_key, docs, summary_data)
+        else:
+            running = claim_summary_stream(docs, signature, cache_key, fingerprint)
+    feed = stream_feeds.get(cache_key) if running is not None else None
+    if running is not None and feed is None:
+        summary_data = await summary_flight.wait(running)
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    async def events() -> AsyncIterator[str]:
+        try:
+            source = feed.follow() if feed is not None else replay_summary_events(summary_data)
+            async for event in source:
+                if event["type"] == "token" and not tokens:
+                    continue
+                if event["type"] != "done":
+                    yield encode_event(event, sse)
+            # a followed run is done once it is cached and indexed, not at its last event
+            done = await summary_flight.wait(running) if feed is not None else summary_data
+            yield encode_event({"type": "summary", "summaries": [await keep_summary(cache_key, done, folder, upload.sha256)]}, sse)
+        except HTTPException as e:
+            # the 200 is already on the wire; report the failure in-band
+            yield encode_event({"type": "error", "detail": e.detail}, sse)
+        except Exception:
+            logger.exception("Error in simplify_pdf_stream")
+            yield encode_event({"type": "error", "detail": "AI service unavailable. Please try again later."}, sse)
+
+    return StreamingResponse(events(), media_type="text/event-stream" if sse else "application/x-ndjson")
+
+# ─── Ask across notes ─────────────────────────────────────────────────────────
+class AskRequest(BaseModel):
+    question: str
+    k: int = 8
+    answer: bool = False                # also have the LLM answer from the passages
+    notes: Optional[List[str]] = None   # only search these notes
+
+@app.post("/api/ask")
+async def ask(req: AskRequest):
+    # Ranked passages from every processed note (BM25 candidates re-ranked by
+    # vector similarity), each with its note and page; with answer=true, an
+    # answer written from them whose [n] citations index into "passages".
+    k = min(max(req.k, 1), 50)
+    with span("corpus_search"):
+        hits = await asyncio.to_thread(corpus.search, req.question, k, req.notes)
+    if not req.answer:
+        return {"passages": hits}
+    if not hits:
+        return {"passages": [], "answer": None}
+    try:
+        answer = await aanswer_question(req.question, hits)
+    except Exception as e:
+        raise llm_error(e, "aanswer_question")
+    return {"passages": hits, "answer": answer}
+
+@app.delete("/api/notes/{note_key}", status_code=204)
+async def delete_note(note_key: str):
+    # drop a note from the search corpus
+    if not await asyncio.to_thread(corpus.delete_note, note_key):
+        raise HTTPException(status_code=404, detail="Unknown note.")
+    return Response(status_code=204)
+
+# ─── Stored summaries ─────────────────────────────────────────────────────────
+# Responses carry a strong ETag and Cache-Control: no-cache, so the app's
+# URLSession cache revalidates them with If-None-Match and gets a bodiless
+# 304 while nothing has changed.
+def not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match", "")
+    return header.strip() == "*" or etag in (t.strip().removeprefix("W/") for t in header.split(","))
+
+def conditional(request: Request, etag: str, content) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=content, headers=headers)
+
+@app.get("/api/summaries")
+async def list_summaries(request: Request, folder: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None):
+    # {"summaries": [...], "next_cursor"}: newest first, without lines or
+    # expanded sections; pass next_cursor back for the following page.
+    # folder="" lists the summaries not in any folder.
+    limit = min(max(limit, 1), 200)
+    try:
+        page, next_cursor = await asyncio.to_thread(summary_store.list, folder, limit, cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    etag = make_etag(folder if folder is not None else "\0all", str(limit), cursor or "", next_cursor or "",
+                     *(f"{s['id']}:{s['etag']}" for s in page))
+    return conditional(request, etag, {"summaries": page, "next_cursor": next_cursor})
+
+@app.get("/api/summaries/{summary_id}")
+async def get_summary(request: Request, summary_id: int):
+    # one stored Summary object, as /api/simplify_pdf returned it; a
+    # revalidation that still matches is answered without reading the body
+    etag = await asyncio.to_thread(summary_store.etag, summary_id)
+    if etag is None:
+        raise HTTPException(status_code=404, detail="Unknown summary.")
+    if not_modified(request, etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    found = await asyncio.to_thread(summary_store.get, summary_id)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Unknown summary.")
+    summary, etag = found
+    return conditional(request, etag, summary)
+
+@app.get("/api/folders")
+async def list_folders(request: Request):
+    # [{"name", "summaries"}] for the sidebar; "" holds the unfiled ones
+    folders = await asyncio.to_thread(summary_store.folders)
+    etag = make_etag(*(f"{f['name']}\0{f['summaries']}" for f in folders))
+    return conditional(request, etag, {"folders": folders})
+
+@app.get("/api/cache/stats")
+async def cache_stats():
+    # hit/miss counters plus the pipeline seconds and LLM tokens hits have skipped,
+    # how often the near-duplicate index found a match, upload bytes in flight,
+    # and how many requests joined an identical one already running. The
+    # SQLite-backed counts run off the event loop
+    cache, near_duplicates, corpus_stats, stored = await asyncio.gather(
+        asyncio.to_thread(summary_cache.stats), asyncio.to_thread(dedup_index.stats),
+        asyncio.to_thread(corpus.stats), asyncio.to_thread(summary_store.stats),
+    )
+    return {**cache, "near_duplicates": near_duplicates, "uploads": upload_budget.stats(),
+            "coalesced": summary_flight.stats(), "corpus": corpus_stats,
+            "doc_store": doc_store.stats(), "expansions": expand_flight.stats(),
+            "summary_store": stored}
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus text format: stage/request latency histograms, LLM calls and tokens
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
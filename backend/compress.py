@@ -0,0 +1,96 @@
+# compress.py
+#
+# Optional extractive pre-compression before the high-level summary call.
+# Sentences are embedded locally, ranked by TextRank over their cosine
+# similarity graph (or by closeness to the document centroid when there are
+# too many for a dense graph), and the best ones are kept, in their original
+# order, until the token budget is spent. Repeated headers/footers and tiny
+# fragments such as page numbers are dropped before ranking.
+
+import re
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from backend.retrieval import get_embedder
+
+# TextRank needs an n×n matrix; above this many sentences use centroid centrality
+MAX_GRAPH_SENTENCES = 2000
+MIN_SENTENCE_WORDS = 4
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n{2,}")
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English; close enough to pick a strategy
+    return len(text) // 4 + 1
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_END.split(text) if s.strip()]
+
+def textrank(vectors: np.ndarray, damping: float = 0.85, iterations: int = 50) -> np.ndarray:
+    sim = np.clip(vectors @ vectors.T, 0.0, None)
+    np.fill_diagonal(sim, 0.0)
+    out_weight = sim.sum(axis=1, keepdims=True)
+    # rows with no edges jump uniformly, like PageRank's dangling nodes
+    n = len(vectors)
+    transition = np.divide(sim, out_weight, out=np.full_like(sim, 1.0 / n), where=out_weight > 0)
+    scores = np.full(n, 1.0 / n, dtype=np.float64)
+    for _ in range(iterations):
+        updated = (1 - damping) / n + damping * (transition.T @ scores)
+        if np.abs(updated - scores).sum() < 1e-6:
+            return updated
+        scores = updated
+    return scores
+
+def centroid_scores(vectors: np.ndarray) -> np.ndarray:
+    centroid = vectors.mean(axis=0)
+    norm = np.linalg.norm(centroid)
+    return vectors @ (centroid / norm) if norm > 0 else np.zeros(len(vectors))
+
+def compress_documents(docs: List[Document], token_budget: int) -> Tuple[List[Document], Dict]:
+    """
+    Keeps the highest-ranked sentences of `docs` within `token_budget`.
+    Returns one Document per source chunk that kept anything (metadata
+    preserved) and a report with the token counts and compression ratio.
+    """
+    original_tokens = sum(estimate_tokens(d.page_content) for d in docs)
+
+    # (chunk index, sentence); drop exact repeats and fragments
+    seen = set()
+    sentences: List[Tuple[int, str]] = []
+    for i, doc in enumerate(docs):
+        for sentence in split_sentences(doc.page_content):
+            key = " ".join(sentence.lower().split())
+            if key in seen or len(key.split()) < MIN_SENTENCE_WORDS:
+                continue
+            seen.add(key)
+            sentences.append((i, sentence))
+
+    kept = [False] * len(sentences)
+    if sentences:
+        vectors = get_embedder().embed([s for _, s in sentences])
+        scores = textrank(vectors) if len(sentences) <= MAX_GRAPH_SENTENCES else centroid_scores(vectors)
+        used = 0
+        for j in np.argsort(-scores, kind="stable"):
+            cost = estimate_tokens(sentences[j][1])
+            if used + cost > token_budget:
+                continue
+            kept[j] = True
+            used += cost
+
+    by_chunk: Dict[int, List[str]] = {}
+    for (i, sentence), keep in zip(sentences, kept):
+        if keep:
+            by_chunk.setdefault(i, []).append(sentence)
+    out = [Document(page_content=" ".join(by_chunk[i]), metadata=dict(docs[i].metadata)) for i in sorted(by_chunk)]
+
+    compressed_tokens = sum(estimate_tokens(d.page_content) for d in out)
+    report = {
+        "original_tokens": original_tokens,
+        "compressed_tokens": compressed_tokens,
+        "tokens_saved": original_tokens - compressed_tokens,
+        "ratio": round(compressed_tokens / original_tokens, 4) if original_tokens else 1.0,
+    }
+    return out, report
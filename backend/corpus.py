@@ -0,0 +1,269 @@
+# corpus.py
+#
+# Search across every note ever processed. Each summarized document adds its
+# chunks (with page numbers) and its summary lines as passages to one SQLite
+# database. A query runs in two steps:
+#
+#   1. an FTS5 full-text index ranks passages by BM25 and keeps the top
+#      NOTERAG_CORPUS_CANDIDATES. Only the query's rarest terms go into the
+#      match, up to NOTERAG_CORPUS_POSTINGS passages' worth, so a question
+#      full of common words doesn't score half the corpus; those words
+#      still count in step 2.
+#   2. candidates are ordered by how much of the question they contain
+#      (query terms weighted by idf), then by the reciprocal-rank fusion
+#      of BM25 and cosine similarity to the query. The cosine uses int8
+#      vectors stored next to each passage (1 byte per dimension plus a
+#      scale), so no vector index has to be held in memory.
+#
+# Term document counts live in their own table (fts5vocab has to scan the
+# whole vocabulary for each lookup).
+#
+# Adding a note that is already there replaces it; deleting removes its
+# passages from both indexes.
+
+import collections
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from backend.retrieval import get_embedder
+
+_TOKEN = re.compile(r"[^\W_]+")
+# words common enough that matching them only makes BM25 slower
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has in is it its of on or that the this to was were what when "
+    "where which who why how with do does did can".split()
+)
+RRF_K = 60
+
+Passage = Tuple[Optional[int], str, str]        # (0-based page or None, kind, text)
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # per-row symmetric int8: row ≈ q * scale
+    scale = np.abs(vectors).max(axis=1) / 127.0
+    scale[scale == 0] = 1.0
+    q = np.round(vectors / scale[:, None]).astype(np.int8)
+    return q, scale.astype(np.float32)
+
+def tokenize(text: str) -> List[str]:
+    # close to FTS5's unicode61 tokenizer with remove_diacritics: lowercase,
+    # accents stripped, split on anything that isn't a letter or digit
+    text = text.lower()
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return _TOKEN.findall(text)
+
+def query_terms(text: str) -> List[str]:
+    return list(dict.fromkeys(t for t in tokenize(text) if t not in STOPWORDS))
+
+def note_passages(docs: List[Document], summary_data: Dict) -> List[Passage]:
+    # the chunks the summary was made from, plus its own lines
+    passages: List[Passage] = [(d.metadata.get("page"), "chunk", d.page_content) for d in docs]
+    passages.extend((None, "summary", line) for line in summary_data["high_level"])
+    for section in summary_data["expanded"]:
+        passages.extend((None, "summary", point) for point in section if point)
+    return passages
+
+
+class Corpus:
+    def __init__(self, path: Optional[str] = None, candidates: int = 200, postings: int = 20000, embedder=None):
+        self.candidates = candidates
+        self.postings = postings
+        self.embedder = embedder or get_embedder()
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS notes (
+                id         INTEGER PRIMARY KEY,
+                key        TEXT UNIQUE NOT NULL,
+                title      TEXT,
+                embedder   TEXT NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS passages (
+                id      INTEGER PRIMARY KEY,
+                note_id INTEGER NOT NULL REFERENCES notes(id),
+                page    INTEGER,
+                kind    TEXT NOT NULL,
+                text    TEXT NOT NULL,
+                vec     BLOB NOT NULL,
+                scale   REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS passages_note ON passages(note_id);
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                docs INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            -- no stemmer, so FTS5 terms are what tokenize() returns
+            CREATE VIRTUAL TABLE IF NOT EXISTS passages_fts USING fts5(
+                text, content='passages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+            );
+            CREATE TRIGGER IF NOT EXISTS passages_ai AFTER INSERT ON passages BEGIN
+                INSERT INTO passages_fts(rowid, text) VALUES (new.id, new.text);
+            END;
+            CREATE TRIGGER IF NOT EXISTS passages_ad AFTER DELETE ON passages BEGIN
+                INSERT INTO passages_fts(passages_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            END;
+            """
+        )
+        self._db.commit()
+
+    @classmethod
+    def from_env(cls) -> "Corpus":
+        # NOTERAG_CORPUS_PATH="" keeps the corpus in memory only
+        return cls(
+            path=os.getenv("NOTERAG_CORPUS_PATH", ".noterag_cache/corpus.sqlite3") or None,
+            candidates=int(os.getenv("NOTERAG_CORPUS_CANDIDATES", "200")),
+            postings=int(os.getenv("NOTERAG_CORPUS_POSTINGS", "20000")),
+        )
+
+    def _count_terms(self, texts: Sequence[str], sign: int) -> None:
+        counts = collections.Counter(t for text in texts for t in set(tokenize(text)))
+        self._db.executemany(
+            "INSERT INTO terms VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET docs = docs + excluded.docs",
+            [(term, sign * n) for term, n in counts.items()],
+        )
+
+    def _delete(self, key: str) -> bool:
+        row = self._db.execute("SELECT id FROM notes WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return False
+        texts = [text for (text,) in self._db.execute("SELECT text FROM passages WHERE note_id = ?", row)]
+        self._count_terms(texts, -1)
+        self._db.execute("DELETE FROM passages WHERE note_id = ?", row)
+        self._db.execute("DELETE FROM notes WHERE id = ?", row)
+        return True
+
+    def add_note(self, key: str, title: str, passages: Sequence[Passage]) -> int:
+        # embedding happens outside the lock; only the writes are serialized
+        vectors, scales = quantize(self.embedder.embed([text for _, _, text in passages]))
+        with self._lock:
+            self._delete(key)
+            self._count_terms([text for _, _, text in passages], 1)
+            cur = self._db.execute(
+                "INSERT INTO notes (key, title, embedder, created_at) VALUES (?, ?, ?, ?)",
+                (key, title, self.embedder.fingerprint, time.time()),
+            )
+            self._db.executemany(
+                "INSERT INTO passages (note_id, page, kind, text, vec, scale) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (cur.lastrowid, page, kind, text, vec.tobytes(), float(scale))
+                    for (page, kind, text), vec, scale in zip(passages, vectors, scales)
+                ],
+            )
+            self._db.commit()
+        return len(passages)
+
+    def delete_note(self, key: str) -> bool:
+        with self._lock:
+            found = self._delete(key)
+            self._db.commit()
+        return found
+
+    def document_frequencies(self, words: Sequence[str]) -> Tuple[Dict[str, int], int]:
+        # passages containing each word (split as tokenize() splits it, the
+        # rarest piece counts) and about how many passages there are in all
+        pieces = {w: tokenize(w) for w in words}
+        wanted = sorted({p for ps in pieces.values() for p in ps})
+        counts: Dict[str, int] = {}
+        with self._lock:
+            for n in range(0, len(wanted), 500):
+                batch = wanted[n:n + 500]
+                counts.update(self._db.execute(
+                    f"SELECT term, docs FROM terms WHERE term IN ({','.join('?' * len(batch))})", batch
+                ))
+            (total,) = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM passages").fetchone()
+        return {w: min((counts.get(p, 0) for p in ps), default=0) for w, ps in pieces.items()}, total
+
+    def search(self, query: str, k: int = 8, notes: Optional[Sequence[str]] = None) -> List[Dict]:
+        """
+        Best `k` passages for `query`, optionally only from the notes with
+        the given keys. Each hit: note key and title, 1-based page (None for
+        summary lines), kind, text, the share of the question it covers,
+        and the fused BM25/vector score.
+        """
+        terms = query_terms(query)
+        if not terms:
+            return []
+        counts, total = self.document_frequencies(terms)
+        # rarest first, until the postings budget is spent (always at least
+        # one); a term in no passage costs nothing to include
+        chosen, budget = [], self.postings
+        for term in sorted(counts, key=counts.get):
+            if chosen and counts[term] > budget:
+                break
+            chosen.append(term)
+            budget -= counts[term]
+        if not chosen:
+            return []
+        # each term quoted, so FTS5 syntax in the question is inert
+        match = " OR ".join(f'"{t}"' for t in chosen)
+        sql = "SELECT rowid FROM passages_fts WHERE passages_fts MATCH ?"
+        params: List = [match]
+        if notes:
+            sql += (" AND rowid IN (SELECT p.id FROM passages p JOIN notes n ON n.id = p.note_id"
+                    f" WHERE n.key IN ({','.join('?' * len(notes))}))")
+            params.extend(notes)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(self.candidates)
+        with self._lock:
+            ids = [rowid for (rowid,) in self._db.execute(sql, params)]
+            rows = self._db.execute(
+                f"""
+                SELECT p.id, n.key, n.title, p.page, p.kind, p.text, p.vec, p.scale
+                FROM passages p JOIN notes n ON n.id = p.note_id
+                WHERE p.id IN ({','.join('?' * len(ids))})
+                """,
+                ids,
+            ).fetchall() if ids else []
+        if not rows:
+            return []
+
+        by_id = {row[0]: row for row in rows}
+        rows = [by_id[i] for i in ids if i in by_id]            # BM25 order
+        vectors = np.frombuffer(b"".join(row[6] for row in rows), dtype=np.int8).reshape(len(rows), -1)
+        scales = np.array([row[7] for row in rows], dtype=np.float32)
+        cosine = (vectors.astype(np.float32) @ self.embedder.embed([query])[0]) * scales
+        vector_rank = np.empty(len(rows), dtype=np.int64)
+        vector_rank[np.argsort(-cosine)] = np.arange(len(rows))
+        fused = 1.0 / (RRF_K + np.arange(len(rows)) + 1) + 1.0 / (RRF_K + vector_rank + 1)
+
+        idf = {t: math.log(1 + total / (1 + counts[t])) for t in terms}
+        wanted: Set[str] = set(terms)
+        coverage = np.array([
+            sum(idf[t] for t in wanted.intersection(tokenize(row[5]))) for row in rows
+        ]) / sum(idf.values())
+
+        hits = []
+        for i in np.lexsort((-fused, -np.round(coverage, 3)))[:k]:
+            _, key, title, page, kind, text, _, _ = rows[i]
+            hits.append({
+                "note": key,
+                "title": title,
+                "page": page + 1 if page is not None else None,
+                "kind": kind,
+                "text": text,
+                "coverage": round(float(coverage[i]), 3),
+                "score": round(float(fused[i]), 6),
+            })
+        return hits
+
+    def stats(self) -> Dict:
+        with self._lock:
+            (notes,) = self._db.execute("SELECT COUNT(*) FROM notes").fetchone()
+            (passages,) = self._db.execute("SELECT COUNT(*) FROM passages").fetchone()
+        return {"notes": notes, "passages": passages}
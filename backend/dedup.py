@@ -0,0 +1,179 @@
+# dedup.py
+#
+# Near-duplicate detection for uploads that differ from an earlier one by a
+# little (re-exported slides, a new date in the footer). Each document gets
+# a MinHash signature over shingles of its normalized text; signatures are
+# banded into an LSH index in SQLite, so a lookup touches only the few
+# documents that share a band instead of scanning all of them. A candidate
+# whose estimated Jaccard similarity clears the threshold hands back the
+# cache key of its stored summary. Documents with almost no text (scanned or
+# image-only PDFs) get no signature and are never matched: with nothing to
+# hash, they would all look identical.
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 16                  # 16 bands × 8 rows: ~50% chance to collide at J=0.71, ~99% at J=0.9
+ROWS = NUM_PERM // BANDS
+SHINGLE_CHARS = 24          # ~4 words, starting at a word boundary
+MIN_SHINGLES = 32           # fewer: too little text to tell documents apart
+_BLOCK = 8192               # shingles hashed per step; bounds memory at NUM_PERM × _BLOCK
+
+# fixed seeds: signatures must compare across processes and restarts
+_rng = np.random.default_rng(0x6E6F7465)
+_A = (_rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64) << np.uint64(1)) | np.uint64(1)   # odd multipliers
+_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+_BAND_MIX = _rng.integers(0, 2**63, ROWS, dtype=np.uint64) | np.uint64(1)
+with np.errstate(over="ignore"):
+    _POWERS = np.cumprod(np.full(SHINGLE_CHARS, 1099511628211, dtype=np.uint64))[::-1]
+
+
+def shingle_hashes(text: str) -> np.ndarray:
+    # 64-bit polynomial hash of the SHINGLE_CHARS bytes after every word start
+    normalized = " ".join(text.lower().split()).encode("utf-8")
+    data = np.frombuffer(normalized, dtype=np.uint8)
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    starts = np.flatnonzero(np.concatenate(([True], data[:-1] == ord(" "))))
+    padded = np.concatenate((data, np.zeros(SHINGLE_CHARS, dtype=np.uint8)))
+    windows = np.lib.stride_tricks.sliding_window_view(padded, SHINGLE_CHARS)[starts]
+    # Σ byte·P^k mod 2^64; repeats don't change a minimum, so no dedupe pass
+    with np.errstate(over="ignore"):
+        return (windows.astype(np.uint64) * _POWERS).sum(axis=1, dtype=np.uint64)
+
+def minhash(text: str) -> Optional[np.ndarray]:
+    """
+    NUM_PERM-value MinHash signature (uint32), or None if the text has
+    fewer than MIN_SHINGLES shingles. Each "permutation" is a multiply-shift
+    hash, (a·x + b) mod 2^64 >> 32, applied to all shingles at once; blocks
+    keep the intermediate matrix small.
+    """
+    shingles = shingle_hashes(text)
+    if len(shingles) < MIN_SHINGLES:
+        return None
+    sig = np.full(NUM_PERM, np.iinfo(np.uint32).max, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        for start in range(0, len(shingles), _BLOCK):
+            block = shingles[start:start + _BLOCK]
+            hashed = (_A[:, None] * block[None, :] + _B[:, None]) >> np.uint64(32)
+            np.minimum(sig, hashed.min(axis=1), out=sig)
+    return sig.astype(np.uint32)
+
+def jaccard_estimate(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.mean(a == b))
+
+def band_keys(sig: np.ndarray) -> List[int]:
+    # one signed 63-bit key per band; the band number is mixed in so equal
+    # rows in different bands don't collide
+    rows = sig.astype(np.uint64).reshape(BANDS, ROWS)
+    with np.errstate(over="ignore"):
+        mixed = (rows * _BAND_MIX[None, :]).sum(axis=1, dtype=np.uint64)
+        mixed = mixed * np.uint64(0x9E3779B97F4A7C15) + np.arange(BANDS, dtype=np.uint64)
+    return [int(k) for k in (mixed >> np.uint64(1)).astype(np.int64)]
+
+
+class DedupIndex:
+    """
+    LSH index of MinHash signatures. Each entry remembers the cache key of
+    the summary it stands for and the pipeline fingerprint it was made
+    under; lookups only match entries with the current fingerprint.
+    """
+
+    def __init__(self, path: Optional[str] = None, threshold: float = 0.85):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "matches": 0, "candidates": 0, "added": 0, "too_short": 0}
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")    # an index, not a record: losing the tail is fine
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS docs (
+                id          INTEGER PRIMARY KEY,
+                cache_key   TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                signature   BLOB NOT NULL,
+                created_at  REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS bands (
+                key    INTEGER NOT NULL,
+                doc_id INTEGER NOT NULL,
+                PRIMARY KEY (key, doc_id)
+            ) WITHOUT ROWID;
+            """
+        )
+        self._db.commit()
+
+    @classmethod
+    def from_env(cls) -> "DedupIndex":
+        # NOTERAG_DEDUP_PATH="" keeps the index in memory only;
+        # NOTERAG_DEDUP_THRESHOLD=0 turns near-duplicate matching off
+        return cls(
+            path=os.getenv("NOTERAG_DEDUP_PATH", ".noterag_cache/dedup.sqlite3") or None,
+            threshold=float(os.getenv("NOTERAG_DEDUP_THRESHOLD", "0.85")),
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def lookup(self, sig: Optional[np.ndarray], fingerprint: str) -> Optional[Tuple[str, float]]:
+        # (cache key, estimated Jaccard) of the most similar entry above the
+        # threshold; a None signature (too little text) matches nothing
+        if not self.enabled:
+            return None
+        if sig is None:
+            with self._lock:
+                self._counters["too_short"] += 1
+            return None
+        keys = band_keys(sig)
+        with self._lock:
+            self._counters["lookups"] += 1
+            rows = self._db.execute(
+                f"""
+                SELECT d.cache_key, d.signature FROM docs d
+                WHERE d.fingerprint = ? AND d.id IN (
+                    SELECT doc_id FROM bands WHERE key IN ({",".join("?" * len(keys))})
+                )
+                """,
+                (fingerprint, *keys),
+            ).fetchall()
+            self._counters["candidates"] += len(rows)
+        best: Optional[Tuple[str, float]] = None
+        for cache_key, blob in rows:
+            score = jaccard_estimate(sig, np.frombuffer(blob, dtype=np.uint32))
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (cache_key, score)
+        if best is not None:
+            with self._lock:
+                self._counters["matches"] += 1
+        return best
+
+    def add(self, sig: Optional[np.ndarray], cache_key: str, fingerprint: str) -> None:
+        if not self.enabled or sig is None:
+            return
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO docs (cache_key, fingerprint, signature, created_at) VALUES (?, ?, ?, ?)",
+                (cache_key, fingerprint, sig.astype(np.uint32).tobytes(), time.time()),
+            )
+            self._db.executemany(
+                "INSERT OR IGNORE INTO bands VALUES (?, ?)", [(k, cur.lastrowid) for k in band_keys(sig)]
+            )
+            self._db.commit()
+            self._counters["added"] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out = dict(self._counters)
+            (out["entries"],) = self._db.execute("SELECT COUNT(*) FROM docs").fetchone()
+        out["threshold"] = self.threshold
+        return out
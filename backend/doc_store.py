@@ -0,0 +1,98 @@
+# doc_store.py
+#
+# Parsed chunks of recently summarized documents, for lazy expansion: when
+# /api/simplify_pdf?lazy=true returns only the three lines, the expansion
+# of a line is made later (/api/expand) from these chunks, without parsing
+# the PDF again. Each document is one zlib-compressed JSON blob next to its
+# (uncompressed, small) outline summary, in an LRU bounded by total bytes;
+# entries also expire after a TTL. In memory only: after a restart or an
+# eviction the client uploads the file again.
+
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+
+class DocStore:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl_seconds: float = 24 * 3600):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # key -> (compressed chunks, outline summary, size in bytes, uncompressed chunk bytes, expires_at)
+        self._entries: "OrderedDict[str, Tuple[bytes, Dict, int, int, float]]" = OrderedDict()
+        self._bytes = 0
+        self._raw_bytes = 0
+        self._counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls) -> "DocStore":
+        return cls(
+            max_bytes=int(os.getenv("NOTERAG_DOC_STORE_BYTES", str(64 * 1024 * 1024))),
+            ttl_seconds=float(os.getenv("NOTERAG_DOC_STORE_TTL", str(24 * 3600))),
+        )
+
+    def _drop(self, key: str) -> None:
+        _, _, size, raw, _ = self._entries.pop(key)
+        self._bytes -= size
+        self._raw_bytes -= raw
+
+    def _entry(self, key: str):
+        # caller holds the lock; refreshes LRU order, drops expired entries
+        entry = self._entries.get(key)
+        if entry is not None and entry[4] < time.time():
+            self._drop(key)
+            entry = None
+        if entry is None:
+            self._counters["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._counters["hits"] += 1
+        return entry
+
+    def put(self, key: str, docs: List[Document], summary: Dict) -> None:
+        raw = json.dumps([[d.page_content, d.metadata] for d in docs], ensure_ascii=False).encode("utf-8")
+        blob = zlib.compress(raw, 6)
+        size = len(blob) + len(json.dumps(summary, ensure_ascii=False))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (blob, summary, size, len(raw), time.time() + self.ttl_seconds)
+            self._bytes += size
+            self._raw_bytes += len(raw)
+            self._counters["stores"] += 1
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def summary(self, key: str) -> Optional[Dict]:
+        # the outline only, without decompressing the chunks
+        with self._lock:
+            entry = self._entry(key)
+        return entry[1] if entry is not None else None
+
+    def get(self, key: str) -> Optional[Tuple[List[Document], Dict]]:
+        with self._lock:
+            entry = self._entry(key)
+        if entry is None:
+            return None
+        chunks = json.loads(zlib.decompress(entry[0]))
+        return [Document(page_content=text, metadata=metadata) for text, metadata in chunks], entry[1]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                **self._counters,
+                "docs": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                # what the stored chunks would take uncompressed
+                "raw_bytes": self._raw_bytes,
+            }
@@ -0,0 +1,495 @@
+# governor.py
+#
+# One gate in front of every LLM call, shared by all requests in the
+# process (get_llm() wraps the chat model in it). Each call:
+#
+#   1. fails fast if the circuit breaker is open (the provider looks down)
+#   2. waits its turn in two token buckets: requests/min and tokens/min
+#   3. waits for a slot under an adaptive (AIMD) concurrency limit
+#   4. runs with a deadline; rate-limit and transient errors are retried
+#      with full-jitter exponential backoff, anything else is raised as is
+#
+# The concurrency limit grows by ~1 per limit-worth of healthy calls and is
+# cut by 30% on a 429, a timeout, or when recent latency runs well above
+# the long-run average, so it settles just under what the provider will
+# take. A 429's Retry-After also pauses both buckets, so the waiting
+# requests don't all retry at once.
+#
+# Waiting calls get slots in arrival order, except inside stage_priority():
+# there a call queues as if it had arrived a few average call latencies
+# later the further its document is through the pipeline (batch mode, where
+# only the last document to finish matters).
+#
+#   NOTERAG_LLM_RPM / NOTERAG_LLM_TPM        0 = unlimited
+#   NOTERAG_LLM_CONCURRENCY                  starting limit (adapts between 1 and the max)
+#   NOTERAG_LLM_MAX_CONCURRENCY              ceiling for the adaptive limit (default 64)
+#   NOTERAG_LLM_RETRIES, NOTERAG_LLM_TIMEOUT
+#   NOTERAG_LLM_BREAKER_FAILURES, NOTERAG_LLM_BREAKER_COOLDOWN
+#   NOTERAG_LLM_GOVERNOR=0                   call the model directly
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from backend.metrics import LLM_BREAKER_OPEN, LLM_CONCURRENCY_LIMIT, LLM_FAILFAST, LLM_RETRIES
+from backend.tracing import current_stage
+
+logger = logging.getLogger("noterag")
+
+
+class LLMUnavailableError(Exception):
+    # the API turns this into 503 + Retry-After
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(LLMUnavailableError):
+    pass
+
+
+# ─── Error classification ─────────────────────────────────────────────────────
+RATE_LIMIT, TRANSIENT, FATAL = "rate_limit", "transient", "fatal"
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+def classify(exc: BaseException) -> str:
+    # by status code or class name, so no provider SDK has to be imported
+    status = _status_code(exc)
+    if status == 429 or type(exc).__name__ == "RateLimitError":
+        return RATE_LIMIT
+    if status is not None:
+        return TRANSIENT if status in (408, 409) or status >= 500 else FATAL
+    if isinstance(exc, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return TRANSIENT
+    name = type(exc).__name__
+    if "Timeout" in name or "Connection" in name or name in ("RemoteProtocolError", "ReadError", "WriteError"):
+        return TRANSIENT
+    return FATAL
+
+def retry_after_hint(exc: BaseException) -> Optional[float]:
+    hint = getattr(exc, "retry_after", None)
+    if hint is None:
+        headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+        hint = headers.get("retry-after")
+    try:
+        return float(hint) if hint is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+# ─── Pieces ───────────────────────────────────────────────────────────────────
+class TokenBucket:
+    """
+    `per_minute` units per minute, bursting to `burst`. reserve(n) debits
+    at once and returns how long the caller must wait before using them;
+    the balance may go negative, which queues later callers behind it.
+    """
+
+    def __init__(self, per_minute: float, burst: Optional[float] = None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst if burst is not None else per_minute / 6   # ~10 s worth
+        self._balance = self.capacity
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._balance = min(self.capacity, self._balance + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def reserve(self, amount: float) -> float:
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            self._balance -= amount
+            return max(0.0, -self._balance / self.rate)
+
+    def adjust(self, delta: float) -> None:
+        # settle an estimate against actual usage (delta > 0 returns units)
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._balance = min(self.capacity, self._balance + delta)
+
+    def pause(self, seconds: float) -> None:
+        # nothing more goes out for `seconds` (provider said Retry-After)
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill(time.monotonic())
+            self._balance = min(self._balance, -seconds * self.rate)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` consecutive transient errors; while open, calls
+    fail immediately. After `cooldown` seconds one probe call is let
+    through: success closes the circuit, failure reopens it. Calls that
+    arrive during the probe are refused too; the governor holds them
+    until the verdict instead.
+    """
+
+    def __init__(self, failures: int = 5, cooldown: float = 30.0):
+        self.failures = failures
+        self.cooldown = cooldown
+        self._count = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def probing(self) -> bool:
+        return self._probing
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if self._probing else "open"
+
+    def before(self) -> None:
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.cooldown - time.monotonic()
+            if remaining > 0 or self._probing:
+                raise CircuitOpenError("LLM provider unavailable (circuit open).", max(remaining, 1.0))
+            self._probing = True
+
+    def success(self) -> None:
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("LLM circuit closed")
+            self._count = 0
+            self._opened_at = None
+            self._probing = False
+            LLM_BREAKER_OPEN.set(0)
+
+    def failure(self) -> None:
+        with self._lock:
+            self._count += 1
+            if self._probing or (self._opened_at is None and self._count >= self.failures):
+                logger.warning("LLM circuit open for %.0fs after %d failures", self.cooldown, self._count)
+                self._opened_at = time.monotonic()
+                self._probing = False
+                LLM_BREAKER_OPEN.set(1)
+
+    def abandon(self) -> None:
+        # a probe that ended without a verdict (fatal error, cancellation)
+        with self._lock:
+            self._probing = False
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit driven by AIMD. acquire() waits for a slot, in
+    arrival order pushed back by `rounds` average call latencies;
+    release() reports the call's latency and whether the provider pushed
+    back, and moves the limit. Single event loop; release() is synchronous
+    so it can run in a finally during generator cleanup.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 64, tolerance: float = 2.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []     # heap
+        self._arrivals = itertools.count()
+        # short- and long-run latency averages; comparing the two rather than
+        # single calls keeps a mix of short and long prompts from looking
+        # like overload
+        self._short: Optional[float] = None
+        self._long: Optional[float] = None
+        self._last_cut = 0.0
+        LLM_CONCURRENCY_LIMIT.set(self.limit)
+
+    async def acquire(self, rounds: int = 0) -> None:
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (time.monotonic() + rounds * (self._long or 0.0), next(self._arrivals), waiter)
+        heapq.heappush(self._waiters, entry)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()          # granted just as we were cancelled
+            else:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = heapq.heappop(self._waiters)[-1]
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def release(self, latency: float, overloaded: bool) -> None:
+        now = time.monotonic()
+        if not overloaded:
+            if self._long is None:
+                self._short = self._long = latency
+            self._short += 0.2 * (latency - self._short)
+            self._long += 0.02 * (latency - self._long)
+            overloaded = self._short > self.tolerance * self._long
+        if overloaded:
+            # at most one cut per round trip, so one burst of errors is one signal
+            if now - self._last_cut > (self._long or latency):
+                self.limit = max(float(self.minimum), self.limit * 0.7)
+                self._last_cut = now
+        else:
+            self.limit = min(float(self.maximum), self.limit + 1.0 / self.limit)
+        LLM_CONCURRENCY_LIMIT.set(self.limit)
+        self._release_slot()
+
+
+# ─── Stage priority ───────────────────────────────────────────────────────────
+_stage_rounds: ContextVar[Optional[Dict[str, int]]] = ContextVar("noterag_stage_rounds", default=None)
+
+@contextmanager
+def stage_priority(rounds: Dict[str, int]) -> Iterator[None]:
+    """
+    LLM calls made inside (and in tasks started inside) queue behind others
+    by rounds[their tracing stage] average call latencies; other stages by 0.
+    """
+    token = _stage_rounds.set(rounds)
+    try:
+        yield
+    finally:
+        _stage_rounds.reset(token)
+
+def _queue_rounds() -> int:
+    rounds = _stage_rounds.get()
+    return rounds.get(current_stage(), 0) if rounds else 0
+
+
+# ─── Governor ─────────────────────────────────────────────────────────────────
+class Governor:
+    def __init__(
+        self,
+        rpm: float = 0,
+        tpm: float = 0,
+        concurrency: int = 16,
+        max_concurrency: int = 64,
+        retries: int = 4,
+        timeout: float = 120.0,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 30.0,
+        breaker_failures: int = 5,
+        breaker_cooldown: float = 30.0,
+        completion_tokens: int = 500,
+    ):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.limiter = AdaptiveLimiter(concurrency, maximum=max(concurrency, max_concurrency))
+        self.breaker = CircuitBreaker(breaker_failures, breaker_cooldown)
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.completion_tokens = completion_tokens
+
+    @classmethod
+    def from_env(cls, completion_tokens: int = 500) -> "Governor":
+        return cls(
+            rpm=float(os.getenv("NOTERAG_LLM_RPM", "0")),
+            tpm=float(os.getenv("NOTERAG_LLM_TPM", "0")),
+            concurrency=int(os.getenv("NOTERAG_LLM_CONCURRENCY", "16")),
+            max_concurrency=int(os.getenv("NOTERAG_LLM_MAX_CONCURRENCY", "64")),
+            retries=int(os.getenv("NOTERAG_LLM_RETRIES", "4")),
+            timeout=float(os.getenv("NOTERAG_LLM_TIMEOUT", "120")),
+            breaker_failures=int(os.getenv("NOTERAG_LLM_BREAKER_FAILURES", "5")),
+            breaker_cooldown=float(os.getenv("NOTERAG_LLM_BREAKER_COOLDOWN", "30")),
+            completion_tokens=completion_tokens,
+        )
+
+    def estimate(self, prompt_chars: int) -> int:
+        # ~4 chars per token, plus the most the completion may use
+        return prompt_chars // 4 + 1 + self.completion_tokens
+
+    def _admission_wait(self, estimate: int) -> float:
+        try:
+            self.breaker.before()
+        except CircuitOpenError:
+            LLM_FAILFAST.inc()
+            raise
+        return max(self.requests.reserve(1), self.tokens.reserve(estimate))
+
+    async def _aadmit(self, estimate: int) -> None:
+        # while a probe is out, wait for its verdict rather than refuse: if
+        # it succeeds, the whole request goes through, not just its first call
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                self.breaker.before()
+                break
+            except CircuitOpenError:
+                if not self.breaker.probing or time.monotonic() > deadline:
+                    LLM_FAILFAST.inc()
+                    raise
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(max(self.requests.reserve(1), self.tokens.reserve(estimate)))
+
+    def _backoff(self, attempt: int, hint: Optional[float]) -> float:
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        return max(delay, hint or 0.0)
+
+    def _failed(self, exc: BaseException, attempt: int) -> float:
+        """Book a failed attempt; returns the backoff delay or raises."""
+        kind = classify(exc)
+        if kind == FATAL:
+            self.breaker.abandon()
+            raise exc
+        hint = retry_after_hint(exc)
+        if kind == RATE_LIMIT:
+            # the provider is up, just busy: no breaker strike
+            self.breaker.abandon()
+            self.requests.pause(hint or self.backoff_base)
+            self.tokens.pause(hint or self.backoff_base)
+        else:
+            self.breaker.failure()
+        if attempt >= self.retries:
+            raise LLMUnavailableError(f"LLM call failed after {attempt + 1} attempts: {exc!r}",
+                                      hint or self.backoff_cap) from exc
+        LLM_RETRIES.inc(reason=kind)
+        return self._backoff(attempt, hint)
+
+    def _succeeded(self, result: Any, estimate: int) -> None:
+        self.breaker.success()
+        usage = (getattr(result, "llm_output", None) or {}).get("token_usage") or {}
+        if usage.get("total_tokens"):
+            self.tokens.adjust(estimate - usage["total_tokens"])
+
+    async def acall(self, call: Callable[[], Awaitable[Any]], estimate: int) -> Any:
+        for attempt in range(self.retries + 1):
+            await self._aadmit(estimate)
+            await self.limiter.acquire(_queue_rounds())
+            started = time.monotonic()
+            try:
+                result = await asyncio.wait_for(call(), self.timeout)
+            except Exception as e:
+                self.limiter.release(time.monotonic() - started, overloaded=classify(e) != FATAL)
+                delay = self._failed(e, attempt)
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.limiter.release(time.monotonic() - started, overloaded=False)
+                self.breaker.abandon()
+                raise
+            self.limiter.release(time.monotonic() - started, overloaded=False)
+            self._succeeded(result, estimate)
+            return result
+
+    async def astream(self, open_stream: Callable[[], AsyncIterator[Any]], estimate: int) -> AsyncIterator[Any]:
+        # retried only until the first chunk: after that the caller has
+        # already seen output, so an error is raised as is
+        for attempt in range(self.retries + 1):
+            await self._aadmit(estimate)
+            await self.limiter.acquire(_queue_rounds())
+            started = time.monotonic()
+            stream = open_stream()
+            yielded = False
+            outcome = None                     # None: consumer stopped early
+            try:
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        break
+                    yielded = True
+                    yield chunk
+                outcome = "ok"
+            except Exception as e:
+                outcome = e
+            finally:
+                overloaded = isinstance(outcome, Exception) and classify(outcome) != FATAL
+                self.limiter.release(time.monotonic() - started, overloaded)
+                if outcome is None:
+                    self.breaker.abandon()
+                await stream.aclose()
+            if outcome == "ok":
+                self._succeeded(None, estimate)
+                return
+            if yielded:
+                if classify(outcome) == TRANSIENT:
+                    self.breaker.failure()
+                raise outcome
+            await asyncio.sleep(self._failed(outcome, attempt))
+
+    def call(self, call: Callable[[], Any], estimate: int) -> Any:
+        # blocking calls: same buckets, retries and breaker, no concurrency limit
+        for attempt in range(self.retries + 1):
+            time.sleep(self._admission_wait(estimate))
+            try:
+                result = call()
+            except Exception as e:
+                time.sleep(self._failed(e, attempt))
+                continue
+            self._succeeded(result, estimate)
+            return result
+
+    def stats(self) -> dict:
+        return {
+            "concurrency_limit": round(self.limiter.limit, 2),
+            "in_flight": self.limiter.in_flight,
+            "waiting": len(self.limiter._waiters),
+            "breaker": self.breaker.state,
+        }
+
+
+def governed_chat_model(inner: Any, governor: Governor) -> Any:
+    """Wraps a LangChain chat model so every call goes through `governor`."""
+    from langchain_core.language_models import BaseChatModel
+
+    class GovernedChatModel(BaseChatModel):
+        inner: Any
+        governor: Any
+
+        @property
+        def _llm_type(self) -> str:
+            return self.inner._llm_type
+
+        def _estimate(self, messages) -> int:
+            return self.governor.estimate(sum(len(str(m.content)) for m in messages))
+
+        def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+            return self.governor.call(
+                lambda: self.inner._generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                self._estimate(messages),
+            )
+
+        async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+            return await self.governor.acall(
+                lambda: self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs),
+                self._estimate(messages),
+            )
+
+        async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+            stream = self.governor.astream(
+                lambda: self.inner._astream(messages, stop=stop, run_manager=run_manager, **kwargs),
+                self._estimate(messages),
+            )
+            async for chunk in stream:
+                yield chunk
+
+    return GovernedChatModel(inner=inner, governor=governor)
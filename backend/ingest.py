@@ -0,0 +1,177 @@
+# ingest.py
+#
+# Single-pass PDF ingestion. The upload is parsed straight from memory, each
+# page's text is extracted once and split on its own, and the chunks go to
+# the pipeline as Documents tagged with their page and offset — no temp
+# file, no join of the whole text, no second splitting pass.
+#
+# Large uploads are sharded into contiguous page ranges that run in a
+# process pool and are merged back in page order. Every task in the pool
+# stops at the parse deadline (SIGALRM in the worker), so a PDF that times
+# out doesn't keep a worker busy after the request has given up on it.
+
+import asyncio
+import io
+import math
+import os
+import signal
+import threading
+import time
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Union
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from pypdf import PdfReader
+
+from backend.tracing import record
+
+# Kept free of LLM imports: this module is loaded in parse-pool workers.
+
+MAX_PAGES = int(os.getenv("NOTERAG_MAX_PAGES", "1000"))
+PARSE_TIMEOUT = float(os.getenv("NOTERAG_PARSE_TIMEOUT", "60"))
+# below this many pages per worker, the extra IPC costs more than it saves
+MIN_PAGES_PER_SHARD = int(os.getenv("NOTERAG_MIN_PAGES_PER_SHARD", "20"))
+
+
+# the upload's bytes, or the path of the file it was spooled to; a path is
+# what gets sent to parse workers, so big uploads aren't pickled per shard
+PDFSource = Union[bytes, str]
+
+
+class PDFIngestError(ValueError):
+    status_code = 422
+
+
+class PDFTooLargeError(PDFIngestError):
+    status_code = 413
+
+
+def make_text_splitter() -> RecursiveCharacterTextSplitter:
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=100,
+        separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""],
+        add_start_index=True,
+    )
+
+@contextmanager
+def _open(source: PDFSource) -> Iterator[PdfReader]:
+    # BytesIO over an immutable bytes object shares the buffer, it doesn't
+    # copy; a path is read lazily through the open file
+    stream = io.BytesIO(source) if isinstance(source, bytes) else open(source, "rb")
+    try:
+        try:
+            reader = PdfReader(stream)
+        except Exception as e:
+            raise PDFIngestError(f"Could not read PDF: {e}") from None
+        yield reader
+    finally:
+        stream.close()
+
+def count_pages(source: PDFSource) -> int:
+    with _open(source) as reader:
+        try:
+            return len(reader.pages)
+        except Exception as e:
+            raise PDFIngestError(f"Could not read PDF: {e}") from None
+
+def iter_pdf_pages(source: PDFSource, start: int = 0, stop: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    with _open(source) as reader:
+        pages = reader.pages[start:stop]
+        for page_no, page in enumerate(pages, start):
+            try:
+                text = page.extract_text() or ""
+            except Exception as e:
+                raise PDFIngestError(f"Could not read page {page_no + 1}: {e}") from None
+            yield page_no, text
+
+def _chunk_page_range_timed(source: PDFSource, start: int, stop: Optional[int]) -> Tuple[List[Document], float, float]:
+    # metadata: "page" (0-based) and "start_index" (char offset within that page)
+    started = time.perf_counter()
+    pages = list(iter_pdf_pages(source, start, stop))
+    extracted = time.perf_counter()
+    splitter = make_text_splitter()
+    docs: List[Document] = []
+    for page_no, text in pages:
+        if text.strip():
+            docs.extend(splitter.create_documents([text], metadatas=[{"page": page_no}]))
+    return docs, extracted - started, time.perf_counter() - extracted
+
+def chunk_page_range(source: PDFSource, start: int = 0, stop: Optional[int] = None) -> List[Document]:
+    return _chunk_page_range_timed(source, start, stop)[0]
+
+def _check_page_count(pages: int, max_pages: int) -> None:
+    if pages > max_pages:
+        raise PDFTooLargeError(f"PDF has {pages} pages; the limit is {max_pages}.")
+
+def load_pdf_chunks(source: PDFSource, max_pages: int = MAX_PAGES) -> List[Document]:
+    # serial path for scripts; the API uses aload_pdf_chunks
+    _check_page_count(count_pages(source), max_pages)
+    return chunk_page_range(source)
+
+class _PastDeadline(BaseException):
+    # not an Exception, so pypdf's and our own `except Exception` let it through
+    pass
+
+def _past_deadline(signum, frame):
+    raise _PastDeadline()
+
+def _run_until(deadline: float, fn: Callable[..., Any], *args) -> Any:
+    # in a parse worker: fn(*args), interrupted at `deadline` (time.time());
+    # without SIGALRM (Windows, or not the main thread) only a task that
+    # starts too late is refused
+    if time.time() >= deadline:
+        raise PDFIngestError("PDF text extraction ran past its deadline.")
+    if not hasattr(signal, "setitimer") or threading.current_thread() is not threading.main_thread():
+        return fn(*args)
+    previous = signal.signal(signal.SIGALRM, _past_deadline)
+    signal.setitimer(signal.ITIMER_REAL, max(deadline - time.time(), 0.001))
+    try:
+        return fn(*args)
+    except _PastDeadline:
+        raise PDFIngestError("PDF text extraction ran past its deadline.") from None
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def shard_ranges(pages: int, workers: int) -> List[Tuple[int, int]]:
+    shards = max(1, min(workers, math.ceil(pages / MIN_PAGES_PER_SHARD)))
+    size = math.ceil(pages / shards) if pages else 1
+    return [(start, min(start + size, pages)) for start in range(0, pages, size)]
+
+async def aload_pdf_chunks(
+    source: PDFSource,
+    pool: Executor,
+    workers: int,
+    max_pages: int = MAX_PAGES,
+    timeout: float = PARSE_TIMEOUT,
+) -> List[Document]:
+    """
+    Counts pages, rejects documents over `max_pages` before any text is
+    extracted, then extracts and
+    splits page ranges across `pool`. Returns the same chunks as
+    load_pdf_chunks, in page order. Raises PDFIngestError on malformed
+    input or when extraction takes longer than `timeout` seconds; the
+    pool's tasks for it are stopped at the same deadline.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = time.time() + timeout
+
+    async def extract() -> List[Tuple[List[Document], float, float]]:
+        pages = await loop.run_in_executor(pool, _run_until, deadline, count_pages, source)
+        _check_page_count(pages, max_pages)
+        return await asyncio.gather(*(
+            loop.run_in_executor(pool, _run_until, deadline, _chunk_page_range_timed, source, start, stop)
+            for start, stop in shard_ranges(pages, workers)
+        ))
+
+    try:
+        parts = await asyncio.wait_for(extract(), timeout)
+    except asyncio.TimeoutError:
+        raise PDFIngestError(f"PDF text extraction took longer than {timeout:g}s.") from None
+    # worker-seconds, summed over shards (wall time is the caller's span)
+    record("pdf_parse.extract", sum(extract_s for _, extract_s, _ in parts))
+    record("pdf_parse.split", sum(split_s for _, _, split_s in parts))
+    return [doc for docs, _, _ in parts for doc in docs]
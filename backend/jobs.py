@@ -0,0 +1,168 @@
+# jobs.py
+#
+# Submit-now, fetch-later mode for slow uploads. Jobs go into a bounded
+# in-process queue drained by a fixed number of worker tasks; when the queue
+# is full, submit() refuses instead of piling up work, and the API turns that
+# into 429 + Retry-After. Job records live in a JobStore so a shared store
+# can replace the in-memory one without touching the queue.
+
+import abc
+import asyncio
+import logging
+import math
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("noterag")
+
+
+class QueueFullError(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class JobFailed(Exception):
+    # raise from a handler to fail a job with a specific status and message
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class JobStore(abc.ABC):
+    """Where job records live. Records are plain JSON-able dicts."""
+
+    @abc.abstractmethod
+    def put(self, job: Dict) -> None:
+        ...
+
+    @abc.abstractmethod
+    def get(self, job_id: str) -> Optional[Dict]:
+        ...
+
+    @abc.abstractmethod
+    def delete(self, job_id: str) -> None:
+        ...
+
+    @abc.abstractmethod
+    def finished_before(self, cutoff: float) -> List[str]:
+        # ids of jobs that finished before `cutoff` (a time.time() value)
+        ...
+
+
+class InMemoryJobStore(JobStore):
+    def __init__(self):
+        self._jobs: Dict[str, Dict] = {}
+
+    def put(self, job: Dict) -> None:
+        self._jobs[job["id"]] = job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self._jobs.get(job_id)
+
+    def delete(self, job_id: str) -> None:
+        self._jobs.pop(job_id, None)
+
+    def finished_before(self, cutoff: float) -> List[str]:
+        return [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None and job["finished_at"] < cutoff
+        ]
+
+
+class JobQueue:
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Dict]],
+        workers: int = 2,
+        max_pending: int = 32,
+        result_ttl: float = 3600,
+        store: Optional[JobStore] = None,
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.store = store or InMemoryJobStore()
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._avg_seconds = 30.0     # running estimate of one job's duration
+
+    def start(self) -> None:
+        # idempotent; called lazily from submit() so it binds to the running loop
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def submit(self, payload: Any) -> Dict:
+        self.start()
+        self._expire()
+        job = {
+            "id": uuid.uuid4().hex,
+            "status": "queued",
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "error": None,
+            "error_status": None,
+            "result": None,
+        }
+        try:
+            self._queue.put_nowait((job["id"], payload))
+        except asyncio.QueueFull:
+            raise QueueFullError(self.retry_after()) from None
+        self.store.put(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.store.get(job_id)
+
+    def retry_after(self) -> int:
+        # time until roughly one queue slot frees up
+        return max(1, math.ceil(self._avg_seconds / self.workers))
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "pending": self._queue.qsize() if self._queue is not None else 0,
+            "avg_seconds": round(self._avg_seconds, 3),
+        }
+
+    async def _worker(self) -> None:
+        while True:
+            job_id, payload = await self._queue.get()
+            job = self.store.get(job_id)
+            try:
+                if job is None:
+                    continue
+                job["status"] = "running"
+                job["started_at"] = time.time()
+                self.store.put(job)
+                try:
+                    job["result"] = await self.handler(payload)
+                    job["status"] = "done"
+                except JobFailed as e:
+                    job["status"], job["error"], job["error_status"] = "failed", e.detail, e.status_code
+                except Exception:
+                    logger.exception("Error in job %s", job_id)
+                    job["status"], job["error"], job["error_status"] = "failed", "Internal error.", 500
+                job["finished_at"] = time.time()
+                self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * (job["finished_at"] - job["started_at"])
+                self.store.put(job)
+            finally:
+                self._queue.task_done()
+
+    def _expire(self) -> None:
+        for job_id in self.store.finished_before(time.time() - self.result_ttl):
+            self.store.delete(job_id)
@@ -0,0 +1,216 @@
+# keywords.py
+#
+# Title, topic and keywords without an LLM call (NOTERAG_METADATA=local).
+# Candidates are the 1-3 word runs between stopwords and punctuation, as in
+# RAKE. Each word gets a TF-IDF weight: its count in the document against
+# how many passages of a background corpus contain it (the notes corpus,
+# once set_background is called; without one, TF alone). A candidate
+# scores the summed weight of its words times how often it occurs as a
+# phrase, boosted when it appears in one of the three main ideas; a
+# multi-word candidate has to repeat, or be in a main idea, to count.
+# Keywords are the best candidates that share no word; the topic is the one
+# of them spread most widely over the chunks. The title is the first main
+# idea's opening clause.
+#
+# Tokenizing is a Python loop over words; everything after it is NumPy.
+
+import functools
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_WORD = re.compile(r"[^\W_](?:[\w'’-]*[^\W_])?")
+# clause boundaries: a phrase never spans one
+_BREAK = re.compile(r"[.,;:!?()\[\]{}\"“”/|]+|\s[-–—]+\s|\n")
+_POSSESSIVE = re.compile(r"['’]s$")
+
+STOPWORDS = frozenset("""
+a about above across after again against all almost along already also although always am among an and
+another any anyone anything are around as at away be because been before being below between both but
+by can cannot could did do does doing done down during each either else enough especially even ever
+every example few for from further get gets getting give given gives go goes going good got great had
+has have having he her here hers him his how however i if in including into is it its itself just keep
+kind know known less let like likely made main make makes making many may me might more most much must
+my near need needs never new no not now of off often on once one only onto or other others our out
+over own part per perhaps put rather really same see seem seems several shall she should show shows
+since so some something sometimes specific still such take takes than that the their them then there
+these they thing things this those though through thus to together too toward towards under until up
+upon us use used uses using very via was way ways we well were what whatever when where whether which
+while who whole whom whose why will with within without would yet you your
+able always become becomes better help helps helping allow allows provide provides providing
+ensure ensures various different important simple simply easy easier
+""".split())
+
+MAX_WORDS = 3
+SUMMARY_BOOST = 2.0
+
+# words -> ({word: passages containing it}, total passages)
+Background = Callable[[Sequence[str]], Tuple[Dict[str, int], int]]
+_background: Optional[Background] = None
+
+def set_background(background: Optional[Background]) -> None:
+    # document frequencies to score words against (backend.api passes the
+    # notes corpus); None scores against the document's own chunks
+    global _background
+    _background = background
+
+
+@functools.lru_cache(maxsize=65536)
+def _key(word: str) -> str:
+    # lowercase, no possessive, plural folded: "Visuals" -> "visual", "studies" -> "study"
+    key = _POSSESSIVE.sub("", word.lower())
+    if len(key) > 4 and key.endswith("ies"):
+        return key[:-3] + "y"
+    if len(key) > 3 and key.endswith("s") and not key.endswith(("ss", "us", "is")):
+        return key[:-1]
+    return key
+
+def _runs(text: str) -> List[List[str]]:
+    # maximal stretches of non-stopwords inside one clause, surface forms
+    runs = []
+    for clause in _BREAK.split(text):
+        run: List[str] = []
+        for word in _WORD.findall(clause):
+            key = _key(word)
+            if key in STOPWORDS or len(key) < 3 or not key[0].isalpha():
+                if run:
+                    runs.append(run)
+                run = []
+            else:
+                run.append(word)
+        if run:
+            runs.append(run)
+    return runs
+
+
+class _Candidates:
+    # word and phrase occurrences of one document, as flat id lists
+    def __init__(self):
+        self.words: Dict[str, int] = {}
+        self.surface: List[Dict[str, int]] = []     # per word: surface form -> count
+        self.phrases: Dict[Tuple[int, ...], int] = {}
+        self.word_id: List[int] = []
+        self.phrase_chunk: List[int] = []
+        self.phrase_id: List[int] = []
+        self.in_summary: set = set()
+
+    def _ids(self, run: List[str]) -> List[int]:
+        ids = []
+        for word in run:
+            wid = self.words.setdefault(_key(word), len(self.words))
+            if wid == len(self.surface):
+                self.surface.append({})
+            self.surface[wid][word] = self.surface[wid].get(word, 0) + 1
+            ids.append(wid)
+        return ids
+
+    def _phrases(self, ids: List[int]):
+        # every 1..MAX_WORDS-word window of a run, skipping ones that repeat a word
+        for n in range(len(ids)):
+            for size in range(1, min(MAX_WORDS, len(ids) - n) + 1):
+                phrase = tuple(ids[n:n + size])
+                if size > 1 and len(set(phrase)) < size:
+                    continue
+                yield self.phrases.setdefault(phrase, len(self.phrases))
+
+    def add(self, chunk: int, text: str) -> None:
+        for run in _runs(text):
+            ids = self._ids(run)
+            self.word_id.extend(ids)
+            for pid in self._phrases(ids):
+                self.phrase_chunk.append(chunk)
+                self.phrase_id.append(pid)
+
+    def add_summary(self, text: str) -> None:
+        for run in _runs(text):
+            self.in_summary.update(self._phrases(self._ids(run)))
+
+    def form(self, phrase: Tuple[int, ...]) -> str:
+        # each word as it is most often written
+        return " ".join(max(self.surface[wid].items(), key=lambda item: item[1])[0] for wid in phrase)
+
+
+def _idf(vocab: List[str]) -> np.ndarray:
+    # against the background corpus; without one (or while it is empty)
+    # every word weighs the same and the stopword list does the filtering
+    if _background is not None:
+        try:
+            counts, total = _background(vocab)
+        except Exception:
+            counts, total = {}, 0
+        if total:
+            df = np.array([counts.get(w, 0) for w in vocab], dtype=np.float64)
+            return np.log((1 + total) / (1 + df)) + 1
+    return np.ones(len(vocab))
+
+def extract(texts: Sequence[str], summary_lines: Sequence[str] = (), k: int = 5) -> Dict:
+    """
+    {"topic": ..., "keywords": [...]} for a document given as its chunks,
+    optionally with its main ideas. At most `k` keywords, best first.
+    """
+    cands = _Candidates()
+    for chunk, text in enumerate(texts):
+        cands.add(chunk, text)
+    for line in summary_lines:
+        cands.add_summary(re.sub(r'^\d+\.\s*', '', line))
+    if not cands.phrases:
+        return {"topic": "", "keywords": []}
+
+    vocab = list(cands.words)
+    chunks = max(1, len(texts))
+    words = len(vocab)
+    freq = np.bincount(np.array(cands.word_id, dtype=np.int64), minlength=words).astype(np.float64)
+    weight = np.zeros(words + 1)                        # last slot pads short phrases
+    weight[:words] = np.where(freq > 0, 1 + np.log(np.maximum(freq, 1)), 0) * _idf(vocab)
+
+    phrases = len(cands.phrases)
+    keys = list(cands.phrases)
+    ids = np.full((phrases, MAX_WORDS), words, dtype=np.int64)
+    for pid, phrase in enumerate(keys):
+        ids[pid, :len(phrase)] = phrase
+    length = (ids < words).sum(axis=1)
+    phrase_id = np.array(cands.phrase_id, dtype=np.int64)
+    pf = np.bincount(phrase_id, minlength=phrases).astype(np.float64)
+    in_chunks = np.unique(np.array(cands.phrase_chunk, dtype=np.int64) * phrases + phrase_id) % phrases
+    spread = np.bincount(in_chunks, minlength=phrases) / chunks
+    summary = np.zeros(phrases, dtype=bool)
+    summary[list(cands.in_summary)] = True
+
+    score = weight[ids].sum(axis=1) * (1 + np.log(np.maximum(pf, 1)))
+    score *= np.where(summary, SUMMARY_BOOST, 1.0)
+    score[(length > 1) & (pf < 2) & ~summary] = 0
+    score[(pf == 0) & ~summary] = 0
+
+    chosen: List[int] = []
+    used: set = set()
+    for pid in np.argsort(-score, kind="stable"):
+        if score[pid] <= 0 or len(chosen) == k:
+            break
+        members = set(keys[pid])
+        if members & used:
+            continue
+        chosen.append(int(pid))
+        used |= members
+
+    keywords = [cands.form(keys[pid]) for pid in chosen]
+    best = max(chosen, key=lambda pid: (spread[pid] * score[pid], length[pid])) if chosen else None
+    topic = cands.form(keys[best]) if best is not None else ""
+    return {"topic": topic, "keywords": keywords}
+
+def title_from(line: str, keywords: Sequence[str], max_words: int = 10) -> str:
+    # the main idea's opening clause if it is short enough, else its keywords
+    text = re.sub(r'^\d+\.\s*', '', line).strip()
+    clause = re.split(r"[,;:]|\s(?:that|which|because|where|while)\s", text, maxsplit=1)[0].strip().rstrip(".")
+    if clause and len(clause.split()) <= max_words:
+        return clause
+    return " and ".join(w[:1].upper() + w[1:] for w in keywords[:2]) or text
+
+def local_metadata(texts: Sequence[str], high_lines: Sequence[str]) -> Dict:
+    # same shape as the LLM metadata call's parsed result
+    found = extract(texts, high_lines)
+    return {
+        "title": title_from(high_lines[0], found["keywords"]) if high_lines else "",
+        "topic": found["topic"],
+        "keywords": found["keywords"],
+    }
@@ -0,0 +1,269 @@
+# llm_backends.py
+#
+# Lazy, pluggable chat-model backends. Nothing is imported or constructed
+# until the first LLM call; the model is then built once and shared by every
+# request (one client, one pooled HTTP connection set), behind the call
+# governor (rate limits, retries, circuit breaker; see governor.py).
+#
+#   NOTERAG_LLM_BACKEND=openai   (default) needs OPENAI_API_KEY
+#   NOTERAG_LLM_BACKEND=fake     deterministic offline model for CI / benchmarks
+#
+# The fake can misbehave like a real API: NOTERAG_FAKE_429_RATE,
+# NOTERAG_FAKE_ERROR_RATE (503s) and NOTERAG_FAKE_TIMEOUT_RATE are per-call
+# probabilities, and NOTERAG_FAKE_CAPACITY answers 429 past that many calls
+# in flight.
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, Callable, ClassVar, Dict, Iterator, AsyncIterator, List, Optional
+
+from backend.governor import Governor, governed_chat_model
+from backend.metrics import token_usage_handler
+
+MODEL_NAME = os.getenv("NOTERAG_MODEL", "gpt-3.5-turbo")
+TEMPERATURE = float(os.getenv("NOTERAG_TEMPERATURE", "0.3"))
+MAX_TOKENS = int(os.getenv("NOTERAG_MAX_TOKENS", "500"))
+
+BACKENDS: Dict[str, Callable[[], Any]] = {}
+
+def register_backend(name: str):
+    # decorator: the factory takes no arguments and returns a LangChain chat model
+    def wrap(factory: Callable[[], Any]) -> Callable[[], Any]:
+        BACKENDS[name] = factory
+        return factory
+    return wrap
+
+def backend_name() -> str:
+    return os.getenv("NOTERAG_LLM_BACKEND", "openai")
+
+def backend_fingerprint() -> str:
+    # identifies what answers the prompts, without building the client
+    return f"{backend_name()}:{MODEL_NAME}:{TEMPERATURE}:{MAX_TOKENS}"
+
+_llm = None
+_governor: Optional[Governor] = None
+_llm_lock = threading.Lock()
+
+def get_llm():
+    global _llm, _governor
+    if _llm is None:
+        with _llm_lock:
+            if _llm is None:
+                name = backend_name()
+                if name not in BACKENDS:
+                    raise ValueError(f"Unknown LLM backend {name!r}; choose from {sorted(BACKENDS)}")
+                llm = BACKENDS[name]()
+                if os.getenv("NOTERAG_LLM_GOVERNOR", "1") != "0":
+                    _governor = Governor.from_env(completion_tokens=MAX_TOKENS)
+                    llm = governed_chat_model(llm, _governor)
+                # per-stage token counts for /metrics
+                llm.callbacks = [*(llm.callbacks or []), token_usage_handler()]
+                _llm = llm
+    return _llm
+
+def get_governor() -> Optional[Governor]:
+    # the governor in front of the shared model, once one has been built
+    return _governor
+
+def reset_llm() -> None:
+    # forget the shared model (and its governor), e.g. after changing
+    # NOTERAG_LLM_BACKEND in a benchmark
+    global _llm, _governor
+    with _llm_lock:
+        _llm = None
+        _governor = None
+
+
+# ─── OpenAI ───────────────────────────────────────────────────────────────────
+@register_backend("openai")
+def openai_backend():
+    import httpx
+    from langchain_openai import ChatOpenAI
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("Please set the OPENAI_API_KEY environment variable")
+
+    # one keep-alive pool shared by every request in this worker
+    limits = httpx.Limits(
+        max_connections=int(os.getenv("NOTERAG_OPENAI_MAX_CONNECTIONS", "64")),
+        max_keepalive_connections=int(os.getenv("NOTERAG_OPENAI_KEEPALIVE", "16")),
+    )
+    return ChatOpenAI(
+        openai_api_key=api_key,
+        model=MODEL_NAME,
+        temperature=TEMPERATURE,
+        max_tokens=MAX_TOKENS,
+        stream_usage=True,      # token counts on streamed calls too
+        max_retries=0,          # the governor retries, with shared backoff
+        http_client=httpx.Client(limits=limits),
+        http_async_client=httpx.AsyncClient(limits=limits),
+    )
+
+
+# ─── Deterministic offline fake ───────────────────────────────────────────────
+@register_backend("fake")
+def fake_backend():
+    return make_fake_chat_model()
+
+def make_fake_chat_model(**overrides):
+    # imported here so the class (and langchain_core) load only when used
+    return fake_chat_model_class()(**{
+        "latency": float(os.getenv("NOTERAG_FAKE_LATENCY", "0.05")),
+        "words_per_line": int(os.getenv("NOTERAG_FAKE_WORDS", "12")),
+        "rate_limit_rate": float(os.getenv("NOTERAG_FAKE_429_RATE", "0")),
+        "error_rate": float(os.getenv("NOTERAG_FAKE_ERROR_RATE", "0")),
+        "timeout_rate": float(os.getenv("NOTERAG_FAKE_TIMEOUT_RATE", "0")),
+        "capacity": int(os.getenv("NOTERAG_FAKE_CAPACITY", "0")),
+        **overrides,
+    })
+
+class FakeAPIError(Exception):
+    # shaped like a provider SDK error: status_code and an optional Retry-After
+    def __init__(self, status_code: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+_FakeChatModel = None
+
+def fake_chat_model_class():
+    global _FakeChatModel
+    if _FakeChatModel is not None:
+        return _FakeChatModel
+
+    from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+    from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+    class FakeChatModel(BaseChatModel):
+        """
+        Answers every pipeline prompt in the format its parser expects, using
+        words drawn from the prompt itself. The same prompt always gets the
+        same answer. `latency` is paid once per call before the first token.
+        Async calls can also fail the way a provider does (all off by
+        default); a timeout hangs for `hang` seconds, then raises.
+        """
+
+        latency: float = 0.05
+        words_per_line: int = 12
+        rate_limit_rate: float = 0.0
+        error_rate: float = 0.0
+        timeout_rate: float = 0.0
+        hang: float = 1.0
+        capacity: int = 0
+        in_flight: ClassVar[int] = 0
+
+        @property
+        def _llm_type(self) -> str:
+            return "noterag-fake"
+
+        def respond(self, prompt: str) -> str:
+            rng = random.Random(hashlib.sha256(prompt.encode("utf-8")).digest())
+            vocab = re.findall(r"[A-Za-z]{4,}", prompt) or ["content"]
+
+            def sentence() -> str:
+                return " ".join(rng.choice(vocab).lower() for _ in range(self.words_per_line)).capitalize() + "."
+
+            if "JSON" in prompt:
+                words = [rng.choice(vocab).lower() for _ in range(5)]
+                return json.dumps({"title": " ".join(words[:3]).title(), "topic": words[3], "keywords": words})
+            if "SUPPORTING POINTS:" in prompt:
+                n = re.search(r"MAIN IDEA (\d+):", prompt).group(1)
+                return "\n".join(f"{n}.{j} {sentence()}" for j in (1, 2, 3))
+            if "PASSAGES:" in prompt:
+                refs = re.findall(r"^\[(\d+)\]", prompt, re.M) or ["1"]
+                return " ".join(f"{sentence()} [{rng.choice(refs)}]" for _ in range(3))
+            if prompt.rstrip().endswith("3."):
+                return "\n".join(f"{i}. {sentence()}" for i in (1, 2, 3))
+            return " ".join(sentence() for _ in range(3))
+
+        @contextlib.asynccontextmanager
+        async def _provider(self):
+            if (self.capacity and FakeChatModel.in_flight >= self.capacity) or random.random() < self.rate_limit_rate:
+                raise FakeAPIError(429, "Rate limit reached")
+            if random.random() < self.error_rate:
+                raise FakeAPIError(503, "Service unavailable")
+            FakeChatModel.in_flight += 1
+            try:
+                if random.random() < self.timeout_rate:
+                    await asyncio.sleep(self.hang)
+                    raise TimeoutError("Request timed out")
+                await asyncio.sleep(self.latency)
+                yield
+            finally:
+                FakeChatModel.in_flight -= 1
+
+        def _result(self, messages: List[BaseMessage]) -> ChatResult:
+            prompt = "\n".join(str(m.content) for m in messages)
+            text = self.respond(prompt)
+            usage = {"prompt_tokens": len(prompt) // 4 + 1, "completion_tokens": len(text) // 4 + 1}
+            usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+            return ChatResult(
+                generations=[ChatGeneration(message=AIMessage(content=text))],
+                llm_output={"token_usage": usage, "model_name": self._llm_type},
+            )
+
+        def _chunks(self, messages: List[BaseMessage]) -> Iterator[ChatGenerationChunk]:
+            result = self._result(messages)
+            for piece in re.findall(r"\S+\s*", result.generations[0].message.content):
+                yield ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            # usage rides on a final empty chunk, as with OpenAI's stream_usage
+            usage = result.llm_output["token_usage"]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata={
+                "input_tokens": usage["prompt_tokens"],
+                "output_tokens": usage["completion_tokens"],
+                "total_tokens": usage["total_tokens"],
+            }))
+
+        def _generate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+        ) -> ChatResult:
+            time.sleep(self.latency)
+            return self._result(messages)
+
+        async def _agenerate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+        ) -> ChatResult:
+            async with self._provider():
+                return self._result(messages)
+
+        def _stream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+        ) -> Iterator[ChatGenerationChunk]:
+            time.sleep(self.latency)
+            yield from self._chunks(messages)
+
+        async def _astream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+            **kwargs: Any,
+        ) -> AsyncIterator[ChatGenerationChunk]:
+            async with self._provider():
+                for chunk in self._chunks(messages):
+                    yield chunk
+
+    _FakeChatModel = FakeChatModel
+    return FakeChatModel
@@ -0,0 +1,181 @@
+# metrics.py
+#
+# Process-wide counters and histograms in the Prometheus text format, served
+# on /metrics. Hand-rolled (no client library): a metric is a dict of label
+# tuple -> values behind one lock, so an observation is a bisect and a few
+# additions; a gauge is a single float. Every tracing span is observed into
+# noterag_stage_seconds, and LLM token usage is counted per stage by a
+# LangChain callback. The LLM governor reports retries, fail-fasts, its
+# concurrency limit and breaker state.
+#
+# token_tally() also adds up the tokens of the LLM calls made inside it (and
+# in tasks started inside it), so a cache entry can record what it cost.
+
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from backend import tracing
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = tuple(str(labels[n]) for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(tuple(str(labels[n]) for n in self.labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {value:g}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._value = 0.0
+
+    def set(self, value: float) -> None:
+        self._value = float(value)
+
+    def value(self) -> float:
+        return self._value
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {self._value:g}"]
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> (per-bucket counts, +Inf included last; sum)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[n]) for n in self.labels)
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][slot] += 1
+            entry[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total[0]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("noterag_stage_seconds", "Time spent in each pipeline stage.", ("stage",))
+REQUEST_SECONDS = Histogram("noterag_request_seconds", "HTTP request latency.", ("path", "status"))
+LLM_CALLS = Counter("noterag_llm_calls_total", "LLM calls, by pipeline stage.", ("stage",))
+LLM_TOKENS = Counter("noterag_llm_tokens_total", "LLM tokens, by pipeline stage and kind.", ("stage", "kind"))
+LLM_RETRIES = Counter("noterag_llm_retries_total", "LLM calls retried, by error class.", ("reason",))
+LLM_FAILFAST = Counter("noterag_llm_failfast_total", "LLM calls refused while the circuit was open.")
+LLM_CONCURRENCY_LIMIT = Gauge("noterag_llm_concurrency_limit", "Current adaptive limit on LLM calls in flight.")
+LLM_BREAKER_OPEN = Gauge("noterag_llm_breaker_open", "1 while the LLM circuit breaker is open.")
+
+REGISTRY = [STAGE_SECONDS, REQUEST_SECONDS, LLM_CALLS, LLM_TOKENS, LLM_RETRIES, LLM_FAILFAST,
+            LLM_CONCURRENCY_LIMIT, LLM_BREAKER_OPEN]
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+tracing.add_observer(lambda name, seconds: STAGE_SECONDS.observe(seconds, stage=name))
+
+
+# ─── LLM token usage ──────────────────────────────────────────────────────────
+def record_llm_usage(prompt_tokens: int, completion_tokens: int, stage: Optional[str] = None) -> None:
+    stage = stage or tracing.current_stage() or "other"
+    LLM_CALLS.inc(stage=stage)
+    LLM_TOKENS.inc(prompt_tokens, stage=stage, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, stage=stage, kind="completion")
+    for tally in _tallies.get():
+        tally[0] += prompt_tokens + completion_tokens
+
+# every open tally sees the calls made inside it, nested ones included
+_tallies: ContextVar[Tuple[List[int], ...]] = ContextVar("noterag_token_tallies", default=())
+
+@contextmanager
+def token_tally() -> Iterator[List[int]]:
+    # set and restored rather than reset: an async generator may close it
+    # from another context, as with tracing.span
+    outer = _tallies.get()
+    tally = [0]
+    _tallies.set(outer + (tally,))
+    try:
+        yield tally
+    finally:
+        _tallies.set(outer)
+
+_handler = None
+
+def token_usage_handler():
+    # one shared callback; the class is defined on first use so importing
+    # this module does not pull in langchain_core.callbacks
+    global _handler
+    if _handler is not None:
+        return _handler
+
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class TokenUsageHandler(BaseCallbackHandler):
+        # called in the caller's context, so the current span names the stage
+        run_inline = True
+
+        def on_llm_end(self, response, **kwargs) -> None:
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            prompt, completion = usage.get("prompt_tokens"), usage.get("completion_tokens")
+            if prompt is None:
+                # streamed calls report usage on the final message instead
+                prompt = completion = 0
+                for generations in response.generations:
+                    for g in generations:
+                        meta = getattr(getattr(g, "message", None), "usage_metadata", None) or {}
+                        prompt += meta.get("input_tokens", 0)
+                        completion += meta.get("output_tokens", 0)
+            record_llm_usage(prompt, completion or 0)
+
+    _handler = TokenUsageHandler()
+    return _handler
@@ -1,27 +1,35 @@
 # rag_pipeline.py
 
+import asyncio
+import hashlib
+import json
+import logging
 import os
 import re
-from typing import List, Dict
-
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.schema import Document
-from langchain.prompts import PromptTemplate
-from langchain.chains.summarize import load_summarize_chain
-from langchain_openai import ChatOpenAI
-from langchain import LLMChain
-
-# ─── 1) Initialize your LLM ────────────────────────────────────────────────────
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-if not OPENAI_API_KEY:
-    raise ValueError("Please set the OPENAI_API_KEY environment variable")
-
-llm = ChatOpenAI(
-    openai_api_key=OPENAI_API_KEY,
-    model="gpt-3.5-turbo",
-    temperature=0.3,
-    max_tokens=500
-)
+import threading
+import time
+import zlib
+from contextlib import nullcontext
+from typing import AsyncIterator, List, Dict, Optional, Tuple, Union
+
+from langchain_core.documents import Document
+from langchain_core.prompts import PromptTemplate
+
+from backend.ingest import make_text_splitter
+from backend.retrieval import build_index, get_embedder
+from backend.compress import compress_documents, estimate_tokens
+from backend.governor import stage_priority
+from backend.keywords import local_metadata
+from backend.llm_backends import backend_fingerprint, get_llm
+from backend.metrics import token_tally
+from backend.summary_cache import SummaryCache, make_cache_key
+from backend.tracing import span
+
+logger = logging.getLogger("noterag")
+
+# ─── 1) LLM backend ────────────────────────────────────────────────────────────
+# The chat model comes from backend.llm_backends and is only built on the
+# first call (see get_chains), so importing this module needs no API key.
 
 # ─── 2) High‑level summary prompt ──────────────────────────────────────────────
 high_level_prompt = PromptTemplate(
@@ -40,123 +48,540 @@ MAIN IDEAS:
 )
 
 # ─── 3) Expansion prompt ───────────────────────────────────────────────────────
+# One call per main idea, so the three run side by side and a bad answer is
+# retried on its own.
 expand_prompt = PromptTemplate(
     template="""
-For each main idea below, write three short and clear supporting points.
+Write three short and clear supporting points for the main idea below.
+Base every point on the source passages listed under it.
 Use simple words. Each point should explain or give an example.
 Write in a way that helps people with ADHD or reading difficulties.
 
-MAIN IDEAS:
+MAIN IDEA {number}: {idea}
+
+SOURCE PASSAGES:
+{passages}
+
+SUPPORTING POINTS:
+{number}.1
+{number}.2
+{number}.3
+""",
+    input_variables=["number", "idea", "passages"],
+)
+
+# ─── 4) Title, topic & keywords in one structured call ─────────────────────────
+meta_prompt = PromptTemplate(
+    template="""
+From the summary below, return a JSON object with exactly these keys:
+  "title": a simple and short title (under 10 words)
+  "topic": the main topic (1-3 words)
+  "keywords": a list of 3 to 5 relevant keywords
+Output only the JSON object, nothing else.
+
+SUMMARY:
 {text}
 
-DETAILED EXPLANATIONS:
-Point 1:
-1.1
-1.2
-1.3
-
-Point 2:
-2.1
-2.2
-2.3
-
-Point 3:
-3.1
-3.2
-3.3
+JSON:
 """,
     input_variables=["text"],
 )
 
-# ─── 4) (Optional) Topic & keywords extraction ─────────────────────────────────
-topic_prompt = PromptTemplate(
+# NOTERAG_METADATA=local: title, topic and keywords come from the statistical
+# extractor in backend.keywords instead of the call above
+METADATA_SOURCE = os.getenv("NOTERAG_METADATA", "llm")
+
+meta_repair_prompt = PromptTemplate(
     template="""
-In one or two words, give a concise topic label for this summary sentence:
+The text below should be a JSON object with keys "title" (string), "topic"
+(string) and "keywords" (list of 3 to 5 strings), but it is invalid: {error}
+Return only the corrected JSON object, nothing else.
 
 {text}
+""",
+    input_variables=["text", "error"],
+)
 
-Topic:
+# ─── 5) Helper to split text ───────────────────────────────────────────────────
+def prepare_text_for_langchain(text: str) -> List[Document]:
+    # same splitter settings as backend.ingest uses for PDF pages
+    return make_text_splitter().create_documents([text])
+
+# ─── 6) Map‑reduce for documents that don't fit one prompt ────────────────────
+# Below STUFF_TOKEN_LIMIT every chunk is "stuffed" into one high-level call.
+# Above it, chunk groups are summarized in parallel (map), the partial
+# summaries are merged pairwise-or-better level by level (reduce) until they
+# fit, and the high-level prompt turns what's left into the three main ideas.
+# Each level at least halves the partials, so depth grows with log(pages).
+# Groups have content-defined boundaries and their summaries are memoized
+# in a chunk cache, so re-uploading a lightly edited document re-summarizes
+# only the groups around the edit. A document's map calls all go out at
+# once and the governor's global limit decides how many run; set
+# NOTERAG_MAP_CONCURRENCY to also cap them per document.
+STUFF_TOKEN_LIMIT = int(os.getenv("NOTERAG_STUFF_TOKEN_LIMIT", "3000"))
+MAP_GROUP_TOKENS = int(os.getenv("NOTERAG_MAP_GROUP_TOKENS", "2500"))
+MAP_CONCURRENCY = int(os.getenv("NOTERAG_MAP_CONCURRENCY", "0"))    # 0 = no per-document cap
+MAP_BOUNDARY_EVERY = int(os.getenv("NOTERAG_MAP_BOUNDARY_EVERY", "6"))
+
+map_prompt = PromptTemplate(
+    template="""
+Summarize the key ideas of the following part of a longer document.
+Keep important facts, names, terms and examples. Use short, plain sentences.
+
+{text}
+
+KEY IDEAS:
 """,
     input_variables=["text"],
 )
 
-keyword_prompt = PromptTemplate(
+reduce_prompt = PromptTemplate(
     template="""
-Extract up to five comma‑separated keywords from the following summary sentence.
-Only output the keywords, nothing else.
+The notes below summarize consecutive parts of one document.
+Combine them into a single shorter summary that keeps every key idea.
+Use short, plain sentences.
 
-Summary:
 {text}
 
-Keywords:
+COMBINED SUMMARY:
 """,
     input_variables=["text"],
 )
 
-topic_chain = LLMChain(llm=llm, prompt=topic_prompt)
-keyword_chain = LLMChain(llm=llm, prompt=keyword_prompt)
+def _group_by_content(texts: List[str], budget: int, min_size: int = 1) -> List[List[str]]:
+    # A group closes after any text whose hash hits 1-in-MAP_BOUNDARY_EVERY,
+    # or before it would overflow `budget`. Boundaries follow content, not
+    # position, so an edit only regroups the texts around it.
+    groups: List[List[str]] = []
+    current: List[str] = []
+    used = 0
+    for t in texts:
+        cost = estimate_tokens(t)
+        if current and used + cost > budget and len(current) >= min_size:
+            groups.append(current)
+            current, used = [], 0
+        current.append(t)
+        used += cost
+        if len(current) >= min_size and zlib.crc32(t.encode("utf-8")) % MAP_BOUNDARY_EVERY == 0:
+            groups.append(current)
+            current, used = [], 0
+    if current:
+        groups.append(current)
+    return groups
 
-# ─── 5) Build your summarize chains ────────────────────────────────────────────
-summary_chain = load_summarize_chain(
-    llm=llm, chain_type="stuff", prompt=high_level_prompt
-)
-expand_chain = load_summarize_chain(
-    llm=llm, chain_type="stuff", prompt=expand_prompt
-)
+# Map and reduce outputs are memoized by content, so a re-upload after a
+# small edit only sends the changed groups to the LLM.
+_chunk_cache: Optional[SummaryCache] = None
 
-# ─── 6) Helper to split text ───────────────────────────────────────────────────
-def prepare_text_for_langchain(text: str) -> List[Document]:
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=100,
-        separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""]
+def get_chunk_cache() -> SummaryCache:
+    global _chunk_cache
+    if _chunk_cache is None:
+        _chunk_cache = SummaryCache.from_env("NOTERAG_CHUNK_CACHE", ".noterag_cache/chunks.sqlite3", memory_items=4096)
+    return _chunk_cache
+
+def _chunk_key(prompt: PromptTemplate, text: str) -> str:
+    # same text, prompt and model → same partial summary
+    fingerprint = hashlib.sha256(f"{backend_fingerprint()}\0{prompt.template}".encode("utf-8")).hexdigest()
+    return make_cache_key(hashlib.sha256(text.encode("utf-8")).hexdigest(), fingerprint)
+
+async def _arun_parallel(chain, texts: List[str], stage: str) -> Tuple[List[str], List[bool]]:
+    # returns the outputs and, for each, whether it came from the chunk cache
+    cache = get_chunk_cache()
+    keys = [_chunk_key(chain.prompt, t) for t in texts]
+    hits = await asyncio.to_thread(lambda: [cache.get(k) for k in keys])
+    limit = asyncio.Semaphore(MAP_CONCURRENCY) if MAP_CONCURRENCY > 0 else nullcontext()
+
+    async def one(t: str, key: str) -> str:
+        async with limit:
+            started = time.perf_counter()
+            with span(stage), token_tally() as used:
+                out = (await chain.arun({"text": t})).strip()
+        await asyncio.to_thread(cache.put, key, {"text": out}, time.perf_counter() - started, used[0])
+        return out
+
+    outs = [hit["text"] if hit is not None else "" for hit in hits]
+    missing = [i for i, hit in enumerate(hits) if hit is None]
+    for i, out in zip(missing, await asyncio.gather(*(one(texts[i], keys[i]) for i in missing))):
+        outs[i] = out
+    return outs, [hit is not None for hit in hits]
+
+def _map_groups(docs: List[Document]) -> Optional[List[List[str]]]:
+    # chunk groups for the map step; None if the chunks already fit
+    chunks = [d.page_content for d in docs]
+    if sum(estimate_tokens(c) for c in chunks) <= STUFF_TOKEN_LIMIT:
+        return None
+    return _group_by_content(chunks, MAP_GROUP_TOKENS)
+
+def _reduce_inputs(partials: List[str]) -> Optional[List[str]]:
+    # merge neighbours (at least two at a time); None once everything fits
+    if len(partials) <= 1 or sum(estimate_tokens(p) for p in partials) <= STUFF_TOKEN_LIMIT:
+        return None
+    return ["\n\n".join(g) for g in _group_by_content(partials, MAP_GROUP_TOKENS, min_size=2)]
+
+def _chunk_reuse(groups: List[List[str]], reused: List[bool]) -> Dict:
+    return {
+        "chunks": sum(len(g) for g in groups),
+        "reused": sum(len(g) for g, hit in zip(groups, reused) if hit),
+    }
+
+async def areduce_to_fit(docs: List[Document]) -> Tuple[str, Optional[Dict]]:
+    # Returns the text for the high-level prompt, joined the way the "stuff"
+    # chain joins documents, and the chunk reuse counts (None without a map step).
+    groups = _map_groups(docs)
+    if groups is None:
+        return "\n\n".join(d.page_content for d in docs), None
+
+    partials, reused = await _arun_parallel(get_chains().map, ["\n\n".join(g) for g in groups], "chain.map")
+    while (inputs := _reduce_inputs(partials)) is not None:
+        partials, _ = await _arun_parallel(get_chains().reduce, inputs, "chain.reduce")
+    return "\n\n".join(partials), _chunk_reuse(groups, reused)
+
+# ─── 7) Build your chains (lazily) ─────────────────────────────────────────────
+class Chains:
+    # The high-level summary is streamed straight from the LLM with
+    # high_level_prompt (see astream_langchain_summary), so it has no chain.
+    def __init__(self, llm):
+        # the chain modules are slow to import; only pay for it on first use
+        from langchain.chains import LLMChain
+
+        self.llm = llm
+        self.expand = LLMChain(llm=llm, prompt=expand_prompt)
+        self.map = LLMChain(llm=llm, prompt=map_prompt)
+        self.reduce = LLMChain(llm=llm, prompt=reduce_prompt)
+        # JSON mode makes the model emit a syntactically valid object; the
+        # strict parser below still checks the shape.
+        json_llm = llm.bind(response_format={"type": "json_object"})
+        self.meta = LLMChain(llm=json_llm, prompt=meta_prompt)
+        self.meta_repair = LLMChain(llm=json_llm, prompt=meta_repair_prompt)
+
+_chains = None
+_chains_lock = threading.Lock()
+
+def get_chains() -> Chains:
+    # built on first use and shared by every request; rebuilt if the backend was reset
+    global _chains
+    llm = get_llm()
+    if _chains is None or _chains.llm is not llm:
+        with _chains_lock:
+            if _chains is None or _chains.llm is not llm:
+                _chains = Chains(llm)
+    return _chains
+
+# ─── 8) Retrieval for grounded expansions ─────────────────────────────────────
+# Each main idea pulls its own top-k chunks from a per-document index, and
+# only those passages go into that idea's expansion prompt.
+RETRIEVAL_TOP_K = int(os.getenv("NOTERAG_RETRIEVAL_TOP_K", "3"))
+INDEX_DIR = os.getenv("NOTERAG_INDEX_DIR", ".noterag_cache/indexes")
+INDEX_MAX_BYTES = int(os.getenv("NOTERAG_INDEX_MAX_BYTES", str(256 * 1024 * 1024)))
+
+def strip_number(line: str) -> str:
+    return re.sub(r'^\d+\.\s*', '', line)
+
+def expand_input(index: int, line: str, hits: List[Document]) -> Dict:
+    # expand_prompt variables for the main idea at `index` (0-based)
+    passages = "\n".join(
+        f"[page {d.metadata['page'] + 1}] {d.page_content}" if "page" in d.metadata else f"- {d.page_content}"
+        for d in hits
     )
-    chunks = splitter.split_text(text)
-    return [Document(page_content=chunk) for chunk in chunks]
-
-# ─── 7) The real pipeline ─────────────────────────────────────────────────────
-def generate_langchain_summary(text: str) -> Dict:
-    # a) split & high‑level summary
-    docs = prepare_text_for_langchain(text)
-    high_raw = summary_chain.run(docs).strip()
+    return {"number": index + 1, "idea": strip_number(line), "passages": passages}
+
+def source_pages(hits: List[Document]) -> List[int]:
+    # 1-based pages an expansion was grounded in
+    return sorted({d.metadata["page"] + 1 for d in hits if "page" in d.metadata})
+
+async def aretrieve_passages(docs: List[Document], high_lines: List[str]) -> List[List[Document]]:
+    # embedding is CPU work; keep it off the event loop
+    def run() -> List[List[Document]]:
+        index = build_index(docs, index_dir=INDEX_DIR, max_bytes=INDEX_MAX_BYTES)
+        return index.search([strip_number(ln) for ln in high_lines], RETRIEVAL_TOP_K)
+    with span("retrieval"):
+        return await asyncio.to_thread(run)
+
+# ─── 9) Optional extractive pre-compression ───────────────────────────────────
+# With a budget set, documents bigger than it are cut down to their
+# top-ranked sentences before the high-level summary (and map-reduce).
+# Retrieval for the expansions still searches the full chunks. 0 = off.
+COMPRESS_TOKEN_BUDGET = int(os.getenv("NOTERAG_COMPRESS_BUDGET", "0"))
+
+async def acompress(docs: List[Document], budget: int):
+    if budget <= 0 or sum(estimate_tokens(d.page_content) for d in docs) <= budget:
+        return docs, None
+    # ranking is CPU work; keep it off the event loop
+    with span("compress"):
+        return await asyncio.to_thread(compress_documents, docs, budget)
+
+# ─── 10) The real pipeline ────────────────────────────────────────────────────
+def parse_high_level(high_raw: str) -> List[str]:
     # extract lines beginning “1.”, “2.”, “3.”
     high_lines = [ln.strip() for ln in high_raw.split("\n") if re.match(r'^\d+\.', ln.strip())]
     # pad/truncate to exactly 3
     while len(high_lines) < 3:
         high_lines.append(f"{len(high_lines)+1}. Additional point.")
-    high_lines = high_lines[:3]
+    return high_lines[:3]
 
-    # b) expand each high‑level point
-    expand_raw = expand_chain.run([Document(page_content="\n".join(high_lines))]).strip()
-    expanded: List[List[str]] = []
-    current: List[str] = []
-    for ln in expand_raw.split("\n"):
-        ln = ln.strip()
-        if re.match(r'^\d+\.\d+', ln):
-            current.append(ln)
-        elif ln.lower().startswith("point") and current:
-            expanded.append(current)
-            current = []
-    if current:
-        expanded.append(current)
-    # pad to 3×3
-    while len(expanded) < 3:
-        expanded.append([f"{len(expanded)+1}.1 Extra", f"{len(expanded)+1}.2 Extra", f"{len(expanded)+1}.3 Extra"])
-    for i, section in enumerate(expanded):
-        while len(section) < 3:
-            section.append(f"{i+1}.{len(section)+1} Extra")
-
-    # c) extract topic & keywords from first high‑level sentence
-    seed = re.sub(r'^\d+\.\s*', '', high_lines[0])
-    topic = topic_chain.run({"text": seed}).strip()
-    raw_kw = keyword_chain.run({"text": seed})
-    keywords = [kw.strip() for kw in raw_kw.split(",") if kw.strip()]
+# An expansion with fewer than three points is asked for again, up to
+# EXPAND_RETRIES more times; after that the missing points are left empty
+# (clients index all three), never filled with made-up text.
+EXPAND_RETRIES = int(os.getenv("NOTERAG_EXPAND_RETRIES", "1"))
+
+def parse_points(raw: str, number: int) -> List[str]:
+    # lines beginning "n.1", "n.2", ...; renumbered under this idea, at most 3
+    points = [re.sub(r'^\d+\.\d+\.?\s*', '', ln.strip()) for ln in raw.split("\n")
+              if re.match(r'^\d+\.\d+', ln.strip())]
+    return [f"{number}.{j} {p}" for j, p in enumerate([p for p in points if p][:3], 1)]
 
+async def aexpand_idea(index: int, line: str, hits: List[Document]) -> List[str]:
+    inputs = expand_input(index, line, hits)
+    for attempt in range(EXPAND_RETRIES + 1):
+        with span("chain.expand"):
+            raw = await get_chains().expand.arun(inputs)
+        points = parse_points(raw, index + 1)
+        if len(points) == 3:
+            return points
+    logger.warning("Main idea %d expanded to %d points after %d attempts", index + 1, len(points), attempt + 1)
+    return points + [""] * (3 - len(points))
+
+async def aexpand_line(docs: List[Document], line: str, index: int) -> Dict:
+    # one main idea on its own, for lazy expansion: {"points", "sources"}
+    hits = (await aretrieve_passages(docs, [line]))[0]
+    return {"points": await aexpand_idea(index, line, hits), "sources": source_pages(hits)}
+
+class MetadataError(ValueError):
+    pass
+
+def parse_metadata(raw: str) -> Dict:
+    # strict: one JSON object, exactly the expected keys and types
+    body = raw.strip()
+    if body.startswith("```"):
+        body = re.sub(r'^```(?:json)?\s*|\s*```$', '', body)
+    try:
+        data = json.loads(body)
+    except json.JSONDecodeError as e:
+        raise MetadataError(f"not valid JSON ({e.msg})") from None
+    if not isinstance(data, dict) or set(data) != {"title", "topic", "keywords"}:
+        raise MetadataError('expected an object with keys "title", "topic" and "keywords"')
+    if not isinstance(data["title"], str) or not data["title"].strip():
+        raise MetadataError('"title" must be a non-empty string')
+    if not isinstance(data["topic"], str):
+        raise MetadataError('"topic" must be a string')
+    keywords = data["keywords"]
+    if not isinstance(keywords, list) or not all(isinstance(k, str) for k in keywords):
+        raise MetadataError('"keywords" must be a list of strings')
+    return {
+        "title": data["title"].strip(),
+        "topic": data["topic"].strip(),
+        "keywords": [k.strip() for k in keywords if k.strip()][:5],
+    }
+
+async def alocal_metadata(docs: List[Document], high_lines: List[str]) -> Dict:
+    # milliseconds for a handout, but proportional to the document; off the loop
+    with span("keywords"):
+        return await asyncio.to_thread(local_metadata, [d.page_content for d in docs], high_lines)
+
+async def allm_metadata(high_lines: List[str]) -> Dict:
+    with span("chain.meta"):
+        raw = await get_chains().meta.arun({"text": "\n".join(high_lines)})
+    return await _aparse_or_repair_metadata(raw, high_lines)
+
+async def aextract_metadata(high_lines: List[str], docs: List[Document]) -> Dict:
+    if METADATA_SOURCE == "local":
+        return await alocal_metadata(docs, high_lines)
+    return await allm_metadata(high_lines)
+
+async def _aparse_or_repair_metadata(raw: str, high_lines: List[str]) -> Dict:
+    try:
+        return parse_metadata(raw)
+    except MetadataError as e:
+        error = str(e)
+    # one bounded repair attempt, then fall back to what we already know
+    with span("chain.meta_repair"):
+        raw = await get_chains().meta_repair.arun({"text": raw, "error": error})
+    try:
+        return parse_metadata(raw)
+    except MetadataError as e:
+        logger.warning("Unusable metadata from LLM: %s", e)
+        return {"title": strip_number(high_lines[0]), "topic": "", "keywords": []}
+
+def _summary_dict(high_lines: List[str], expanded: List[List[str]], meta: Dict,
+                  passages: List[List[Document]], compression: Optional[Dict], chunk_reuse: Optional[Dict]) -> Dict:
     return {
         "high_level": high_lines,
         "expanded": expanded,
-        "topic": topic,
-        "keywords": keywords
+        "title": meta["title"],
+        "topic": meta["topic"],
+        "keywords": meta["keywords"],
+        # 1-based pages each idea's expansion was grounded in
+        "sources": [source_pages(hits) for hits in passages],
+        # None unless pre-compression ran
+        "compression": compression,
+        # {"chunks", "reused"}: map-step chunks whose summary came from the chunk cache; None without a map step
+        "chunk_reuse": chunk_reuse,
+    }
+
+async def astream_langchain_summary(text: Union[str, List[Document]], expand: bool = True) -> AsyncIterator[Dict]:
+    """
+    Runs the pipeline and yields typed events as soon as each piece exists:
+      {"type": "compression", ...}                      token counts, only when compression ran
+      {"type": "token",    "text": ...}                 high-level output as it streams
+      {"type": "line",     "index": i, "text": ...}     each of the three main ideas
+      {"type": "expanded", "index": i, "points": [...]}  one per idea, in the order they finish
+      {"type": "meta",     "title": ..., "topic": ..., "keywords": [...]}   may come before any "expanded"
+      {"type": "done",     "summary": {...}}            same dict agenerate_langchain_summary returns
+    Accepts raw text or chunks already produced by backend.ingest. With
+    expand=False there are no "expanded" events and every section of the
+    result is empty (see aexpand_line).
+    """
+    # a) split, optionally compress, & high‑level summary streamed token by token
+    docs = prepare_text_for_langchain(text) if isinstance(text, str) else text
+    summary_docs, compression = await acompress(docs, COMPRESS_TOKEN_BUDGET)
+    if compression is not None:
+        yield {"type": "compression", **compression}
+    with span("map_reduce"):
+        stuffed, chunk_reuse = await areduce_to_fit(summary_docs)
+
+    raw_parts: List[str] = []
+    pending = ""
+    sent = 0
+    chains = get_chains()
+    # includes time the consumer spends between tokens, which is ~0 except
+    # when a streaming client is slow to read
+    with span("chain.high_level"):
+        async for chunk in chains.llm.astream(high_level_prompt.format(text=stuffed)):
+            piece = chunk.content
+            if not piece:
+                continue
+            raw_parts.append(piece)
+            yield {"type": "token", "text": piece}
+            # a numbered line is final once its newline arrives
+            *complete, pending = (pending + piece).split("\n")
+            for ln in complete:
+                if sent < 3 and re.match(r'^\d+\.', ln.strip()):
+                    yield {"type": "line", "index": sent, "text": ln.strip()}
+                    sent += 1
+    high_lines = parse_high_level("".join(raw_parts).strip())
+    for i in range(sent, 3):
+        yield {"type": "line", "index": i, "text": high_lines[i]}
+
+    # b) everything else needs only the main ideas: the metadata call, and one
+    # expansion per idea from its own retrieved passages, all at once
+    meta_task = asyncio.ensure_future(aextract_metadata(high_lines, docs))
+    tasks: Dict[asyncio.Future, Optional[int]] = {meta_task: None}
+    passages: List[List[Document]] = [[] for _ in high_lines]
+    expanded: List[List[str]] = [[] for _ in high_lines]
+    try:
+        if expand:
+            passages = await aretrieve_passages(docs, high_lines)
+            for i, (line, hits) in enumerate(zip(high_lines, passages)):
+                tasks[asyncio.ensure_future(aexpand_idea(i, line, hits))] = i
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                i = tasks[task]
+                if i is None:
+                    meta = task.result()
+                    yield {"type": "meta", **meta}
+                else:
+                    expanded[i] = task.result()
+                    yield {"type": "expanded", "index": i, "points": expanded[i]}
+    finally:
+        # a failed call or a consumer that stopped listening leaves nothing running
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+    yield {"type": "done", "summary": _summary_dict(high_lines, expanded, meta, passages, compression, chunk_reuse)}
+
+async def agenerate_langchain_summary(text: Union[str, List[Document]], expand: bool = True) -> Dict:
+    # Same pipeline as generate_langchain_summary, but every LLM call goes
+    # through the async client so the event loop stays free while we wait.
+    async for event in astream_langchain_summary(text, expand):
+        if event["type"] == "done":
+            return event["summary"]
+    raise RuntimeError("summary stream ended without a result")
+
+def generate_langchain_summary(text: Union[str, List[Document]]) -> Dict:
+    # Blocking entry point for scripts; servers should await the async one.
+    return asyncio.run(agenerate_langchain_summary(text))
+
+
+# ─── 11) Batch mode ───────────────────────────────────────────────────────────
+# Many documents in one call, each through its own pipeline: a document
+# moves on to its next stage as soon as its own calls are back, never
+# waiting for the rest of the batch. LLM slots are the governor's global
+# limit, shared with every other request; while they are short, a batch's
+# calls go earliest stage first (see batch_priority), so no document falls
+# behind and finishes alone.
+BATCH_STAGE_ROUNDS = {"chain.reduce": 1, "chain.high_level": 2, "chain.expand": 3, "chain.meta": 3, "chain.meta_repair": 4}
+
+def batch_priority():
+    # calls made inside queue behind earlier-stage ones by their stage's round
+    return stage_priority(BATCH_STAGE_ROUNDS)
+
+async def abatch_langchain_summaries(docs_list: List[List[Document]]) -> List[Union[Dict, Exception]]:
+    """
+    Runs the pipeline for every document in `docs_list` and returns, in the
+    same order, the dict agenerate_langchain_summary would return, or the
+    exception that stopped that document. One failure never stops the rest.
+    """
+    with batch_priority():
+        return list(await asyncio.gather(
+            *(agenerate_langchain_summary(docs) for docs in docs_list), return_exceptions=True
+        ))
+
+
+# ─── 12) Answers from the notes corpus ───────────────────────────────────────
+answer_prompt = PromptTemplate(
+    template="""
+Answer the question using only the numbered passages from the student's notes.
+Use simple words and short sentences.
+After every sentence, cite the passages it is based on, like [1] or [2][3].
+If the passages do not answer the question, say so.
+
+PASSAGES:
+{passages}
+
+QUESTION: {question}
+
+ANSWER:
+""",
+    input_variables=["passages", "question"],
+)
+
+async def aanswer_question(question: str, hits: List[Dict]) -> Dict:
+    # `hits` as returned by Corpus.search; citations point back to note and page
+    def source(h: Dict) -> str:
+        title = h["title"] or "Untitled"
+        return f"{title}, page {h['page']}" if h["page"] else title
+
+    passages = "\n\n".join(f"[{i}] ({source(h)}) {h['text']}" for i, h in enumerate(hits, 1))
+    with span("chain.answer"):
+        message = await get_llm().ainvoke(answer_prompt.format(passages=passages, question=question))
+    text = str(message.content).strip()
+    cited = sorted({int(n) for n in re.findall(r"\[(\d+)\]", text) if 1 <= int(n) <= len(hits)})
+    return {
+        "text": text,
+        "citations": [{"ref": n, "note": hits[n - 1]["note"], "page": hits[n - 1]["page"]} for n in cited],
     }
 
+# ─── 13) Cache fingerprint ────────────────────────────────────────────────────
+# Bump when the parsing/padding logic above changes the output shape.
+PIPELINE_VERSION = "6"
 
+def pipeline_fingerprint() -> str:
+    # Everything that changes what generate_langchain_summary returns for the
+    # same input goes in here, so cached summaries go stale automatically.
+    h = hashlib.sha256()
+    for part in (
+        PIPELINE_VERSION, backend_fingerprint(),
+        high_level_prompt.template, expand_prompt.template,
+        meta_prompt.template, meta_repair_prompt.template,
+        map_prompt.template, reduce_prompt.template,
+        str(STUFF_TOKEN_LIMIT), str(MAP_GROUP_TOKENS), str(MAP_BOUNDARY_EVERY),
+        str(RETRIEVAL_TOP_K), get_embedder().fingerprint, str(COMPRESS_TOKEN_BUDGET), str(EXPAND_RETRIES), METADATA_SOURCE,
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
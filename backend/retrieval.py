@@ -0,0 +1,163 @@
+# retrieval.py
+#
+# Per-document passage retrieval for grounding the expansions. Chunks are
+# embedded with a local embedder (no API calls), stacked into one float32
+# matrix, and searched with a single matrix product + argpartition. The
+# matrix is saved as .npy keyed by the chunk contents and reopened with
+# mmap, so repeat requests on the same document skip re-embedding. The
+# directory is kept under a byte cap, least recently used files first (a
+# hit bumps its file's mtime).
+
+import hashlib
+import os
+import re
+import tempfile
+import zlib
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+# ─── Embedders ────────────────────────────────────────────────────────────────
+class HashingEmbedder:
+    """
+    Feature-hashed bag of words with sublinear term frequency and a signed
+    hash to cancel collisions. Deterministic across processes and runs.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.fingerprint = f"hashing-{dim}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        rows: List[int] = []
+        hashes: List[int] = []
+        for row, text in enumerate(texts):
+            tokens = _TOKEN.findall(text.lower())
+            rows.extend([row] * len(tokens))
+            hashes.extend(zlib.crc32(t.encode("utf-8")) for t in tokens)
+
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if hashes:
+            h = np.asarray(hashes, dtype=np.uint64)
+            cols = (h % self.dim).astype(np.int64)
+            # counts per (row, bucket, sign), then sublinear tf
+            flat = np.asarray(rows, dtype=np.int64) * self.dim + cols
+            signs = np.where((h >> np.uint64(31)) & np.uint64(1), -1.0, 1.0)
+            pos = np.bincount(flat[signs > 0], minlength=out.size)
+            neg = np.bincount(flat[signs < 0], minlength=out.size)
+            out = (np.log1p(pos) - np.log1p(neg)).astype(np.float32).reshape(out.shape)
+        norms = np.linalg.norm(out, axis=1, keepdims=True)
+        np.divide(out, norms, out=out, where=norms > 0)
+        return out
+
+
+EMBEDDERS: Dict[str, Callable[[], object]] = {
+    "hashing": lambda: HashingEmbedder(int(os.getenv("NOTERAG_EMBED_DIM", "512"))),
+}
+
+def register_embedder(name: str, factory: Callable[[], object]) -> None:
+    # factory() must return an object with .fingerprint and .embed(texts) -> (n, d) float32
+    EMBEDDERS[name] = factory
+
+_embedders: Dict[str, object] = {}
+
+def get_embedder(name: Optional[str] = None):
+    name = name or os.getenv("NOTERAG_EMBEDDER", "hashing")
+    if name not in _embedders:
+        if name not in EMBEDDERS:
+            raise ValueError(f"Unknown embedder {name!r}; choose from {sorted(EMBEDDERS)}")
+        _embedders[name] = EMBEDDERS[name]()
+    return _embedders[name]
+
+
+# ─── Index ────────────────────────────────────────────────────────────────────
+class ChunkIndex:
+    def __init__(self, docs: List[Document], vectors: np.ndarray, embedder):
+        self.docs = docs
+        self.vectors = vectors
+        self.embedder = embedder
+
+    def search(self, queries: List[str], k: int) -> List[List[Document]]:
+        # top-k chunks for every query, best first
+        if not self.docs or not queries:
+            return [[] for _ in queries]
+        k = min(k, len(self.docs))
+        scores = self.embedder.embed(queries) @ np.asarray(self.vectors).T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+        top = np.take_along_axis(top, order, axis=1)
+        return [[self.docs[i] for i in row] for row in top]
+
+
+def index_key(docs: List[Document], embedder) -> str:
+    h = hashlib.sha256(embedder.fingerprint.encode("utf-8"))
+    for d in docs:
+        h.update(b"\0")
+        h.update(d.page_content.encode("utf-8"))
+    return h.hexdigest()
+
+def evict_indexes(index_dir: str, max_bytes: int, keep: Optional[str] = None) -> int:
+    """
+    Deletes the least recently modified files in `index_dir` (never `keep`)
+    until the rest fit in `max_bytes`. Returns how many were deleted.
+    """
+    files = []
+    with os.scandir(index_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith(".tmp"):
+                continue                # still being written
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue                # deleted by another process meanwhile
+            files.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in files)
+    deleted = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)             # an open mmap of it stays valid
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return deleted
+
+def build_index(docs: List[Document], embedder=None, index_dir: Optional[str] = None, max_bytes: int = 0) -> ChunkIndex:
+    # max_bytes: cap for index_dir (0 = none)
+    embedder = embedder or get_embedder()
+    if not index_dir:
+        return ChunkIndex(docs, embedder.embed([d.page_content for d in docs]), embedder)
+
+    path = os.path.join(index_dir, index_key(docs, embedder) + ".npy")
+    try:
+        vectors = np.load(path, mmap_mode="r")
+        os.utime(path)                  # most recently used
+        return ChunkIndex(docs, vectors, embedder)
+    except FileNotFoundError:
+        pass
+
+    vectors = embedder.embed([d.page_content for d in docs])
+    os.makedirs(index_dir, exist_ok=True)
+    # a temp file of our own: other threads may be writing this same index
+    fd, tmp_path = tempfile.mkstemp(dir=index_dir, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, vectors)
+        os.replace(tmp_path, path)     # atomic, so readers never see half a file
+    except FileNotFoundError:
+        # the index dir was cleared meanwhile; the vectors are still good
+        pass
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if max_bytes:
+        evict_indexes(index_dir, max_bytes, keep=path)
+    return ChunkIndex(docs, vectors, embedder)
@@ -0,0 +1,97 @@
+# singleflight.py
+#
+# In-flight deduplication. The first caller for a key starts the work as
+# its own task; callers arriving while it runs wait on that same task and
+# get its result (or its exception). Waiters are shielded, so a client that
+# disconnects only stops waiting: the work carries on for everyone else and
+# still fills the cache. Nothing is remembered once the task finishes;
+# results live in the cache, and a failure is retried by the next caller.
+#
+# A task that produces a stream of events (the streaming endpoint) writes
+# them to an EventFeed as well, so every client that joins it gets the same
+# events live, from the first one on, however late it arrived.
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class SingleFlight:
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._counters = {"started": 0, "joined": 0, "failed": 0, "abandoned": 0}
+
+    def _finished(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # retrieve the exception so a failure nobody waited for isn't logged
+        # as "never retrieved"; the waiters have their own copy
+        if not task.cancelled() and task.exception() is not None:
+            self._counters["failed"] += 1
+
+    def claim(self, key: str, start: Callable[[], Awaitable[Any]]) -> Tuple[asyncio.Task, bool]:
+        """
+        The in-flight task for `key`, starting it with `start()` if there is
+        none, and whether this call started it. Synchronous, so the caller
+        knows its role before anything else can run.
+        """
+        task = self._tasks.get(key)
+        if task is not None:
+            self._counters["joined"] += 1
+            return task, False
+        task = asyncio.ensure_future(start())
+        self._tasks[key] = task
+        task.add_done_callback(lambda t: self._finished(key, t))
+        self._counters["started"] += 1
+        return task, True
+
+    def get(self, key: str) -> Optional[asyncio.Task]:
+        task = self._tasks.get(key)
+        if task is not None:
+            self._counters["joined"] += 1
+        return task
+
+    async def do(self, key: str, start: Callable[[], Awaitable[Any]]) -> Any:
+        task, _ = self.claim(key, start)
+        return await self.wait(task)
+
+    async def wait(self, task: asyncio.Task) -> Any:
+        # shielded: cancelling the waiter leaves the task running
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done():
+                self._counters["abandoned"] += 1
+            raise
+
+    def stats(self) -> Dict:
+        return {**self._counters, "in_flight": len(self._tasks)}
+
+
+class EventFeed:
+    def __init__(self):
+        self._events: List[Any] = []
+        self._closed = False
+        self._changed = asyncio.Event()
+
+    def _wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, event: Any) -> None:
+        self._events.append(event)
+        self._wake()
+
+    def close(self) -> None:
+        self._closed = True
+        self._wake()
+
+    async def follow(self) -> AsyncIterator[Any]:
+        # every event so far, then each new one until close()
+        seen = 0
+        while True:
+            while seen < len(self._events):
+                yield self._events[seen]
+                seen += 1
+            if self._closed:
+                return
+            await self._changed.wait()
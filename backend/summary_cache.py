@@ -0,0 +1,217 @@
+# summary_cache.py
+#
+# Content-addressed result cache for /api/simplify_pdf.
+# Key = sha256(uploaded bytes) + fingerprint of the pipeline (prompts, model,
+# temperature), so re-uploads of the same handout skip parsing and every LLM
+# call, while a prompt or model change simply stops matching old entries.
+#
+# Every method takes a lock and may touch SQLite: async code calls them
+# through asyncio.to_thread. Hits don't write: their access times are kept
+# in memory and written in one statement with the next put (or every
+# TOUCH_BATCH hits), and the bytes on disk are a running total, so neither
+# a lookup nor a store scans the table.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+TOUCH_BATCH = 64
+
+
+def make_cache_key(content_hash: str, fingerprint: str) -> str:
+    return hashlib.sha256(f"{content_hash}:{fingerprint}".encode("utf-8")).hexdigest()
+
+
+class SummaryCache:
+    """
+    Two tiers: a bounded in-process LRU in front of an optional SQLite file.
+    Entries expire after `ttl_seconds`; the SQLite tier is trimmed by
+    least-recent access once it grows past `max_bytes`. Each entry keeps
+    what it cost to compute (seconds, LLM tokens), and hits add that up in
+    the saved_seconds / saved_tokens counters.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        memory_items: int = 256,
+        max_bytes: int = 256 * 1024 * 1024,
+        ttl_seconds: float = 7 * 24 * 3600,
+    ):
+        self.memory_items = memory_items
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # key -> (value, expires_at, compute_seconds, tokens)
+        self._memory: "OrderedDict[str, Tuple[Dict, float, float, int]]" = OrderedDict()
+        self._touched: Dict[str, float] = {}      # key -> access time not yet on disk
+        self._disk_bytes = 0
+        self._counters = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "saved_seconds": 0.0,
+            "saved_tokens": 0,
+        }
+
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key             TEXT PRIMARY KEY,
+                    value           TEXT NOT NULL,
+                    size            INTEGER NOT NULL,
+                    compute_seconds REAL NOT NULL,
+                    created_at      REAL NOT NULL,
+                    accessed_at     REAL NOT NULL,
+                    tokens          INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            if "tokens" not in {row[1] for row in self._db.execute("PRAGMA table_info(entries)")}:
+                self._db.execute("ALTER TABLE entries ADD COLUMN tokens INTEGER NOT NULL DEFAULT 0")
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries(accessed_at)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries(created_at)")
+            self._db.commit()
+            (self._disk_bytes,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+
+    @classmethod
+    def from_env(
+        cls, prefix: str = "NOTERAG_CACHE", path: str = ".noterag_cache/summaries.sqlite3", memory_items: int = 256
+    ) -> "SummaryCache":
+        # <prefix>_PATH="" turns the on-disk tier off
+        return cls(
+            path=os.getenv(f"{prefix}_PATH", path) or None,
+            memory_items=int(os.getenv(f"{prefix}_MEMORY_ITEMS", str(memory_items))),
+            max_bytes=int(os.getenv(f"{prefix}_MAX_BYTES", str(256 * 1024 * 1024))),
+            ttl_seconds=float(os.getenv(f"{prefix}_TTL", str(7 * 24 * 3600))),
+        )
+
+    # ─── lookups ──────────────────────────────────────────────────────────────
+    def get(self, key: str) -> Optional[Dict]:
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit is not None:
+                value, expires_at, compute_seconds, tokens = hit
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self._counted_hit("memory_hits", compute_seconds, tokens)
+                    self._touch(key, now)
+                    return value
+                del self._memory[key]
+
+            if self._db is not None:
+                # an expired row is left for _evict_disk
+                row = self._db.execute(
+                    "SELECT value, compute_seconds, tokens, created_at FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and row[3] + self.ttl_seconds > now:
+                    raw, compute_seconds, tokens, created_at = row
+                    value = json.loads(raw)
+                    self._remember(key, value, created_at + self.ttl_seconds, compute_seconds, tokens)
+                    self._counted_hit("disk_hits", compute_seconds, tokens)
+                    self._touch(key, now)
+                    return value
+
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, key: str, value: Dict, compute_seconds: float = 0.0, tokens: int = 0) -> None:
+        # compute_seconds / tokens: what producing `value` cost
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now + self.ttl_seconds, compute_seconds, tokens)
+            self._counters["stores"] += 1
+            if self._db is not None:
+                raw = json.dumps(value, ensure_ascii=False)
+                size = len(raw.encode("utf-8"))
+                old = self._db.execute("SELECT size FROM entries WHERE key = ?", (key,)).fetchone()
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, size, compute_seconds, created_at, accessed_at, tokens)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, raw, size, compute_seconds, now, now, tokens),
+                )
+                self._disk_bytes += size - (old[0] if old else 0)
+                self._touched.pop(key, None)
+                self._flush_touches()
+                self._evict_disk(now)
+                self._db.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            out = dict(self._counters)
+            out["memory_entries"] = len(self._memory)
+            if self._db is not None:
+                count, self._disk_bytes = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+                ).fetchone()
+                out["disk_entries"] = count
+                out["disk_bytes"] = self._disk_bytes
+        lookups = out["memory_hits"] + out["disk_hits"] + out["misses"]
+        out["hit_rate"] = (out["memory_hits"] + out["disk_hits"]) / lookups if lookups else 0.0
+        return out
+
+    # ─── bookkeeping and eviction (caller holds the lock) ─────────────────────
+    def _counted_hit(self, kind: str, compute_seconds: float, tokens: int) -> None:
+        self._counters[kind] += 1
+        self._counters["saved_seconds"] += compute_seconds
+        self._counters["saved_tokens"] += tokens
+
+    def _touch(self, key: str, now: float) -> None:
+        if self._db is None:
+            return
+        self._touched[key] = now
+        if len(self._touched) >= TOUCH_BATCH:
+            self._flush_touches()
+            self._db.commit()
+
+    def _flush_touches(self) -> None:
+        if self._touched:
+            self._db.executemany(
+                "UPDATE entries SET accessed_at = ? WHERE key = ? AND accessed_at < ?",
+                [(at, key, at) for key, at in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def _remember(self, key: str, value: Dict, expires_at: float, compute_seconds: float, tokens: int) -> None:
+        self._memory[key] = (value, expires_at, compute_seconds, tokens)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _evict_disk(self, now: float) -> None:
+        # both queries are index range scans, usually over nothing
+        cutoff = now - self.ttl_seconds
+        expired, expired_bytes = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries WHERE created_at < ?", (cutoff,)
+        ).fetchone()
+        if expired:
+            self._db.execute("DELETE FROM entries WHERE created_at < ?", (cutoff,))
+            self._counters["evictions"] += expired
+            self._disk_bytes -= expired_bytes
+        # drop least-recently-used rows until we're back under the ceiling
+        while self._disk_bytes > self.max_bytes:
+            rows = self._db.execute("SELECT key, size FROM entries ORDER BY accessed_at LIMIT 64").fetchall()
+            if not rows:
+                # another process sharing the file deleted them: recount
+                (self._disk_bytes,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()
+                break
+            for key, size in rows:
+                if self._disk_bytes <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._counters["evictions"] += 1
+                self._disk_bytes -= size
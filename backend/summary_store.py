@@ -0,0 +1,233 @@
+# summary_store.py
+#
+# Every Summary object the API returns, kept so the app can list its notes
+# by folder and open one again without re-uploading the PDF. One row per
+# file, found by the hash of its bytes, so the same file summarized again
+# (even under another model or prompt, which gives it a new "doc" handle)
+# updates its row and keeps its id. A row holds what a listing shows:
+# title, topic, keywords, folder, handle, times and ETag. The full object, with its lines
+# and expanded sections, is a zlib-compressed JSON blob in a table of its
+# own that only a single-summary fetch reads, so listings scan narrow rows.
+#
+# Listings are newest first and paginated by an opaque cursor (the last
+# row's created_at and id) instead of an offset: a page deep in millions of
+# rows costs the same index seek as the first one, and rows added meanwhile
+# don't shift the pages after it.
+#
+# ETags are strong: the hash of the stored object, kept in its row, so a
+# conditional fetch is answered without reading or decompressing the body.
+
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_at: float, summary_id: int) -> str:
+    raw = json.dumps([created_at, summary_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    try:
+        created_at, summary_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(created_at), int(summary_id)
+    except Exception:
+        raise InvalidCursorError("Invalid cursor.")
+
+def make_etag(*parts: str) -> str:
+    # quoted, as the header carries it
+    return '"' + hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:32] + '"'
+
+
+class SummaryStore:
+    def __init__(self, path: Optional[str] = None):
+        self._lock = threading.Lock()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS summaries (
+                id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                doc        TEXT UNIQUE NOT NULL,
+                folder     TEXT NOT NULL,
+                title      TEXT NOT NULL,
+                topic      TEXT,
+                keywords   TEXT NOT NULL,
+                etag       TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS summaries_created ON summaries(created_at, id);
+            CREATE INDEX IF NOT EXISTS summaries_folder ON summaries(folder, created_at, id);
+            CREATE TABLE IF NOT EXISTS summary_bodies (
+                id   INTEGER PRIMARY KEY REFERENCES summaries(id),
+                body BLOB NOT NULL
+            );
+            -- kept up to date on write: counting an indexed column over
+            -- millions of rows on every sidebar load is not
+            CREATE TABLE IF NOT EXISTS folders (
+                name      TEXT PRIMARY KEY,
+                summaries INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            """
+        )
+        if "content" not in {row[1] for row in self._db.execute("PRAGMA table_info(summaries)")}:
+            self._db.execute("ALTER TABLE summaries ADD COLUMN content TEXT")
+        self._db.execute("CREATE UNIQUE INDEX IF NOT EXISTS summaries_content ON summaries(content)")
+        self._db.commit()
+
+    @classmethod
+    def from_env(cls) -> "SummaryStore":
+        # NOTERAG_SUMMARY_STORE_PATH="" keeps the store in memory only. Users'
+        # notes, not a cache: kept out of .noterag_cache, which is safe to delete
+        return cls(path=os.getenv("NOTERAG_SUMMARY_STORE_PATH", ".noterag_data/summary_store.sqlite3") or None)
+
+    def _count(self, folder: str, delta: int) -> None:
+        self._db.execute(
+            "INSERT INTO folders VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET summaries = summaries + excluded.summaries",
+            (folder, delta),
+        )
+        self._db.execute("DELETE FROM folders WHERE name = ? AND summaries <= 0", (folder,))
+
+    def _find(self, doc: str, content: Optional[str]) -> Optional[Tuple[int, str, str, str]]:
+        # the file's row (id, folder, etag, doc): by content hash, else by
+        # handle (an expansion of a lazy summary, rows stored before hashes)
+        row = None
+        if content is not None:
+            row = self._db.execute("SELECT id, folder, etag, doc FROM summaries WHERE content = ?", (content,)).fetchone()
+        if row is None:
+            row = self._db.execute("SELECT id, folder, etag, doc FROM summaries WHERE doc = ?", (doc,)).fetchone()
+        return row
+
+    def _drop(self, summary_id: int, folder: str) -> None:
+        self._db.execute("DELETE FROM summary_bodies WHERE id = ?", (summary_id,))
+        self._db.execute("DELETE FROM summaries WHERE id = ?", (summary_id,))
+        self._count(folder, -1)
+
+    def _put(self, doc: str, summary: Dict, folder: Optional[str], content: Optional[str], now: float) -> Dict:
+        # caller holds the lock; `folder` None keeps the row's folder ("" for a new row)
+        row = self._find(doc, content)
+        if row is not None and row[3] != doc:
+            # new handle for the same file: an older duplicate row under it goes
+            other = self._db.execute("SELECT id, folder FROM summaries WHERE doc = ?", (doc,)).fetchone()
+            if other is not None:
+                self._drop(*other)
+        folder = folder if folder is not None else (row[1] if row else "")
+        obj = {**{k: v for k, v in summary.items() if k != "id"}, "doc": doc, "folder": folder}
+        body = json.dumps(obj, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+        columns = (folder, obj.get("title") or "", obj.get("topic"), json.dumps(obj.get("keywords") or [], ensure_ascii=False))
+        if row is None:
+            summary_id = self._db.execute(
+                "INSERT INTO summaries (doc, content, folder, title, topic, keywords, etag, created_at, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, '', ?, ?)",
+                (doc, content, *columns, now, now),
+            ).lastrowid
+            self._count(folder, 1)
+        else:
+            summary_id = row[0]
+            if row[1] != folder:
+                self._count(row[1], -1)
+                self._count(folder, 1)
+        etag = make_etag(str(summary_id), body)
+        if row is not None and row[2] == etag:
+            return {**obj, "id": summary_id}
+        self._db.execute(
+            "UPDATE summaries SET doc = ?, content = COALESCE(?, content), folder = ?, title = ?, topic = ?,"
+            " keywords = ?, etag = ?, updated_at = ? WHERE id = ?",
+            (doc, content, *columns, etag, now, summary_id),
+        )
+        self._db.execute(
+            "INSERT OR REPLACE INTO summary_bodies VALUES (?, ?)",
+            (summary_id, zlib.compress(body.encode("utf-8"), 6)),
+        )
+        return {**obj, "id": summary_id}
+
+    def put_many(self, items: Sequence[Tuple[str, Dict, Optional[str], Optional[str]]]) -> List[Dict]:
+        """
+        Stores (doc, summary object, folder, content hash) tuples in one
+        transaction and returns each object as stored: with its id, doc and
+        folder. A known content hash updates that file's row; None updates
+        the row of `doc`, if any. An unchanged summary is not rewritten.
+        """
+        now = time.time()
+        with self._lock:
+            try:
+                out = [self._put(doc, summary, folder, content, now) for doc, summary, folder, content in items]
+            except BaseException:
+                self._db.rollback()
+                raise
+            self._db.commit()
+        return out
+
+    def put(self, doc: str, summary: Dict, folder: Optional[str] = None, content: Optional[str] = None) -> Dict:
+        return self.put_many([(doc, summary, folder, content)])[0]
+
+    def etag(self, summary_id: int) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT etag FROM summaries WHERE id = ?", (summary_id,)).fetchone()
+        return row[0] if row else None
+
+    def get(self, summary_id: int) -> Optional[Tuple[Dict, str]]:
+        # (the stored object with its id and times, etag)
+        with self._lock:
+            row = self._db.execute(
+                "SELECT s.etag, s.created_at, s.updated_at, b.body FROM summaries s"
+                " JOIN summary_bodies b ON b.id = s.id WHERE s.id = ?",
+                (summary_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        etag, created_at, updated_at, body = row
+        obj = json.loads(zlib.decompress(body))
+        return {**obj, "id": summary_id, "created_at": created_at, "updated_at": updated_at}, etag
+
+    def list(self, folder: Optional[str] = None, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[Dict], Optional[str]]:
+        """
+        One page of summaries, newest first, without their lines or
+        expanded sections; all folders unless `folder` is given ("" is the
+        unfiled ones). Returns the page and the cursor of the next one
+        (None on the last page). Raises InvalidCursorError.
+        """
+        sql = "SELECT id, doc, folder, title, topic, keywords, etag, created_at, updated_at FROM summaries"
+        where, params = [], []
+        if folder is not None:
+            where.append("folder = ?")
+            params.append(folder)
+        if cursor:
+            where.append("(created_at, id) < (?, ?)")
+            params.extend(decode_cursor(cursor))
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+        params.append(limit + 1)
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        page = [
+            {"id": r[0], "doc": r[1], "folder": r[2], "title": r[3], "topic": r[4], "keywords": json.loads(r[5]),
+             "etag": r[6], "created_at": r[7], "updated_at": r[8]}
+            for r in rows[:limit]
+        ]
+        more = len(rows) > limit
+        return page, encode_cursor(page[-1]["created_at"], page[-1]["id"]) if more else None
+
+    def folders(self) -> List[Dict]:
+        with self._lock:
+            rows = self._db.execute("SELECT name, summaries FROM folders ORDER BY name").fetchall()
+        return [{"name": name, "summaries": n} for name, n in rows]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            (summaries, folders) = self._db.execute("SELECT COALESCE(SUM(summaries), 0), COUNT(*) FROM folders").fetchone()
+        return {"summaries": summaries, "folders": folders}
@@ -0,0 +1,82 @@
+# tracing.py
+#
+# Per-request stage timing. A Trace is attached to the current context
+# (contextvars, so it follows the request through awaits and tasks); code
+# wraps each stage in `with span("name"):` and the elapsed seconds land on
+# whatever Trace is active. Observers (backend.metrics registers one) see
+# every span, traced or not; the innermost open span's name is available to
+# code that wants to label its own numbers, e.g. LLM token counts.
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+class Trace:
+    def __init__(self):
+        self.spans: List[Tuple[str, float]] = []
+
+    def add(self, name: str, seconds: float) -> None:
+        self.spans.append((name, seconds))
+
+    def totals(self) -> Dict[str, float]:
+        # stages that ran more than once (e.g. map calls) are summed
+        out: Dict[str, float] = {}
+        for name, seconds in self.spans:
+            out[name] = out.get(name, 0.0) + seconds
+        return out
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("noterag_trace", default=None)
+_stage: ContextVar[Optional[str]] = ContextVar("noterag_stage", default=None)
+_observers: List[Callable[[str, float], None]] = []
+
+def add_observer(observer: Callable[[str, float], None]) -> None:
+    _observers.append(observer)
+
+def start_trace() -> Trace:
+    trace = Trace()
+    _current.set(trace)
+    return trace
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+@contextmanager
+def request_trace() -> Iterator[Trace]:
+    # a fresh trace for one request, unless the caller already started one
+    # (e.g. a benchmark driving the app in-process)
+    trace = _current.get()
+    if trace is not None:
+        yield trace
+        return
+    trace = start_trace()
+    try:
+        yield trace
+    finally:
+        _current.set(None)
+
+def current_stage() -> Optional[str]:
+    return _stage.get()
+
+def record(name: str, seconds: float) -> None:
+    # for durations measured elsewhere, e.g. inside a worker process
+    for observer in _observers:
+        observer(name, seconds)
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    # set/restore rather than reset(token): a span inside an async generator
+    # may be closed from a different context than the one that opened it
+    outer = _stage.get()
+    _stage.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+        _stage.set(outer)
@@ -0,0 +1,192 @@
+# uploads.py
+#
+# Bounded upload intake. The multipart parser has already put the file in a
+# SpooledTemporaryFile (never more than the request body cap in api.py,
+# which also holds for bodies sent without a Content-Length); from there we
+# copy it in fixed-size chunks (hashing as we go) into our own buffer, which
+# stays in memory for small files and moves to a temp file past
+# NOTERAG_UPLOAD_SPOOL_BYTES, so no upload is ever held in RAM whole. The
+# temp file is deleted when it is closed: by Upload.aclose(), on an error,
+# or when the object is collected. Before anything is copied:
+#
+#   - files over NOTERAG_MAX_UPLOAD_BYTES are refused (413)
+#   - files that don't start like a PDF are refused (415)
+#   - the file's size is reserved from a process-wide in-flight budget
+#     (NOTERAG_UPLOAD_INFLIGHT_BYTES); if it doesn't free up within
+#     NOTERAG_UPLOAD_WAIT seconds the upload is refused (503, Retry-After)
+#
+# The reservation is held until the caller is done with the bytes (after
+# parsing), so parse memory is bounded by the budget too.
+
+import asyncio
+import hashlib
+import io
+import os
+import tempfile
+from typing import IO, Optional
+
+from fastapi import UploadFile
+
+from backend.ingest import PDFIngestError, PDFSource, PDFTooLargeError
+
+MAX_UPLOAD_BYTES = int(os.getenv("NOTERAG_MAX_UPLOAD_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("NOTERAG_UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_SPOOL_BYTES = int(os.getenv("NOTERAG_UPLOAD_SPOOL_BYTES", str(4 * 1024 * 1024)))
+INFLIGHT_BYTES = int(os.getenv("NOTERAG_UPLOAD_INFLIGHT_BYTES", str(256 * 1024 * 1024)))
+UPLOAD_WAIT = float(os.getenv("NOTERAG_UPLOAD_WAIT", "10"))
+
+# PDF readers accept junk before the header, as long as it's near the start
+PDF_MAGIC = b"%PDF-"
+MAGIC_WINDOW = 1024
+
+
+class NotAPDFError(PDFIngestError):
+    status_code = 415
+
+
+class UploadBusyError(PDFIngestError):
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class ByteBudget:
+    """
+    Counting semaphore over bytes. acquire(n) waits (up to `wait` seconds)
+    until n more bytes fit under `limit`, else raises UploadBusyError.
+    """
+
+    def __init__(self, limit: int, wait: float):
+        self.limit = limit
+        self.wait = wait
+        self.used = 0
+        self.peak = 0
+        self.rejected = 0
+        self._cond: Optional[asyncio.Condition] = None
+
+    def _condition(self) -> asyncio.Condition:
+        # created lazily so it binds to the running loop, not the importer's
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self, n: int) -> None:
+        cond = self._condition()
+        async with cond:
+            try:
+                await asyncio.wait_for(cond.wait_for(lambda: self.used + n <= self.limit), self.wait)
+            except asyncio.TimeoutError:
+                self.rejected += 1
+                raise UploadBusyError("Too many uploads in progress. Please retry shortly.", max(1, round(self.wait))) from None
+            self.used += n
+            self.peak = max(self.peak, self.used)
+
+    async def release(self, n: int) -> None:
+        cond = self._condition()
+        async with cond:
+            self.used -= n
+            cond.notify_all()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "used": self.used, "peak": self.peak, "rejected": self.rejected}
+
+
+upload_budget = ByteBudget(INFLIGHT_BYTES, UPLOAD_WAIT)
+
+
+class Upload:
+    """
+    A received upload: its sha256, size, and `source` for backend.ingest
+    (bytes when small, else the path of a temp file, open in `spooled`
+    until aclose()). release() returns the budget reservation once the
+    bytes are parsed; aclose() also deletes the temp file. Both are safe to
+    call twice.
+    """
+
+    def __init__(self, sha256: str, size: int, source: PDFSource, reserved: int, budget: ByteBudget,
+                 spooled: Optional[IO[bytes]] = None):
+        self.sha256 = sha256
+        self.size = size
+        self.source = source
+        self._spooled = spooled
+        self._reserved = reserved
+        self._budget = budget
+
+    async def release(self) -> None:
+        if self._reserved:
+            reserved, self._reserved = self._reserved, 0
+            await self._budget.release(reserved)
+
+    async def aclose(self) -> None:
+        if self._spooled is not None:
+            spooled, self._spooled = self._spooled, None
+            spooled.close()
+        self.source = b""
+        await self.release()
+
+
+async def _declared_size(file: UploadFile) -> int:
+    if file.size is not None:
+        return file.size
+    # no size from the parser: measure the spooled file without reading it
+    position = file.file.seek(0, os.SEEK_END)
+    file.file.seek(0)
+    return position
+
+
+async def receive_upload(
+    file: UploadFile,
+    budget: ByteBudget = upload_budget,
+    max_bytes: int = MAX_UPLOAD_BYTES,
+    spool_bytes: int = UPLOAD_SPOOL_BYTES,
+) -> Upload:
+    """
+    Checks size and magic bytes, reserves the size from `budget`, then
+    copies the file in UPLOAD_CHUNK_BYTES pieces. spool_bytes=0 always
+    spools to disk (for uploads that wait in the job queue).
+    """
+    size = await _declared_size(file)
+    if size > max_bytes:
+        raise PDFTooLargeError(f"Upload is {size} bytes; the limit is {max_bytes}.")
+
+    head = await file.read(MAGIC_WINDOW)
+    if PDF_MAGIC not in head:
+        raise NotAPDFError("Upload is not a PDF.")
+
+    if size > budget.limit:
+        raise PDFTooLargeError(f"Upload is {size} bytes; the limit is {budget.limit}.")
+    await budget.acquire(size)
+
+    digest = hashlib.sha256()
+    buffer = io.BytesIO()
+    spooled = None
+    received = 0
+    chunk = head
+    try:
+        while chunk:
+            received += len(chunk)
+            if received > max_bytes:
+                # the parser's size was wrong; trust what we actually read
+                raise PDFTooLargeError(f"Upload is over the {max_bytes}-byte limit.")
+            digest.update(chunk)
+            if spooled is None and received > spool_bytes:
+                spooled = tempfile.NamedTemporaryFile(prefix="noterag-", suffix=".pdf")
+                spooled.write(buffer.getbuffer())
+                buffer = io.BytesIO()
+            (spooled or buffer).write(chunk)
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+    except BaseException:
+        if spooled is not None:
+            spooled.close()
+        await budget.release(size)
+        raise
+
+    if spooled is not None:
+        # stays open (and on disk) for the parse pool to read by path
+        spooled.flush()
+        source: PDFSource = spooled.name
+    else:
+        source = buffer.getvalue()
+    return Upload(digest.hexdigest(), received, source, size, budget, spooled)
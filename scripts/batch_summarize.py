@@ -0,0 +1,324 @@
+# batch_summarize.py
+#
+# Headless batch runner for a backlog of course notes (what
+# langchain_rag_template_v2.py does one Colab upload at a time). Walks a
+# directory for .txt and .pdf files and summarizes them in a process pool:
+# each worker takes --batch-size files, runs them through the pipeline's
+# batch mode and renders their outputs itself. Per input file, under --out
+# with the same relative path:
+#
+#   <name>_ios_summary.json   the iOS app's summary format
+#   <name>_summary.pdf        printable summary (reportlab)
+#
+# and one line per document in <out>/summaries.jsonl.
+#
+# --llm-concurrency caps LLM calls in flight across all workers: each
+# worker's governor gets an equal share as its hard ceiling (and an equal
+# share of NOTERAG_LLM_RPM / NOTERAG_LLM_TPM, when set), so there are never
+# more workers than slots.
+#
+# <out>/manifest.jsonl records every finished document with the SHA-256 of
+# its input. A rerun skips documents already done with unchanged content and
+# retries failed ones, so an interrupted run picks up where it stopped.
+# Ctrl-C stops handing out batches and records the ones already running (a
+# second Ctrl-C quits at once). A document cut off between its
+# summaries.jsonl line and its manifest entry is redone and appears twice
+# there; the later line wins.
+#
+#   NOTERAG_LLM_BACKEND=fake python scripts/batch_summarize.py notes/ --out out/ --workers 4 --llm-concurrency 16
+
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import re
+import signal
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+EXTENSIONS = (".txt", ".pdf")
+
+
+# ─── Outputs ──────────────────────────────────────────────────────────────────
+def strip_number(line: str) -> str:
+    return re.sub(r'^\d+(?:\.\d+)?\.?\s*', '', line)
+
+def ios_json(summary: Dict, name: str) -> Dict:
+    return {
+        "document": {
+            "title": summary.get("title") or name,
+            "topic": summary.get("topic", ""),
+            "keywords": summary.get("keywords", []),
+            "summary": {
+                "highlevel": [{"id": i, "text": strip_number(line)} for i, line in enumerate(summary["high_level"], 1)],
+                "expanded": [
+                    {"id": i, "details": [{"id": f"{i}.{j}", "text": strip_number(point)}
+                                          for j, point in enumerate(section, 1)]}
+                    for i, section in enumerate(summary["expanded"], 1)
+                ],
+            },
+        },
+        "metadata": {
+            "version": "1.0",
+            "generatedAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "format": "ios-summary",
+        },
+    }
+
+def render_pdf(summary: Dict, path: str) -> None:
+    # same layout as the Colab script's create_pdf_summary
+    from xml.sax.saxutils import escape
+
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle('CustomTitle', parent=styles['Title'], fontSize=16, alignment=1, spaceAfter=12)
+    heading_style = ParagraphStyle('CustomHeading', parent=styles['Heading1'], fontSize=14, spaceAfter=6)
+    subheading_style = ParagraphStyle('CustomSubHeading', parent=styles['Heading2'], fontSize=12, spaceAfter=4)
+    body_style = ParagraphStyle('CustomBody', parent=styles['Normal'], fontSize=11, leading=14)
+    meta_style = ParagraphStyle('CustomMeta', parent=styles['Normal'], fontSize=10, leading=12, textColor='#666666')
+
+    story = [Paragraph(escape(summary.get("title") or "Document Summary"), title_style), Spacer(1, 0.15 * inch)]
+    if summary.get("topic"):
+        story.append(Paragraph(f"Topic: {escape(summary['topic'])}", meta_style))
+    if summary.get("keywords"):
+        story.append(Paragraph(f"Keywords: {escape(', '.join(summary['keywords']))}", meta_style))
+    story.append(Spacer(1, 0.25 * inch))
+
+    story.append(Paragraph("Main Ideas", heading_style))
+    for i, line in enumerate(summary["high_level"], 1):
+        story.append(Paragraph(f"{i}. {escape(strip_number(line))}", body_style))
+    story.append(Spacer(1, 0.25 * inch))
+
+    story.append(Paragraph("Detailed Explanations", heading_style))
+    for i, section in enumerate(summary["expanded"], 1):
+        story.append(Paragraph(f"Point {i}", subheading_style))
+        for j, point in enumerate(section, 1):
+            if point:
+                story.append(Paragraph(f"{i}.{j} {escape(strip_number(point))}", body_style))
+        story.append(Spacer(1, 0.15 * inch))
+
+    SimpleDocTemplate(path, pagesize=letter).build(story)
+
+def write_atomic(path: str, write) -> None:
+    # a half-written file from an interrupted run never looks finished
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp{os.getpid()}"
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def output_base(out_dir: str, rel: str) -> str:
+    # "Schrödinger's_Cat..txt" -> "<out>/Schrödinger's_Cat"
+    return os.path.join(out_dir, os.path.splitext(rel)[0].rstrip("."))
+
+
+# ─── Workers ──────────────────────────────────────────────────────────────────
+_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def init_worker(env: Dict[str, str]) -> None:
+    # one event loop per worker for its whole life: the LLM client's
+    # connections belong to the loop they were opened on. Ctrl-C is the
+    # parent's to handle: it lets the running batches finish
+    global _loop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    os.environ.update(env)
+    _loop = asyncio.new_event_loop()
+
+def load(path: str):
+    from backend.ingest import load_pdf_chunks
+    from backend.rag_pipeline import prepare_text_for_langchain
+
+    if path.lower().endswith(".pdf"):
+        return load_pdf_chunks(path)
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return prepare_text_for_langchain(f.read())
+
+def summarize_batch(jobs: List[Tuple[str, str, str]], out_dir: str, formats: List[str]) -> List[Dict]:
+    """
+    (path, relative path, sha256) triples in; one manifest record per file
+    out, in the same order, with "summary" added for finished documents.
+    """
+    from backend.rag_pipeline import abatch_langchain_summaries
+
+    started = time.perf_counter()
+    records: List[Dict] = [{"source": rel, "sha256": sha} for _, rel, sha in jobs]
+    loaded: List[Tuple[int, object]] = []
+    for n, (path, _, _) in enumerate(jobs):
+        try:
+            docs = load(path)
+            if not docs:
+                raise ValueError("no text found")
+            loaded.append((n, docs))
+        except Exception as e:
+            records[n].update(status="failed", error=f"{type(e).__name__}: {e}")
+
+    results = _loop.run_until_complete(abatch_langchain_summaries([docs for _, docs in loaded])) if loaded else []
+    for (n, _), result in zip(loaded, results):
+        record = records[n]
+        if isinstance(result, Exception):
+            record.update(status="failed", error=f"{type(result).__name__}: {result}")
+            continue
+        base = output_base(out_dir, record["source"])
+        outputs = []
+        try:
+            if "ios" in formats:
+                def dump(tmp: str) -> None:
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        json.dump(ios_json(result, os.path.basename(base)), f, ensure_ascii=False, indent=2)
+                write_atomic(base + "_ios_summary.json", dump)
+                outputs.append(base + "_ios_summary.json")
+            if "pdf" in formats:
+                write_atomic(base + "_summary.pdf", lambda tmp: render_pdf(result, tmp))
+                outputs.append(base + "_summary.pdf")
+        except Exception as e:
+            record.update(status="failed", error=f"{type(e).__name__}: {e}")
+            continue
+        record.update(status="ok", outputs=outputs, summary=result)
+    elapsed = time.perf_counter() - started
+    for record in records:
+        record["seconds"] = round(elapsed / len(records), 3)
+    return records
+
+
+# ─── Manifest ─────────────────────────────────────────────────────────────────
+def sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def load_manifest(path: str) -> Dict[str, Dict]:
+    # source -> its latest record; a torn last line (killed mid-write) is skipped
+    done: Dict[str, Dict] = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                done[record["source"]] = record
+    return done
+
+def find_inputs(root: str) -> List[str]:
+    found = []
+    for folder, dirs, names in os.walk(root):
+        dirs.sort()
+        found.extend(os.path.join(folder, n) for n in sorted(names) if n.lower().endswith(EXTENSIONS))
+    return found
+
+def append_line(f, record: Dict) -> None:
+    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+def worker_env(workers: int, cap: int) -> Dict[str, str]:
+    share = str(cap // workers)
+    env = {
+        "NOTERAG_LLM_CONCURRENCY": share,
+        "NOTERAG_LLM_MAX_CONCURRENCY": share,
+    }
+    for name in ("NOTERAG_LLM_RPM", "NOTERAG_LLM_TPM"):
+        if float(os.getenv(name, "0")) > 0:
+            env[name] = str(float(os.environ[name]) / workers)
+    return env
+
+
+def main(args) -> int:
+    formats = [f for f in args.formats.split(",") if f]
+    os.makedirs(args.out, exist_ok=True)
+    manifest_path = os.path.join(args.out, "manifest.jsonl")
+    done = load_manifest(manifest_path)
+
+    todo, skipped = [], 0
+    for path in find_inputs(args.input):
+        rel = os.path.relpath(path, args.input)
+        sha = sha256_file(path)
+        previous = done.get(rel)
+        if previous is not None and previous["status"] == "ok" and previous["sha256"] == sha:
+            skipped += 1
+        else:
+            todo.append((path, rel, sha))
+    if args.limit:
+        todo = todo[:args.limit]
+    batches = [todo[i:i + args.batch_size] for i in range(0, len(todo), args.batch_size)]
+    workers = max(1, min(args.workers, args.llm_concurrency, len(batches) or 1))
+    print(f"{len(todo)} to summarize, {skipped} already done; {workers} workers, "
+          f"{args.llm_concurrency // workers} LLM calls each", file=sys.stderr)
+
+    counts = {"ok": 0, "failed": 0}
+    started = time.perf_counter()
+    pool = ProcessPoolExecutor(workers, initializer=init_worker, initargs=(worker_env(workers, args.llm_concurrency),))
+    with open(os.path.join(args.out, "summaries.jsonl"), "a", encoding="utf-8") as out, \
+            open(manifest_path, "a", encoding="utf-8") as manifest:
+
+        def record_batch(records: List[Dict]) -> None:
+            for record in records:
+                summary = record.pop("summary", None)
+                if summary is not None:
+                    append_line(out, {"source": record["source"], "sha256": record["sha256"], **summary})
+                    counts["ok"] += 1
+                else:
+                    counts["failed"] += 1
+                    print(f"failed: {record['source']}: {record['error']}", file=sys.stderr)
+                append_line(manifest, record)
+            print(f"[{counts['ok'] + counts['failed']}/{len(todo)}] {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        pending, queue = set(), iter(batches)
+        try:
+            while True:
+                # a couple of batches queued per worker, not the whole backlog
+                for batch in queue:
+                    pending.add(pool.submit(summarize_batch, batch, args.out, formats))
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record_batch(future.result())
+        except KeyboardInterrupt:
+            pending = {f for f in pending if not f.cancel()}
+            print(f"interrupted: finishing {len(pending)} running batches (Ctrl-C again to quit now)", file=sys.stderr)
+            try:
+                for future in pending:
+                    record_batch(future.result())
+            except KeyboardInterrupt:
+                pass
+            pool.shutdown(wait=False, cancel_futures=True)
+            print(f"stopped after {counts['ok'] + counts['failed']} documents; run again to resume", file=sys.stderr)
+            return 130
+    pool.shutdown()
+    ok, failed = counts["ok"], counts["failed"]
+
+    wall = time.perf_counter() - started
+    rate = f", {ok / wall * 60:.0f} documents/min" if ok and wall else ""
+    print(f"{ok} summarized, {failed} failed, {skipped} skipped in {wall:.1f}s{rate}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="directory of .txt/.pdf notes (searched recursively)")
+    parser.add_argument("--out", required=True, help="output directory; also holds the manifest")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--llm-concurrency", type=int, default=16, help="LLM calls in flight across all workers")
+    parser.add_argument("--batch-size", type=int, default=8, help="files per worker task")
+    parser.add_argument("--formats", default="ios,pdf", help="comma-separated: ios, pdf (summaries.jsonl is always written)")
+    parser.add_argument("--limit", type=int, default=0, help="summarize at most this many files this run")
+    args = parser.parse_args()
+    sys.exit(main(args))
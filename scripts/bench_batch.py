@@ -0,0 +1,119 @@
+# bench_batch.py
+#
+# One /api/simplify_pdf/batch request versus the same N PDFs sent as N
+# /api/simplify_pdf requests, one after another (as the app does today) and
+# all at once, in-process against the fake LLM
+# backend. The model allows at most --limit calls in flight process-wide,
+# as a rate-limited API key would (and the governor is told so), so the
+# comparison is about how well each path keeps those slots busy. The
+# concurrent and batch runs alternate --repeat times and the best of each
+# counts. One corrupt file is added to the batch to check it fails alone.
+#
+# The batch endpoint runs each file the per-file way, so once both keep
+# every slot full they make the same calls in the same time: batch versus
+# concurrent is a tie, checked to within --tolerance, not a win.
+#
+#   python scripts/bench_batch.py --files 10 --pages 10 --latency 0.2 --limit 8 --repeat 3
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["NOTERAG_LLM_BACKEND"] = "limited"
+os.environ["NOTERAG_CACHE_PATH"] = ""
+os.environ["NOTERAG_DEDUP_THRESHOLD"] = "0"
+os.environ["NOTERAG_CACHE_MEMORY_ITEMS"] = "0"
+os.environ["NOTERAG_CHUNK_CACHE_PATH"] = ""
+os.environ["NOTERAG_CHUNK_CACHE_MEMORY_ITEMS"] = "0"
+os.environ["NOTERAG_INDEX_DIR"] = ""
+os.environ["NOTERAG_CORPUS_PATH"] = ""
+os.environ["NOTERAG_SUMMARY_STORE_PATH"] = ""
+
+import httpx
+
+from backend.api import app
+from backend.llm_backends import fake_chat_model_class, register_backend, reset_llm
+from synthetic_pdf import make_pdf
+
+
+LIMIT = {"slots": None}
+
+@register_backend("limited")
+def limited_backend():
+    # the fake backend, but with at most --limit calls in flight process-wide
+    class LimitedChatModel(fake_chat_model_class()):
+        async def _agenerate(self, *args, **kwargs):
+            async with LIMIT["slots"]:
+                return await super()._agenerate(*args, **kwargs)
+
+        async def _astream(self, *args, **kwargs):
+            async with LIMIT["slots"]:
+                async for chunk in super()._astream(*args, **kwargs):
+                    yield chunk
+
+    return LimitedChatModel(latency=float(os.environ["NOTERAG_FAKE_LATENCY"]))
+
+
+async def main(files: int, pages: int, latency: float, limit: int, repeat: int, tolerance: float) -> int:
+    os.environ["NOTERAG_FAKE_LATENCY"] = str(latency)
+    os.environ["NOTERAG_LLM_CONCURRENCY"] = os.environ["NOTERAG_LLM_MAX_CONCURRENCY"] = str(limit)
+    LIMIT["slots"] = asyncio.Semaphore(limit)
+    reset_llm()
+
+    pdfs = [make_pdf(pages, seed=i) for i in range(files)]
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        async def single(pdf: bytes) -> None:
+            resp = await client.post("/api/simplify_pdf", files={"file": ("handout.pdf", pdf, "application/pdf")})
+            resp.raise_for_status()
+
+        await single(make_pdf(pages, seed=files))        # warm up imports and the parse pool
+
+        # what the app does today: one request per file, one after another
+        started = time.perf_counter()
+        for pdf in pdfs:
+            await single(pdf)
+        sequential = time.perf_counter() - started
+
+        upload = [("files", (f"handout{i}.pdf", pdf, "application/pdf")) for i, pdf in enumerate(pdfs)]
+        upload.append(("files", ("broken.pdf", b"%PDF-1.4 not really", "application/pdf")))
+        concurrent = batch = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            await asyncio.gather(*(single(pdf) for pdf in pdfs))
+            concurrent = min(concurrent, time.perf_counter() - started)
+
+            started = time.perf_counter()
+            resp = await client.post("/api/simplify_pdf/batch", files=upload)
+            batch = min(batch, time.perf_counter() - started)
+            resp.raise_for_status()
+            results = resp.json()["results"]
+
+    ok = sum("summaries" in r for r in results)
+    print(f"{files} sequential requests: {sequential:.2f}s  ({files / sequential:.2f} docs/s)")
+    print(f"{files} concurrent requests: {concurrent:.2f}s  ({files / concurrent:.2f} docs/s)")
+    print(f"one batch request:      {batch:.2f}s  ({files / batch:.2f} docs/s)")
+    print(f"batch results: {ok} summarized, {len(results) - ok} failed ({results[-1].get('error')!r})")
+
+    # with every path held to the same LLM slots, the batch must clearly beat
+    # the one-at-a-time client and keep up with firing N requests at once
+    passed = (ok == files and "error" in results[-1] and batch < sequential / 2
+              and batch <= concurrent * (1 + tolerance))
+    print(f"batch vs concurrent: {batch / concurrent - 1:+.1%} (allowed {tolerance:+.0%})")
+    print("PASS" if passed else "FAIL")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--limit", type=int, default=8, help="LLM calls in flight, both paths")
+    parser.add_argument("--repeat", type=int, default=3, help="concurrent/batch runs, best counts")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="how much slower than concurrent the batch may be")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.files, args.pages, args.latency, args.limit, args.repeat, args.tolerance)))
@@ -0,0 +1,38 @@
+# bench_cold_start.py
+#
+# Measures how long a fresh interpreter takes to import backend.api:app,
+# i.e. the worker cold start before the first request can be served.
+# Each run is a new process so nothing is cached between them.
+#
+#   python scripts/bench_cold_start.py --runs 10
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SNIPPET = "import time; t = time.perf_counter(); from backend.api import app; print(time.perf_counter() - t)"
+
+
+def main(runs: int, backend: str) -> None:
+    env = dict(os.environ, NOTERAG_LLM_BACKEND=backend)
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", SNIPPET],
+            cwd=ROOT, env=env, capture_output=True, text=True, check=True,
+        )
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    print(f"backend={backend} runs={runs}")
+    print(f"import backend.api:app  median {statistics.median(samples):.3f}s  "
+          f"min {min(samples):.3f}s  max {max(samples):.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--backend", default="fake", help="NOTERAG_LLM_BACKEND to import with")
+    args = parser.parse_args()
+    main(args.runs, args.backend)
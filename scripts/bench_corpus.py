@@ -0,0 +1,125 @@
+# bench_corpus.py
+#
+# Builds a notes corpus (backend/corpus.py) of --notes synthetic notes, each
+# a few page chunks plus summary lines drawn from a Zipf-distributed
+# vocabulary, then times /api/ask-style searches against it. Also checks
+# that a deleted note stops matching and a re-added one matches again.
+#
+#   python scripts/bench_corpus.py --notes 100000 --queries 200
+#
+# The corpus goes in a temp directory (or --path) and is removed afterwards
+# unless --keep is given.
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from backend.corpus import Corpus
+
+
+def vocabulary(size: int, rng: np.random.Generator) -> np.ndarray:
+    letters = np.array(list("abcdefghijklmnopqrstuvwxyz"))
+    return np.array(["".join(rng.choice(letters, rng.integers(4, 10))) for _ in range(size)])
+
+def make_note(rng: np.random.Generator, words: np.ndarray, cdf: np.ndarray, chunks: int, lines: int):
+    def text(n: int) -> str:
+        return " ".join(words[np.searchsorted(cdf, rng.random(n))])
+    passages = [(page, "chunk", text(120)) for page in range(chunks)]
+    passages += [(None, "summary", text(14)) for _ in range(lines)]
+    return passages
+
+def percentile(samples, q: float) -> float:
+    return float(np.percentile(samples, q)) if samples else 0.0
+
+
+def main(args) -> int:
+    rng = np.random.default_rng(0)
+    words = vocabulary(args.vocab, rng)
+    weights = 1.0 / np.arange(1, len(words) + 1) ** 1.07
+    cdf = np.cumsum(weights / weights.sum())
+    cdf[-1] = 1.0
+
+    root = args.path or tempfile.mkdtemp(prefix="noterag-corpus-")
+    corpus = Corpus(os.path.join(root, "corpus.sqlite3"), candidates=args.candidates)
+    try:
+        started = time.perf_counter()
+        notes = {}
+        for i in range(args.notes):
+            passages = make_note(rng, words, cdf, args.chunks, args.lines)
+            corpus.add_note(f"note-{i}", f"Note {i}", passages)
+            if i < 1000:
+                notes[f"note-{i}"] = passages
+            if (i + 1) % 10000 == 0:
+                print(f"  {i + 1} notes, {time.perf_counter() - started:.0f}s", flush=True)
+        build = time.perf_counter() - started
+        size = sum(os.path.getsize(os.path.join(root, f)) for f in os.listdir(root))
+
+        # queries: a couple of a passage's distinctive words plus a few common
+        # ones, as a student would half-remember it
+        rank = {w: r for r, w in enumerate(words)}
+        def query_for(text: str) -> str:
+            tokens = sorted(set(text.split()), key=rank.get)
+            picked = list(rng.choice(tokens[:len(tokens) // 2], 3)) + tokens[-2:]
+            rng.shuffle(picked)
+            return " ".join(picked)
+
+        queries = []
+        keys = list(notes)
+        for _ in range(args.queries):
+            key = keys[rng.integers(len(keys))]
+            _, _, text = notes[key][rng.integers(args.chunks)]
+            queries.append((key, query_for(text)))
+
+        corpus.search(queries[0][1], 8)                  # warm the page cache
+        latencies = []
+        found = 0
+        for key, q in queries:
+            t = time.perf_counter()
+            hits = corpus.search(q, 8)
+            latencies.append((time.perf_counter() - t) * 1000)
+            found += any(h["note"] == key for h in hits)
+
+        # incremental delete and re-add
+        key = keys[0]
+        probe = query_for(notes[key][0][2])
+        before = any(h["note"] == key for h in corpus.search(probe, 20))
+        corpus.delete_note(key)
+        deleted = not any(h["note"] == key for h in corpus.search(probe, 20))
+        corpus.add_note(key, "Note 0", notes[key])
+        readded = any(h["note"] == key for h in corpus.search(probe, 20))
+        stats = corpus.stats()
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    p50, p95, p99 = (percentile(latencies, q) for q in (50, 95, 99))
+    print(f"{stats['notes']} notes, {stats['passages']} passages: built in {build:.0f}s "
+          f"({args.notes / build:.0f} notes/s), {size / 1e6:.0f} MB on disk")
+    print(f"search ({args.queries} queries, {args.candidates} candidates): "
+          f"p50 {p50:.1f} ms  p95 {p95:.1f} ms  p99 {p99:.1f} ms, source note in top 8: {found / len(queries):.0%}")
+    print(f"delete/re-add: found {before}, gone after delete {deleted}, back after re-add {readded}")
+    passed = p95 < args.target_ms and before and deleted and readded
+    print("PASS" if passed else "FAIL")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--notes", type=int, default=100000)
+    parser.add_argument("--chunks", type=int, default=3, help="page chunks per note")
+    parser.add_argument("--lines", type=int, default=6, help="summary lines per note")
+    parser.add_argument("--vocab", type=int, default=30000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--candidates", type=int, default=200)
+    parser.add_argument("--target-ms", type=float, default=100.0, help="p95 search latency to pass")
+    parser.add_argument("--path", help="build the corpus here instead of a temp directory")
+    parser.add_argument("--keep", action="store_true")
+    args = parser.parse_args()
+    sys.exit(main(args))
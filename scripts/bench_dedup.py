@@ -0,0 +1,81 @@
+# bench_dedup.py
+#
+# Times MinHash signatures for long documents and near-duplicate lookups in
+# a DedupIndex that already holds --entries unrelated documents, then checks
+# that an edited copy is found and an unrelated document is not, and that
+# documents with (almost) no text, like scanned PDFs, never match each other.
+#
+#   python scripts/bench_dedup.py --entries 200000
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from backend.dedup import NUM_PERM, DedupIndex, minhash
+from synthetic_pdf import WORDS
+
+
+def fake_text(words: int, seed: int) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def main(entries: int, lookups: int) -> int:
+    # ~500 words per page
+    for pages in (10, 100, 500):
+        text = fake_text(pages * 500, pages)
+        samples = []
+        for _ in range(5):
+            started = time.perf_counter()
+            minhash(text)
+            samples.append(time.perf_counter() - started)
+        print(f"minhash {pages:>3} pages: {statistics.median(samples) * 1000:6.1f} ms")
+
+    index = DedupIndex(os.path.join(tempfile.mkdtemp(), "dedup.sqlite3"), threshold=0.85)
+    rng = np.random.default_rng(0)
+    started = time.perf_counter()
+    for i in range(entries):
+        index.add(rng.integers(0, 2**32, NUM_PERM, dtype=np.uint64).astype(np.uint32), f"random-{i}", "fp")
+    print(f"indexed {entries} signatures in {time.perf_counter() - started:.1f}s")
+
+    original = fake_text(20000, 1)
+    index.add(minhash(original), "original", "fp")
+    edited = minhash("Updated 18 October 2026. " + original + " Page 1 of 40")
+    unrelated = minhash(fake_text(20000, 2))
+
+    samples = []
+    for _ in range(lookups):
+        started = time.perf_counter()
+        found = index.lookup(edited, "fp")
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    print(f"lookup: median {statistics.median(samples) * 1000:.2f} ms, "
+          f"p99 {samples[int(0.99 * (len(samples) - 1))] * 1000:.2f} ms")
+
+    # a scanned PDF has no text; a cover page has a few words
+    index.add(minhash(""), "scanned", "fp")
+    index.add(minhash("Lecture 3"), "cover", "fp")
+    textless = [index.lookup(minhash(text), "fp") for text in ("", "  \n ", "Lecture 4", "Page 1 of 40")]
+
+    ok = (found is not None and found[0] == "original" and index.lookup(unrelated, "fp") is None
+          and textless == [None] * 4)
+    print(f"edited copy -> {found}")
+    print(f"textless documents -> {textless}")
+    print("PASS" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--lookups", type=int, default=200)
+    args = parser.parse_args()
+    sys.exit(main(args.entries, args.lookups))
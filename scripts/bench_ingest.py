@@ -0,0 +1,82 @@
+# bench_ingest.py
+#
+# Compares the old upload path (temp file → PyPDFLoader.load_and_split →
+# "\n".join → prepare_text_for_langchain re-split) with backend.ingest's
+# single pass over an in-memory buffer, on synthetic 10/100/500-page PDFs.
+# The "parallel" row shards page ranges across a process pool of --workers.
+#
+#   python scripts/bench_ingest.py --pages 10 100 500 --workers 4
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_community.document_loaders import PyPDFLoader
+
+from backend.ingest import aload_pdf_chunks, load_pdf_chunks
+from synthetic_pdf import make_pdf
+
+
+def legacy_ingest(data: bytes):
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(data)
+        tmp_path = tmp.name
+    try:
+        docs = PyPDFLoader(tmp_path).load_and_split()
+        text = "\n".join(doc.page_content for doc in docs)
+    finally:
+        os.remove(tmp_path)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=1000,
+        chunk_overlap=100,
+        separators=["\n\n", "\n", ".", "!", "?", ",", " ", ""]
+    )
+    return [Document(page_content=chunk) for chunk in splitter.split_text(text)]
+
+
+def measure(fn, data: bytes, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - started)
+    # separate run for memory, tracemalloc would skew the timings
+    tracemalloc.start()
+    chunks = fn(data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, len(chunks)
+
+
+def main(pages_list, repeat: int, workers: int) -> None:
+    pool = ProcessPoolExecutor(max_workers=workers)
+
+    def parallel_ingest(data: bytes):
+        # peak memory here only covers the parent process
+        return asyncio.run(aload_pdf_chunks(data, pool, workers))
+
+    print(f"{'pages':>6} {'path':<8} {'best s':>8} {'peak MiB':>9} {'chunks':>7}")
+    for pages in pages_list:
+        data = make_pdf(pages)
+        for name, fn in (("legacy", legacy_ingest), ("single", load_pdf_chunks), ("parallel", parallel_ingest)):
+            seconds, peak, n = measure(fn, data, repeat)
+            print(f"{pages:>6} {name:<8} {seconds:>8.3f} {peak / 2**20:>9.1f} {n:>7}")
+    pool.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+    main(args.pages, args.repeat, args.workers)
@@ -0,0 +1,147 @@
+# bench_pipeline.py
+#
+# End-to-end benchmark of /api/simplify_pdf, run in-process against the
+# offline "fake" LLM backend with a fixed per-call latency. For each
+# concurrency level it sends --requests uploads of a synthetic PDF and
+# reports latency percentiles, throughput, peak RSS and a per-stage
+# breakdown (upload read, parse/extract/split, each chain, response build).
+# Caches are off so every request runs the whole pipeline.
+#
+#   python scripts/bench_pipeline.py --pages 20 --concurrency 1 4 16 --out bench.json
+#
+# Save one JSON per commit and diff them to spot regressions.
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["NOTERAG_LLM_BACKEND"] = "fake"
+os.environ["NOTERAG_CACHE_PATH"] = ""
+os.environ["NOTERAG_DEDUP_THRESHOLD"] = "0"
+os.environ["NOTERAG_CACHE_MEMORY_ITEMS"] = "0"
+os.environ["NOTERAG_CHUNK_CACHE_PATH"] = ""
+os.environ["NOTERAG_CHUNK_CACHE_MEMORY_ITEMS"] = "0"
+os.environ["NOTERAG_INDEX_DIR"] = ""
+os.environ["NOTERAG_CORPUS_PATH"] = ""
+os.environ["NOTERAG_SUMMARY_STORE_PATH"] = ""
+
+import httpx
+
+from backend.api import app, summary_cache
+from backend.llm_backends import reset_llm
+from backend.tracing import start_trace
+from synthetic_pdf import make_pdf
+
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    # nearest-rank
+    rank = max(1, min(len(ordered), round(q / 100 * len(ordered) + 0.5)))
+    return ordered[rank - 1]
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def git_commit() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+async def upload(client: httpx.AsyncClient, pdf: bytes) -> Dict:
+    # runs as its own task, so the trace belongs to this request only
+    trace = start_trace()
+    started = time.perf_counter()
+    resp = await client.post("/api/simplify_pdf", files={"file": ("handout.pdf", pdf, "application/pdf")})
+    resp.raise_for_status()
+    return {"seconds": time.perf_counter() - started, "stages": trace.totals()}
+
+async def run_level(client: httpx.AsyncClient, pdfs: List[bytes], concurrency: int, requests: int) -> Dict:
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> Dict:
+        async with limit:
+            return await asyncio.create_task(upload(client, pdfs[i % len(pdfs)]))
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - started
+
+    latencies = [r["seconds"] for r in results]
+    stages: Dict[str, List[float]] = {}
+    for r in results:
+        for name, seconds in r["stages"].items():
+            stages.setdefault(name, []).append(seconds)
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "wall_seconds": round(wall, 4),
+        "throughput_rps": round(requests / wall, 3),
+        "latency": {f"p{q}": round(percentile(latencies, q), 4) for q in (50, 95, 99)},
+        "stages": {
+            name: {"mean": round(sum(v) / len(v), 4), "p95": round(percentile(v, 95), 4)}
+            for name, v in sorted(stages.items())
+        },
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+async def main(args) -> Dict:
+    os.environ["NOTERAG_FAKE_LATENCY"] = str(args.latency)
+    reset_llm()
+    # distinct documents, so nothing downstream can short-circuit on content
+    pdfs = [make_pdf(args.pages, seed=i) for i in range(args.documents)]
+
+    levels = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        await upload(client, pdfs[0])                    # warm up imports and the parse pool
+        for concurrency in args.concurrency:
+            level = await run_level(client, pdfs, concurrency, args.requests)
+            levels.append(level)
+            lat = level["latency"]
+            print(f"c={concurrency:<3} p50 {lat['p50']:.3f}s  p95 {lat['p95']:.3f}s  p99 {lat['p99']:.3f}s  "
+                  f"{level['throughput_rps']:.2f} req/s  rss {level['peak_rss_mb']:.0f} MB")
+            for name, s in level["stages"].items():
+                print(f"    {name:<22} mean {s['mean']:.4f}s  p95 {s['p95']:.4f}s")
+
+    assert summary_cache.stats()["memory_hits"] == 0, "cache served a benchmark request"
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "params": {"pages": args.pages, "documents": args.documents, "requests": args.requests,
+                   "latency": args.latency},
+        "levels": levels,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--documents", type=int, default=8, help="distinct synthetic PDFs to cycle through")
+    parser.add_argument("--requests", type=int, default=16, help="uploads per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake LLM call")
+    parser.add_argument("--out", help="write the results here as JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"wrote {args.out}")
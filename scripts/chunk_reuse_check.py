@@ -0,0 +1,64 @@
+# chunk_reuse_check.py
+#
+# Uploads a synthetic handout, then the same handout with one line added to
+# a single page, and reports how many map-step chunks the second run took
+# from the chunk cache instead of the LLM. Runs in-process against the fake
+# backend with the whole-document cache off, so only chunk reuse can help.
+#
+#   python scripts/chunk_reuse_check.py --pages 30 --edit-page 3
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["NOTERAG_LLM_BACKEND"] = "fake"
+os.environ["NOTERAG_FAKE_LATENCY"] = "0"
+os.environ["NOTERAG_CACHE_PATH"] = ""
+os.environ["NOTERAG_DEDUP_THRESHOLD"] = "0"
+os.environ["NOTERAG_CACHE_MEMORY_ITEMS"] = "0"
+os.environ["NOTERAG_INDEX_DIR"] = ""
+os.environ["NOTERAG_CORPUS_PATH"] = ""
+os.environ["NOTERAG_SUMMARY_STORE_PATH"] = ""
+os.environ["NOTERAG_CHUNK_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "chunks.sqlite3")
+
+import httpx
+
+from backend.api import app
+from backend.metrics import LLM_CALLS
+from synthetic_pdf import make_pdf
+
+
+async def summarize(client: httpx.AsyncClient, pdf: bytes):
+    before = LLM_CALLS.value(stage="chain.map")
+    resp = await client.post("/api/simplify_pdf", files={"file": ("notes.pdf", pdf, "application/pdf")})
+    resp.raise_for_status()
+    return resp.json()["summaries"][0]["chunk_reuse"], int(LLM_CALLS.value(stage="chain.map") - before)
+
+async def main(pages: int, edit_page: int, min_reuse: float) -> int:
+    original = make_pdf(pages, seed=7)
+    edited = make_pdf(pages, seed=7, edits={edit_page - 1: "Correction: the quiz moved to Friday afternoon."})
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        first, first_calls = await summarize(client, original)
+        second, second_calls = await summarize(client, edited)
+
+    print(f"first upload:   {first['chunks']} chunks, {first['reused']} reused, {first_calls} map calls")
+    print(f"edited page {edit_page}: {second['chunks']} chunks, {second['reused']} reused, {second_calls} map calls")
+    ratio = second["reused"] / second["chunks"]
+    print(f"reuse after edit: {ratio:.0%}")
+    ok = first["reused"] == 0 and ratio >= min_reuse
+    print("PASS" if ok else "FAIL")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--edit-page", type=int, default=3, help="1-based page that gets an extra line")
+    parser.add_argument("--min-reuse", type=float, default=0.8)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.pages, args.edit_page, args.min_reuse)))
@@ -0,0 +1,114 @@
+# coalesce_check.py
+#
+# A class uploads the same handout at once: fires --clients identical
+# uploads at /api/simplify_pdf in-process (fake LLM backend) and checks
+# they share one pipeline run: about as many LLM calls as one upload of a
+# similar file, not --clients times that. The client that started the run
+# disconnects halfway; the others must still get their summary. Then a
+# batch of copies of a PDF that fails to parse checks that every waiter
+# sees the error and nothing is left in flight. Last, streaming uploads of
+# one file (plus a plain upload of it) must share one run too, every
+# stream getting the same events.
+#
+#   python scripts/coalesce_check.py --clients 30
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["NOTERAG_LLM_BACKEND"] = "fake"
+os.environ["NOTERAG_CACHE_PATH"] = ""
+os.environ["NOTERAG_DEDUP_THRESHOLD"] = "0"
+os.environ["NOTERAG_CHUNK_CACHE_PATH"] = ""
+os.environ["NOTERAG_CHUNK_CACHE_MEMORY_ITEMS"] = "0"
+os.environ["NOTERAG_INDEX_DIR"] = ""
+os.environ["NOTERAG_CORPUS_PATH"] = ""
+os.environ["NOTERAG_SUMMARY_STORE_PATH"] = ""
+
+import httpx
+
+from backend.api import app, summary_flight
+from backend.llm_backends import reset_llm
+from backend.metrics import render_metrics
+from synthetic_pdf import make_pdf
+
+
+def llm_calls() -> float:
+    return sum(
+        float(line.rsplit(" ", 1)[1]) for line in render_metrics().splitlines()
+        if line.startswith("noterag_llm_calls_total{")
+    )
+
+
+async def main(clients: int, pages: int, latency: float) -> int:
+    os.environ["NOTERAG_FAKE_LATENCY"] = str(latency)
+    reset_llm()
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        async def upload(pdf: bytes) -> httpx.Response:
+            return await client.post("/api/simplify_pdf", files={"file": ("handout.pdf", pdf, "application/pdf")})
+
+        before = llm_calls()
+        started = time.perf_counter()
+        (await upload(make_pdf(pages, seed=1))).raise_for_status()
+        single, single_calls = time.perf_counter() - started, llm_calls() - before
+
+        pdf = make_pdf(pages, seed=2)
+        before = llm_calls()
+        started = time.perf_counter()
+        leader = asyncio.create_task(upload(pdf))
+        await asyncio.sleep(0.05)                    # let it claim the run
+        others = [asyncio.create_task(upload(pdf)) for _ in range(clients - 1)]
+        await asyncio.sleep(single / 2)
+        leader.cancel()                              # the first student closes the app
+        responses = await asyncio.gather(*others)
+        wall, calls = time.perf_counter() - started, llm_calls() - before
+        stats = summary_flight.stats()
+
+        broken = b"%PDF-1.4 truncated"
+        failures = await asyncio.gather(*(upload(broken) for _ in range(5)))
+
+        async def stream(pdf: bytes) -> list:
+            r = await client.post("/api/simplify_pdf/stream", files={"file": ("handout.pdf", pdf, "application/pdf")})
+            return [json.loads(line)["type"] for line in r.text.splitlines()]
+
+        pdf = make_pdf(pages, seed=3)
+        before = llm_calls()
+        leader = asyncio.create_task(stream(pdf))
+        await asyncio.sleep(0.05)
+        *streams, plain = await asyncio.gather(leader, *(stream(pdf) for _ in range(clients // 3 - 1)), upload(pdf))
+        stream_calls = llm_calls() - before
+
+    ok = sum(r.status_code == 200 for r in responses)
+    print(f"single upload: {single:.2f}s, {single_calls:.0f} LLM calls")
+    print(f"{clients} identical uploads (first one cancelled): {ok}/{clients - 1} ok in {wall:.2f}s, "
+          f"{calls:.0f} LLM calls")
+    print(f"broken PDF x5: statuses {sorted({r.status_code for r in failures})}")
+    print(f"{clients // 3} identical streams + 1 upload: {stream_calls:.0f} LLM calls, "
+          f"{len({tuple(s) for s in streams})} distinct event sequence(s)")
+    print(f"coalescing: {summary_flight.stats()}")
+
+    passed = (
+        ok == clients - 1
+        and calls < 2 * single_calls
+        and stats["started"] == 2 and stats["joined"] >= clients - 1
+        and all(r.status_code == 422 for r in failures)
+        and stream_calls < 2 * single_calls and plain.status_code == 200
+        and all(s == streams[0] and s[-1] == "summary" for s in streams)
+        and summary_flight.stats()["in_flight"] == 0
+    )
+    print("PASS" if passed else "FAIL")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=30)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake LLM call")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.clients, args.pages, args.latency)))
@@ -0,0 +1,83 @@
+# compression_guard.py
+#
+# Quality guard for extractive pre-compression (backend/compress.py).
+# Each fixture is summarized twice by the real pipeline, once on full text
+# and once compressed to --budget tokens, with the LLM replaced by a
+# deterministic extractive stub: its "main ideas" are the most frequent
+# content words of whatever text it was given. If compression keeps the
+# important content, both runs surface mostly the same words.
+#
+#   python scripts/compression_guard.py --budget 300 --min-overlap 0.5 data/*.txt
+
+import argparse
+import asyncio
+import collections
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["NOTERAG_LLM_BACKEND"] = "extractive"
+os.environ["NOTERAG_INDEX_DIR"] = ""
+os.environ["NOTERAG_CORPUS_PATH"] = ""
+os.environ["NOTERAG_SUMMARY_STORE_PATH"] = ""
+
+import backend.rag_pipeline as rag_pipeline
+from backend.llm_backends import fake_chat_model_class, register_backend
+
+STOPWORDS = set(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were "
+    "will with each every can not but they their them into than then there these those what which "
+    "who how when where your you our we he she his her also more most such one two three".split()
+)
+TOP_WORDS = 10
+
+
+def top_words(text: str, n: int = TOP_WORDS):
+    words = [w for w in re.findall(r"[a-z]+", text.lower()) if w not in STOPWORDS and len(w) > 2]
+    return [w for w, _ in collections.Counter(words).most_common(n)]
+
+
+@register_backend("extractive")
+def extractive_backend():
+    class ExtractiveChatModel(fake_chat_model_class()):
+        # the fake backend, except the high-level answer is the top content words
+        def respond(self, prompt: str) -> str:
+            if not prompt.rstrip().endswith("3."):
+                return super().respond(prompt)
+            words = top_words(prompt.split("MAIN IDEAS:")[0], 9)
+            return "\n".join(f"{i + 1}. {' '.join(words[i * 3:(i + 1) * 3])}" for i in range(3))
+
+    return ExtractiveChatModel(latency=0)
+
+
+async def summarize(text: str, budget: int):
+    rag_pipeline.COMPRESS_TOKEN_BUDGET = budget
+    summary = await rag_pipeline.agenerate_langchain_summary(text)
+    words = set(" ".join(rag_pipeline.strip_number(ln) for ln in summary["high_level"]).split())
+    return words, summary["compression"]
+
+
+async def main(paths, budget: int, min_overlap: float) -> int:
+    failures = 0
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        full, _ = await summarize(text, 0)
+        compressed, report = await summarize(text, budget)
+        # share of the uncompressed run's main-idea words that survive
+        overlap = len(full & compressed) / len(full) if full else 1.0
+        ratio = report["ratio"] if report else 1.0
+        ok = overlap >= min_overlap
+        failures += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} overlap={overlap:.2f} ratio={ratio:.2f} {os.path.basename(path)}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="plain-text fixtures, e.g. data/*.txt")
+    parser.add_argument("--budget", type=int, default=300, help="compression token budget")
+    parser.add_argument("--min-overlap", type=float, default=0.5)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.paths, args.budget, args.min_overlap)))
@@ -0,0 +1,116 @@
+# keyword_agreement.py
+#
+# How closely the local extractor (backend/keywords.py, NOTERAG_METADATA=local)
+# agrees with LLM metadata. The fixtures are data/<name>_summary.json next to
+# the source text data/<name>*.txt: each JSON holds the main ideas, title,
+# topic and keywords the LLM produced. For every fixture the extractor runs
+# on the source's chunks plus those main ideas, and is scored against the
+# LLM's labels:
+#
+#   keyword recall     share of LLM keywords sharing a word with a local one
+#   keyword precision  share of local keywords sharing a word with an LLM one
+#   topic              whether the two topics share a word
+#
+# With --live the configured backend's metadata call runs on the same main
+# ideas too, for a latency comparison (and, with a real model, fresh labels
+# to compare against instead of the stored ones).
+#
+#   python scripts/keyword_agreement.py --data data --min-recall 0.4
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import re
+import statistics
+import sys
+import time
+from typing import List, Set
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from backend.keywords import STOPWORDS, local_metadata
+from backend.rag_pipeline import allm_metadata, prepare_text_for_langchain
+
+
+def words(phrase: str) -> Set[str]:
+    out = set()
+    for w in re.findall(r"[^\W_][\w'’-]*", phrase.lower()):
+        w = re.sub(r"['’]s$", "", w)
+        w = w[:-1] if len(w) > 3 and w.endswith("s") and not w.endswith(("ss", "us", "is")) else w
+        if w not in STOPWORDS:
+            out.add(w)
+    return out
+
+def share(ours: List[str], theirs: List[str]) -> float:
+    # share of `ours` that has a word in common with something in `theirs`
+    if not ours:
+        return 0.0
+    return sum(any(words(a) & words(b) for b in theirs) for a in ours) / len(ours)
+
+def fixtures(root: str):
+    for path in sorted(glob.glob(os.path.join(root, "*_summary.json"))):
+        name = os.path.basename(path)[: -len("_summary.json")]
+        sources = sorted(glob.glob(os.path.join(root, glob.escape(name) + "*.txt")))
+        if sources:
+            with open(path, encoding="utf-8") as f, open(sources[0], encoding="utf-8") as g:
+                yield name, json.load(f), g.read()
+
+
+async def main(args) -> int:
+    rows = []
+    for name, summary, text in fixtures(args.data):
+        chunks = [d.page_content for d in prepare_text_for_langchain(text)]
+        times = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            local = local_metadata(chunks, summary["high_level"])
+            times.append((time.perf_counter() - started) * 1000)
+        reference = {"topic": summary["topic"], "keywords": [k.strip() for k in summary["keywords"]]}
+        llm_ms = None
+        if args.live:
+            started = time.perf_counter()
+            reference = await allm_metadata(summary["high_level"])
+            llm_ms = (time.perf_counter() - started) * 1000
+        rows.append({
+            "name": name,
+            "local": local,
+            "llm": reference,
+            "recall": share(reference["keywords"], local["keywords"]),
+            "precision": share(local["keywords"], reference["keywords"]),
+            "topic": bool(words(local["topic"]) & words(reference["topic"])),
+            "ms": statistics.median(times),
+            "llm_ms": llm_ms,
+        })
+
+    if not rows:
+        print(f"no fixtures in {args.data}")
+        return 1
+    for r in rows:
+        print(f"{r['name']}  ({len(r['local']['keywords'])} keywords, {r['ms']:.1f} ms"
+              + (f", LLM call {r['llm_ms']:.0f} ms" if r["llm_ms"] is not None else "") + ")")
+        print(f"  local: topic {r['local']['topic']!r}, keywords {r['local']['keywords']}")
+        print(f"  llm:   topic {r['llm']['topic']!r}, keywords {r['llm']['keywords']}")
+        print(f"  recall {r['recall']:.2f}  precision {r['precision']:.2f}  topic {'agrees' if r['topic'] else 'differs'}")
+    recall = statistics.mean(r["recall"] for r in rows)
+    precision = statistics.mean(r["precision"] for r in rows)
+    topics = sum(r["topic"] for r in rows)
+    slowest = max(r["ms"] for r in rows)
+    print(f"{len(rows)} fixtures: keyword recall {recall:.2f}, precision {precision:.2f}, "
+          f"topic agrees {topics}/{len(rows)}, slowest extraction {slowest:.1f} ms")
+
+    passed = recall >= args.min_recall and slowest <= args.max_ms
+    print("PASS" if passed else "FAIL")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data"))
+    parser.add_argument("--repeat", type=int, default=5, help="extractions per fixture; the median is reported")
+    parser.add_argument("--live", action="store_true", help="compare against a fresh call to the configured LLM")
+    parser.add_argument("--min-recall", type=float, default=0.4)
+    parser.add_argument("--max-ms", type=float, default=50.0, help="slowest extraction allowed")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args)))
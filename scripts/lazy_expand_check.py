@@ -0,0 +1,128 @@
+# lazy_expand_check.py
+#
+# Compares eager and lazy summaries in-process (fake LLM backend): uploads
+# --documents PDFs with /api/simplify_pdf, then other PDFs with ?lazy=true
+# and "taps" --tap-rate of their lines through /api/expand, as DetailView
+# users would. Reports upload latency and LLM calls for both, and checks
+# that a tapped section is made once and then served from cache, that no
+# expand request parses a PDF again, that a document whose every line was
+# tapped becomes an ordinary cached summary, and that ?prefetch=true has
+# all three sections ready without any tap. Passage indexes are written to
+# a temp dir, as in production: prefetched sections of one document build
+# its index from several threads at once.
+#
+#   python scripts/lazy_expand_check.py --documents 10 --tap-rate 0.3
+
+import argparse
+import asyncio
+import atexit
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["NOTERAG_LLM_BACKEND"] = "fake"
+os.environ["NOTERAG_CACHE_PATH"] = ""                # in memory: expansions must be cached
+os.environ["NOTERAG_DEDUP_THRESHOLD"] = "0"
+os.environ["NOTERAG_CHUNK_CACHE_PATH"] = ""
+os.environ["NOTERAG_CHUNK_CACHE_MEMORY_ITEMS"] = "0"
+os.environ["NOTERAG_INDEX_DIR"] = tempfile.mkdtemp(prefix="noterag-index-")
+atexit.register(shutil.rmtree, os.environ["NOTERAG_INDEX_DIR"], True)
+os.environ["NOTERAG_CORPUS_PATH"] = ""
+os.environ["NOTERAG_SUMMARY_STORE_PATH"] = ""
+
+import httpx
+
+from backend.api import app, expand_flight, summary_cache
+from backend.llm_backends import reset_llm
+from backend.metrics import render_metrics
+from synthetic_pdf import make_pdf
+
+
+def counter(prefix: str) -> float:
+    return sum(float(line.rsplit(" ", 1)[1]) for line in render_metrics().splitlines() if line.startswith(prefix))
+
+def llm_calls() -> float:
+    return counter("noterag_llm_calls_total{")
+
+def parses() -> float:
+    return counter('noterag_stage_seconds_count{stage="pdf_parse"}')
+
+
+async def main(args) -> int:
+    os.environ["NOTERAG_FAKE_LATENCY"] = str(args.latency)
+    reset_llm()
+    rng = random.Random(0)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        async def upload(pdf: bytes, **params) -> dict:
+            r = await client.post("/api/simplify_pdf", params=params,
+                                  files={"file": ("handout.pdf", pdf, "application/pdf")})
+            r.raise_for_status()
+            return r.json()["summaries"][0]
+
+        async def run(pdfs, **params):
+            before, started = llm_calls(), time.perf_counter()
+            out = [await upload(pdf, **params) for pdf in pdfs]
+            return out, (time.perf_counter() - started) / len(pdfs), llm_calls() - before
+
+        _, eager_latency, eager_calls = await run([make_pdf(args.pages, seed=i) for i in range(args.documents)])
+        lazy, lazy_latency, lazy_calls = await run(
+            [make_pdf(args.pages, seed=100 + i) for i in range(args.documents)], lazy="true"
+        )
+
+        taps = [(s["doc"], i) for s in lazy for i in range(len(s["lines"])) if rng.random() < args.tap_rate]
+        before_calls, before_parses = llm_calls(), parses()
+        first = [await client.get(f"/api/expand/{doc}/{i}") for doc, i in taps]
+        tap_calls = llm_calls() - before_calls
+        again = [await client.get(f"/api/expand/{doc}/{i}") for doc, i in taps]
+        repeat_calls = llm_calls() - before_calls - tap_calls
+        expand_parses = parses() - before_parses
+
+        # tap every line of one document: it should turn into a plain cache entry
+        doc = lazy[0]["doc"]
+        for i in range(3):
+            (await client.get(f"/api/expand/{doc}/{i}")).raise_for_status()
+        completed = summary_cache.get(doc)
+
+        prefetched = await upload(make_pdf(args.pages, seed=999), lazy="true", prefetch="true")
+        while expand_flight.stats()["in_flight"]:
+            await asyncio.sleep(0.05)
+        before = llm_calls()
+        ready = [await client.get(f"/api/expand/{prefetched['doc']}/{i}") for i in range(3)]
+        prefetch_tap_calls = llm_calls() - before
+        missing = await client.get("/api/expand/0000/0")
+
+    print(f"eager: {eager_latency:.2f}s per upload, {eager_calls / args.documents:.1f} LLM calls per document")
+    print(f"lazy:  {lazy_latency:.2f}s per upload, {lazy_calls / args.documents:.1f} LLM calls per document")
+    print(f"{len(taps)} taps ({args.tap_rate:.0%} of lines): {tap_calls:.0f} LLM calls, "
+          f"{repeat_calls:.0f} on repeat taps, {expand_parses:.0f} PDF parses")
+    print(f"LLM calls, eager vs lazy + taps: {eager_calls:.0f} vs {lazy_calls + tap_calls:.0f}")
+    print(f"every line tapped -> cached summary: {completed is not None and all(completed['expanded'])}")
+    print(f"prefetch: {[r.status_code for r in ready]}, {prefetch_tap_calls:.0f} LLM calls on tap; "
+          f"unknown handle: {missing.status_code}")
+
+    passed = (
+        all(r.status_code == 200 and len(r.json()["points"]) == 3 for r in first + again + ready)
+        and lazy_calls + tap_calls < eager_calls
+        and repeat_calls == 0
+        and expand_parses == 0
+        and completed is not None and all(completed["expanded"])
+        and prefetch_tap_calls == 0
+        and missing.status_code == 404
+    )
+    print("PASS" if passed else "FAIL")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--tap-rate", type=float, default=0.3, help="share of lines a user opens")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per fake LLM call")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args)))
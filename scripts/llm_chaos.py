@@ -0,0 +1,129 @@
+# llm_chaos.py
+#
+# Runs /api/simplify_pdf in-process against a fake LLM that misbehaves like
+# a busy provider, with and without the call governor (backend/governor.py):
+#
+#   throttled: 429 once more than --capacity calls are in flight, plus a few
+#              random 429s and hung calls. Without the governor those fail
+#              the request; with it every request should succeed and the
+#              concurrency limit should settle near the capacity.
+#   outage:    every call fails with 503. The breaker should open and later
+#              requests fail fast with Retry-After; once the provider is
+#              back and the cooldown has passed, one probe closes it again.
+#
+#   python scripts/llm_chaos.py --requests 12 --capacity 4
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["NOTERAG_LLM_BACKEND"] = "fake"
+os.environ["NOTERAG_CACHE_PATH"] = ""
+os.environ["NOTERAG_CACHE_MEMORY_ITEMS"] = "0"
+os.environ["NOTERAG_CHUNK_CACHE_PATH"] = ""
+os.environ["NOTERAG_CHUNK_CACHE_MEMORY_ITEMS"] = "0"
+os.environ["NOTERAG_DEDUP_THRESHOLD"] = "0"
+os.environ["NOTERAG_INDEX_DIR"] = ""
+os.environ["NOTERAG_CORPUS_PATH"] = ""
+os.environ["NOTERAG_SUMMARY_STORE_PATH"] = ""
+
+import httpx
+
+from backend.api import app
+from backend.llm_backends import get_governor, get_llm, reset_llm
+from backend.metrics import LLM_FAILFAST, LLM_RETRIES
+from synthetic_pdf import make_pdf
+
+
+def configure(governor: bool, **env: str) -> None:
+    os.environ["NOTERAG_LLM_GOVERNOR"] = "1" if governor else "0"
+    for name in ("NOTERAG_FAKE_CAPACITY", "NOTERAG_FAKE_429_RATE", "NOTERAG_FAKE_TIMEOUT_RATE",
+                 "NOTERAG_FAKE_ERROR_RATE"):
+        os.environ.pop(name, None)
+    os.environ.update(env)
+    reset_llm()
+
+async def fire(client: httpx.AsyncClient, pdfs) -> list:
+    async def one(pdf: bytes) -> httpx.Response:
+        return await client.post("/api/simplify_pdf", files={"file": ("handout.pdf", pdf, "application/pdf")})
+    return await asyncio.gather(*(one(pdf) for pdf in pdfs))
+
+
+async def throttled(client: httpx.AsyncClient, args, governor: bool) -> int:
+    configure(governor, NOTERAG_FAKE_CAPACITY=str(args.capacity), NOTERAG_FAKE_429_RATE="0.03",
+              NOTERAG_FAKE_TIMEOUT_RATE="0.02", NOTERAG_LLM_TIMEOUT="0.5", NOTERAG_LLM_CONCURRENCY="16")
+    pdfs = [make_pdf(args.pages, seed=i + (100 if governor else 0)) for i in range(args.requests)]
+    retries = sum(LLM_RETRIES.value(reason=r) for r in ("rate_limit", "transient"))
+    started = time.perf_counter()
+    responses = await fire(client, pdfs)
+    wall = time.perf_counter() - started
+    ok = sum(r.status_code == 200 for r in responses)
+    label = "governor on " if governor else "governor off"
+    line = f"throttled, {label}: {ok}/{len(pdfs)} ok in {wall:.1f}s"
+    if governor:
+        retried = sum(LLM_RETRIES.value(reason=r) for r in ("rate_limit", "transient")) - retries
+        line += f", {retried:.0f} retries, concurrency limit now {get_governor().limiter.limit:.1f}"
+    print(line)
+    return ok
+
+
+async def outage(client: httpx.AsyncClient, args) -> bool:
+    configure(True, NOTERAG_FAKE_ERROR_RATE="1", NOTERAG_LLM_BREAKER_FAILURES="5",
+              NOTERAG_LLM_BREAKER_COOLDOWN="2", NOTERAG_LLM_RETRIES="2")
+    pdfs = [make_pdf(args.pages, seed=200 + i) for i in range(args.requests)]
+    get_llm()                                            # build the governor before the first request
+    refused = LLM_FAILFAST.value()
+
+    first = await fire(client, pdfs[:1])
+    started = time.perf_counter()
+    rest = await fire(client, pdfs[1:])
+    fail_fast = time.perf_counter() - started
+    statuses = {r.status_code for r in first + rest}
+    retry_after = rest[-1].headers.get("retry-after")
+    print(f"outage: statuses {sorted(statuses)}, breaker {get_governor().breaker.state}, "
+          f"{LLM_FAILFAST.value() - refused:.0f} calls refused, "
+          f"{len(rest)} requests failed in {fail_fast:.2f}s, Retry-After {retry_after}")
+
+    get_llm().inner.error_rate = 0.0                    # provider recovers
+    await asyncio.sleep(2.1)
+    recovered = await fire(client, pdfs[:1])
+    print(f"after cooldown: {recovered[0].status_code}, breaker {get_governor().breaker.state}")
+    return (
+        statuses == {503}
+        and retry_after is not None
+        and fail_fast < 1.0
+        and recovered[0].status_code == 200
+        and get_governor().breaker.state == "closed"
+    )
+
+
+async def main(args) -> int:
+    os.environ["NOTERAG_FAKE_LATENCY"] = str(args.latency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        without = await throttled(client, args, governor=False)
+        with_governor = await throttled(client, args, governor=True)
+        limit = get_governor().limiter.limit
+        breaker_ok = await outage(client, args)
+
+    passed = (
+        with_governor == args.requests
+        and without < args.requests
+        and limit <= 2 * args.capacity
+        and breaker_ok
+    )
+    print("PASS" if passed else "FAIL")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=12)
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--capacity", type=int, default=4, help="calls in flight before the fake answers 429")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds per fake LLM call")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args)))
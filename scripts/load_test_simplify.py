@@ -0,0 +1,123 @@
+# load_test_simplify.py
+#
+# Fires N concurrent uploads at /api/simplify_pdf in-process, against the
+# offline "fake" LLM backend, which just sleeps before answering. If the
+# endpoint keeps the event loop free, N uploads finish in about the time of
+# one; if anything blocks, the total creeps toward N × one.
+#
+# Then streams one more upload from /api/simplify_pdf/stream, over a real
+# socket (the in-process transport buffers the whole body), and checks the
+# first of the three lines arrives at least half an LLM call before the
+# final summary event.
+#
+#   python scripts/load_test_simplify.py --concurrency 20 --latency 0.5
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["NOTERAG_LLM_BACKEND"] = "fake"
+os.environ["NOTERAG_CACHE_PATH"] = ""                 # measure the pipeline, not the cache
+os.environ["NOTERAG_DEDUP_THRESHOLD"] = "0"
+os.environ["NOTERAG_CHUNK_CACHE_PATH"] = ""
+os.environ["NOTERAG_CHUNK_CACHE_MEMORY_ITEMS"] = "0"
+os.environ["NOTERAG_CORPUS_PATH"] = ""
+os.environ["NOTERAG_SUMMARY_STORE_PATH"] = ""
+
+import httpx
+import uvicorn
+
+from backend.api import app
+from backend.llm_backends import reset_llm
+from synthetic_pdf import make_pdf
+
+
+async def upload(client: httpx.AsyncClient, pdf: bytes) -> float:
+    started = time.perf_counter()
+    resp = await client.post("/api/simplify_pdf", files={"file": ("handout.pdf", pdf, "application/pdf")})
+    resp.raise_for_status()
+    return time.perf_counter() - started
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def stream(pdf: bytes) -> tuple:
+    # (seconds to the first "line" event, seconds to the "summary" event),
+    # with the app served by uvicorn on this event loop
+    server = uvicorn.Server(uvicorn.Config(app, port=free_port(), log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    try:
+        while not server.started:
+            await asyncio.sleep(0.01)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{server.config.port}", timeout=None) as client:
+            return await stream_events(client, pdf)
+    finally:
+        server.should_exit = True
+        await serving
+
+
+async def stream_events(client: httpx.AsyncClient, pdf: bytes) -> tuple:
+    started = time.perf_counter()
+    first_line = None
+    async with client.stream("POST", "/api/simplify_pdf/stream",
+                             files={"file": ("handout.pdf", pdf, "application/pdf")}) as resp:
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            event = json.loads(line) if line else {}
+            if event.get("type") == "line" and first_line is None:
+                first_line = time.perf_counter() - started
+            elif event.get("type") == "summary":
+                return first_line, time.perf_counter() - started
+            elif event.get("type") == "error":
+                raise RuntimeError(event["detail"])
+    raise RuntimeError("stream ended without a summary event")
+
+
+async def main(concurrency: int, pages: int, latency: float) -> int:
+    os.environ["NOTERAG_FAKE_LATENCY"] = str(latency)
+    reset_llm()
+    pdfs = [make_pdf(pages, seed=i) for i in range(concurrency + 2)]
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        await upload(client, pdfs[-2])                   # warm up the parse pool
+        single = await upload(client, pdfs[0])
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(upload(client, pdf) for pdf in pdfs[:concurrency]))
+        total = time.perf_counter() - started
+
+    first_line, streamed = await stream(pdfs[-1])
+
+    slowest = max(latencies)
+    print(f"single upload:            {single:.2f}s")
+    print(f"{concurrency} concurrent uploads:  {total:.2f}s total, slowest {slowest:.2f}s")
+    print(f"serial would take about:  {single * concurrency:.2f}s")
+    print(f"streamed upload:          first line {first_line or float('nan'):.2f}s, summary {streamed:.2f}s")
+
+    # Allow generous slack for parse work, which does use real CPU.
+    failures = []
+    if total >= max(2.0 * single, single + 1.0):
+        failures.append("uploads are being serialized")
+    if first_line is None or first_line > streamed - latency / 2:
+        failures.append("the first line is not streamed ahead of the summary")
+    print("PASS" if not failures else "FAIL: " + "; ".join(failures))
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds per fake LLM call")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.concurrency, args.pages, args.latency)))
@@ -0,0 +1,204 @@
+# summary_store_check.py
+#
+# Checks the stored-summary endpoints in-process (fake LLM backend): uploads
+# get a real, stable id; /api/summaries/{id} returns what the upload
+# returned; a matching If-None-Match gets a 304 and a changed summary (moved
+# folder, lazily expanded section) a new ETag; the same file summarized under
+# a changed pipeline keeps its id and row; cursor pages cover every summary
+# exactly once; /api/folders counts them.
+#
+# Then fills a file-backed SummaryStore with --rows summaries and times the
+# first, a deep and a per-folder listing page, the folder list and a single
+# fetch, and checks SQLite answers each listing from an index (no table
+# scan, no sort).
+#
+#   python scripts/summary_store_check.py --rows 1000000 --max-ms 20
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ["NOTERAG_LLM_BACKEND"] = "fake"
+os.environ["NOTERAG_FAKE_LATENCY"] = "0"
+os.environ["NOTERAG_CACHE_PATH"] = ""
+os.environ["NOTERAG_DEDUP_THRESHOLD"] = "0"
+os.environ["NOTERAG_CHUNK_CACHE_PATH"] = ""
+os.environ["NOTERAG_CHUNK_CACHE_MEMORY_ITEMS"] = "0"
+os.environ["NOTERAG_INDEX_DIR"] = ""
+os.environ["NOTERAG_CORPUS_PATH"] = ""
+os.environ["NOTERAG_SUMMARY_STORE_PATH"] = ""
+
+import httpx
+
+import backend.api as api
+from backend.api import app, expand_flight
+from backend.summary_store import SummaryStore, encode_cursor
+from synthetic_pdf import make_pdf
+
+
+async def check_api() -> list:
+    failures = []
+
+    def expect(ok: bool, what: str) -> None:
+        print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+        if not ok:
+            failures.append(what)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=None) as client:
+        async def upload(pdf: bytes, **params) -> dict:
+            r = await client.post("/api/simplify_pdf", params=params,
+                                  files={"file": ("handout.pdf", pdf, "application/pdf")})
+            r.raise_for_status()
+            return r.json()["summaries"][0]
+
+        pdfs = [make_pdf(2, seed=i) for i in range(7)]
+        made = [await upload(pdf, folder=["Bio", "Math", ""][i % 3]) for i, pdf in enumerate(pdfs)]
+        ids = [s["id"] for s in made]
+        expect(len(set(ids)) == len(ids), f"every upload gets its own id: {ids}")
+
+        again = await upload(pdfs[0])
+        expect(again["id"] == ids[0] and again["folder"] == "Bio", "same file again: same id, folder kept")
+
+        r = await client.get(f"/api/summaries/{ids[0]}")
+        etag = r.headers.get("etag")
+        stored = r.json()
+        expect(r.status_code == 200 and all(stored[k] == made[0][k] for k in made[0]), "fetch returns the upload's object")
+        r = await client.get(f"/api/summaries/{ids[0]}", headers={"If-None-Match": etag})
+        expect(r.status_code == 304 and not r.content and r.headers.get("etag") == etag, "matching If-None-Match -> 304")
+
+        moved = await upload(pdfs[0], folder="Chem")
+        r = await client.get(f"/api/summaries/{ids[0]}", headers={"If-None-Match": etag})
+        expect(moved["id"] == ids[0] and r.status_code == 200 and r.json()["folder"] == "Chem"
+               and r.headers.get("etag") != etag, "moved to another folder -> new ETag, 200")
+
+        fingerprint = api.pipeline_fingerprint
+        api.pipeline_fingerprint = lambda: fingerprint() + "-changed"
+        try:
+            redone = await upload(pdfs[1])
+        finally:
+            api.pipeline_fingerprint = fingerprint
+        expect(redone["id"] == ids[1] and redone["doc"] != made[1]["doc"] and redone["folder"] == "Math",
+               "same file under a changed pipeline: same id, row updated in place")
+
+        lazy = await upload(make_pdf(2, seed=99), lazy="true")
+        r = await client.get(f"/api/summaries/{lazy['id']}")
+        before = r.headers.get("etag")
+        (await client.get(f"/api/expand/{lazy['doc']}/0")).raise_for_status()
+        while expand_flight.stats()["in_flight"]:
+            await asyncio.sleep(0.01)
+        r = await client.get(f"/api/summaries/{lazy['id']}", headers={"If-None-Match": before})
+        expect(r.status_code == 200 and r.json()["expanded"][0] and r.headers.get("etag") != before,
+               "lazily expanded section -> stored summary updated")
+
+        seen, cursor, pages = [], None, 0
+        while True:
+            r = await client.get("/api/summaries", params={"limit": 3, **({"cursor": cursor} if cursor else {})})
+            body = r.json()
+            seen += [s["id"] for s in body["summaries"]]
+            pages += 1
+            cursor = body["next_cursor"]
+            if not cursor:
+                break
+        expect(sorted(seen) == sorted(set(ids + [lazy["id"]])) and "expanded" not in body["summaries"][-1],
+               f"{pages} cursor pages list each summary once, without expanded sections")
+        r = await client.get("/api/summaries", params={"limit": 3})
+        r2 = await client.get("/api/summaries", params={"limit": 3}, headers={"If-None-Match": r.headers["etag"]})
+        expect(r2.status_code == 304, "unchanged listing page -> 304")
+
+        bio = (await client.get("/api/summaries", params={"folder": "Bio"})).json()["summaries"]
+        folders = {f["name"]: f["summaries"] for f in (await client.get("/api/folders")).json()["folders"]}
+        expect({s["folder"] for s in bio} == {"Bio"} and folders == {"": 3, "Bio": 2, "Math": 2, "Chem": 1},
+               f"folder listing and counts: {folders}")
+        expect((await client.get("/api/summaries", params={"cursor": "not-a-cursor"})).status_code == 400,
+               "bad cursor -> 400")
+        expect((await client.get("/api/summaries/999999")).status_code == 404, "unknown id -> 404")
+    return failures
+
+
+def fake_summary(n: int, rng: random.Random) -> dict:
+    words = "memory load visual chapter theory attention model reading practice evidence".split()
+    line = lambda k: " ".join(rng.choice(words) for _ in range(k)).capitalize() + "."
+    return {
+        "title": f"Lecture {n}: {line(4)}",
+        "topic": rng.choice(words),
+        "keywords": rng.sample(words, 3),
+        "lines": [f"{i}. {line(14)}" for i in range(1, 4)],
+        "expanded": [[f"{i}.{j} {line(20)}" for j in range(1, 4)] for i in range(1, 4)],
+        "compression": None,
+        "chunk_reuse": None,
+    }
+
+def timed(fn, repeat: int = 20) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times)
+
+def check_scale(args) -> list:
+    failures = []
+    rng = random.Random(0)
+    folders = [f"Course {i}" for i in range(args.folders)]
+    with tempfile.TemporaryDirectory() as tmp:
+        store = SummaryStore(os.path.join(tmp, "summaries.sqlite3"))
+        started = time.perf_counter()
+        for start in range(0, args.rows, 10000):
+            store.put_many([(f"doc{n}", fake_summary(n, rng), rng.choice(folders), f"sha{n}")
+                            for n in range(start, min(start + 10000, args.rows))])
+        fill = time.perf_counter() - started
+        size = os.path.getsize(os.path.join(tmp, "summaries.sqlite3"))
+        print(f"{args.rows} summaries stored in {fill:.0f}s ({size / 2**20:.0f} MB)")
+
+        page, _ = store.list(limit=50)
+        mid = store.get(args.rows // 2)[0]
+        deep = encode_cursor(mid["created_at"], mid["id"])
+        results = {
+            "first page": timed(lambda: store.list(limit=50)),
+            "deep page": timed(lambda: store.list(limit=50, cursor=deep)),
+            "folder page": timed(lambda: store.list(folders[0], limit=50)),
+            "deep folder page": timed(lambda: store.list(folders[0], limit=50, cursor=deep)),
+            "folders": timed(store.folders),
+            "fetch one": timed(lambda: store.get(rng.randint(1, args.rows))),
+            "etag only": timed(lambda: store.etag(rng.randint(1, args.rows))),
+        }
+        for name, ms in results.items():
+            print(f"  {name:<17} {ms:7.2f} ms")
+        slowest = max(results.values())
+        if slowest > args.max_ms:
+            failures.append(f"slowest query {slowest:.1f} ms > {args.max_ms} ms")
+
+        sql = ("EXPLAIN QUERY PLAN SELECT id FROM summaries WHERE {} ORDER BY created_at DESC, id DESC LIMIT 51")
+        for where, params in [("1", ()), ("(created_at, id) < (?, ?)", (0.0, 0)),
+                              ("folder = ? AND (created_at, id) < (?, ?)", ("x", 0.0, 0))]:
+            plan = " | ".join(row[-1] for row in store._db.execute(sql.format(where), params))
+            ok = "USING" in plan and "TEMP B-TREE" not in plan
+            print(f"  {'ok  ' if ok else 'FAIL'} plan for WHERE {where}: {plan}")
+            if not ok:
+                failures.append(f"listing WHERE {where} is not index-ordered")
+    return failures
+
+
+async def main(args) -> int:
+    print("API:")
+    failures = await check_api()
+    print("Scale:")
+    failures += check_scale(args)
+    print("PASS" if not failures else "FAIL: " + "; ".join(failures))
+    return 0 if not failures else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--folders", type=int, default=50)
+    parser.add_argument("--max-ms", type=float, default=20.0, help="slowest listing/fetch allowed")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args)))
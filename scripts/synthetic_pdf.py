@@ -0,0 +1,40 @@
+# synthetic_pdf.py
+#
+# Builds lecture-handout-like PDFs of a chosen size for load tests and
+# benchmarks, so nobody needs a real file on their Desktop.
+
+import io
+import random
+from typing import Dict, Optional
+
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+WORDS = (
+    "attention memory learning working cognitive load visual representation "
+    "student teacher lecture example concept model theory evidence method "
+    "result practice focus reading summary chapter section figure data study"
+).split()
+
+def make_pdf(pages: int, seed: int = 0, lines_per_page: int = 40, edits: Optional[Dict[int, str]] = None) -> bytes:
+    """
+    Returns the bytes of a `pages`-page PDF filled with pseudo-random sentences.
+    Different seeds give different bytes (and so different cache keys).
+    `edits` maps 0-based page numbers to an extra line for that page, to
+    simulate a small edit; every other page stays identical.
+    """
+    rng = random.Random(seed)
+    buf = io.BytesIO()
+    pdf = canvas.Canvas(buf, pagesize=letter)
+    for page in range(pages):
+        y = 750
+        for _ in range(lines_per_page):
+            sentence = " ".join(rng.choice(WORDS) for _ in range(12)).capitalize() + "."
+            pdf.drawString(40, y, sentence)
+            y -= 17
+        if edits and page in edits:
+            pdf.drawString(40, y, edits[page])
+        pdf.drawString(40, 30, f"Page {page + 1}")
+        pdf.showPage()
+    pdf.save()
+    return buf.getvalue()
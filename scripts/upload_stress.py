@@ -0,0 +1,165 @@
+# upload_stress.py
+#
+# Starts the API under uvicorn (fake LLM backend) with a small in-flight
+# upload budget, fires --concurrency large PDF uploads at it at once, and
+# checks that the server's peak memory grows by no more than the budget
+# plus a fixed per-request allowance, not by concurrency × file size. Peak
+# is VmHWM of the server process plus each parse worker, so the figure is an
+# upper bound on what was ever resident at once. Also checks that an
+# oversized upload is refused from its Content-Length, or once the limit
+# has arrived when it is sent chunked without one, and that a non-PDF is
+# refused from its first bytes.
+#
+#   python scripts/upload_stress.py --concurrency 16 --size-mb 24 --budget-mb 64
+#
+# Linux only (reads /proc).
+
+import argparse
+import asyncio
+import io
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+from pypdf import PdfReader, PdfWriter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_pdf import make_pdf
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+MB = 1024 * 1024
+
+
+def padded_pdf(size: int, seed: int) -> bytes:
+    # a short handout with an incompressible attachment, so the file is big
+    # but only a few pages of text need extracting
+    writer = PdfWriter(clone_from=PdfReader(io.BytesIO(make_pdf(3, seed=seed))))
+    writer.add_attachment("data.bin", os.urandom(size))
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def hwm_bytes(pid: int) -> int:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+def descendants(pid: int):
+    out = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        with open(f"/proc/{pid}/task/{task}/children") as f:
+            for child in f.read().split():
+                out.append(int(child))
+                out.extend(descendants(int(child)))
+    return out
+
+def peak_bytes(pid: int) -> int:
+    # sum of per-process peaks >= the peak of the sum
+    return sum(hwm_bytes(p) for p in [pid, *descendants(pid)])
+
+
+async def main(args) -> int:
+    port = free_port()
+    env = {
+        **os.environ,
+        "NOTERAG_LLM_BACKEND": "fake",
+        "NOTERAG_FAKE_LATENCY": "0.05",
+        "NOTERAG_CACHE_PATH": "",
+        "NOTERAG_CACHE_MEMORY_ITEMS": "0",
+        "NOTERAG_CHUNK_CACHE_PATH": "",
+        "NOTERAG_CHUNK_CACHE_MEMORY_ITEMS": "0",
+        "NOTERAG_DEDUP_THRESHOLD": "0",
+        "NOTERAG_INDEX_DIR": "",
+        "NOTERAG_CORPUS_PATH": "",
+        "NOTERAG_SUMMARY_STORE_PATH": "",
+        "NOTERAG_MAX_UPLOAD_BYTES": str((args.size_mb + 1) * MB),
+        "NOTERAG_UPLOAD_INFLIGHT_BYTES": str(args.budget_mb * MB),
+        "NOTERAG_UPLOAD_WAIT": "120",           # queue, don't refuse: every upload should get through
+        "NOTERAG_PARSE_WORKERS": "2",
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.api:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+    base = f"http://127.0.0.1:{port}"
+    try:
+        async with httpx.AsyncClient(base_url=base, timeout=None) as client:
+            for _ in range(100):
+                try:
+                    await client.get("/api/cache/stats")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+
+            pdfs = [padded_pdf(args.size_mb * MB - 64 * 1024, seed=i) for i in range(args.concurrency + 1)]
+
+            async def post(pdf: bytes, name: str = "handout.pdf") -> httpx.Response:
+                return await client.post("/api/simplify_pdf", files={"file": (name, pdf, "application/pdf")})
+
+            (await post(pdfs[-1])).raise_for_status()            # warm up imports and the parse pool
+            baseline = peak_bytes(server.pid)
+
+            started = time.perf_counter()
+            responses = await asyncio.gather(*(post(pdf) for pdf in pdfs[:-1]))
+            wall = time.perf_counter() - started
+            peak = peak_bytes(server.pid)
+            stats = (await client.get("/api/cache/stats")).json()["uploads"]
+
+            too_big = await post(b"%PDF-1.4\n" + b"0" * ((args.size_mb + 2) * MB))
+            not_pdf = await post(b"PK\x03\x04 definitely a zip", "notes.pdf")
+
+            async def chunked_body():
+                yield (b'--xx\r\nContent-Disposition: form-data; name="file"; filename="handout.pdf"\r\n'
+                       b"Content-Type: application/pdf\r\n\r\n%PDF-1.4\n")
+                for _ in range(args.size_mb + 2):
+                    yield b"0" * MB
+                yield b"\r\n--xx--\r\n"
+            try:
+                chunked = (await client.post("/api/simplify_pdf", content=chunked_body(),
+                                             headers={"Content-Type": "multipart/form-data; boundary=xx"})).status_code
+            except httpx.TransportError:
+                chunked = "connection closed"
+    finally:
+        server.terminate()
+        server.wait()
+
+    ok = sum(r.status_code == 200 for r in responses)
+    growth = peak - baseline
+    # per request: one copy chunk, the multipart parser's in-memory part, slack
+    allowance = args.budget_mb * MB + args.concurrency * 2 * MB + 64 * MB
+    naive = args.concurrency * args.size_mb * MB
+    print(f"{ok}/{args.concurrency} uploads of {args.size_mb} MB in {wall:.2f}s")
+    print(f"peak memory: {baseline / MB:.0f} MB -> {peak / MB:.0f} MB (+{growth / MB:.0f} MB)")
+    print(f"allowed growth: {allowance / MB:.0f} MB; reading every upload whole: >{naive / MB:.0f} MB")
+    print(f"budget: peak {stats['peak'] / MB:.0f} MB of {stats['limit'] / MB:.0f} MB, rejected {stats['rejected']}")
+    print(f"oversized upload: {too_big.status_code}, chunked: {chunked}, non-PDF upload: {not_pdf.status_code}")
+
+    passed = (
+        ok == args.concurrency
+        and growth <= allowance
+        and stats["peak"] <= stats["limit"]
+        and too_big.status_code == 413
+        and chunked == 413
+        and not_pdf.status_code == 415
+    )
+    print("PASS" if passed else "FAIL")
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--size-mb", type=int, default=24)
+    parser.add_argument("--budget-mb", type=int, default=64)
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args)))